@@ -0,0 +1,1431 @@
+"""
+Бенчмарки горячих путей бота. Работают offline, на синтетических данных.
+
+    python bench.py memory --rows 10000
+    python bench.py load --rows 100000 --sheets 4
+    python bench.py search --rows 100000
+    python bench.py inline --rows 100000
+    python bench.py translate --requests 200
+    python bench.py ratelimit --users 100000
+    python bench.py storage --users 200 --answers 20 --pool 1000
+    python bench.py distractors --rows 100000
+    python bench.py review --cards 50000
+    python bench.py answerlog --events 200000
+    python bench.py render --rows 10000
+    python bench.py sends --chats 30 --questions 6
+    python bench.py webhook --updates 2000 --concurrency 40
+    python bench.py workers --rows 10000 --workers 1 2 4 8
+    python bench.py metrics --updates 5000
+
+    python bench.py suite --json report.json            # сравнить с bench_baseline.json
+    python bench.py suite --save-baseline               # обновить bench_baseline.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import aiohttp
+from datetime import datetime
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.base import BaseSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiohttp import web
+from openpyxl import Workbook
+
+import botenglish as bot
+
+
+HEADERS = ("", "UNIT NO", "PAGE", "DEFINITION", "PoS", "EXAMPLE", "CEF", "IPA", "DUTCH TRANSLATION")
+POS = ("noun", "verb", "adjective", "adverb", "phrase")
+SYLLABLES = tuple(c + v for c in "bdfgklmnprstvz" for v in ("a", "e", "i", "o", "u", "ai", "or"))
+# частые служебные слова, как в настоящих definition/example
+COMMON = ("the", "a", "of", "to", "and", "or", "in", "someone", "something", "is", "that", "with")
+
+
+def _fake_word(rnd: random.Random) -> str:
+    return "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4)))
+
+
+def _fake_sentence(rnd: random.Random, lexicon: list[str], lo: int, hi: int) -> str:
+    return " ".join(
+        rnd.choice(COMMON) if rnd.random() < 0.4 else rnd.choice(lexicon)
+        for _ in range(rnd.randint(lo, hi))
+    )
+
+
+def synthetic_rows(n: int, seed: int = 1) -> list[tuple]:
+    """Строки в том же формате, что и лист vocab.xlsx (без шапки)."""
+    rnd = random.Random(seed)
+    # definition/example пишутся ограниченным словарём, как обычный английский текст
+    lexicon = [_fake_word(rnd) for _ in range(5000)]
+    rows = []
+    for i in range(n):
+        definition = _fake_sentence(rnd, lexicon, 4, 12)
+        example = _fake_sentence(rnd, lexicon, 3, 9)
+        rows.append((
+            " " + _fake_word(rnd).capitalize(),
+            float(1 + i * 12 // n),
+            float(10 + i // 8),
+            definition,
+            rnd.choice(POS),
+            example + ".",
+            rnd.choice(("A1", "A2", "B1", "B2")),
+            "ˈ" + _fake_word(rnd),
+            _fake_word(rnd),
+        ))
+    return rows
+
+
+def write_synthetic_workbook(path: str, n: int, sheets: int = 1) -> list[str]:
+    """Книга с `sheets` листами по n строк; возвращает имена листов."""
+    wb = Workbook(write_only=True)
+    names = []
+    for k in range(sheets):
+        name = f"SHEET {k + 1}"
+        ws = wb.create_sheet(name)
+        ws.append(HEADERS)
+        for row in synthetic_rows(n, seed=k + 1):
+            ws.append(row)
+        names.append(name)
+    wb.save(path)
+    return names
+
+
+def legacy_dict_rows(rows: list[tuple]) -> list[dict]:
+    # то, как слова хранились раньше: dict на строку с ключами из шапки
+    headers = ["WORD", *HEADERS[1:]]
+    out = []
+    for _id, row in enumerate(rows, 1):
+        item = {h: row[i] for i, h in enumerate(headers)}
+        item["ID"] = _id
+        item["UNIT NO"] = int(item["UNIT NO"])
+        for k in ("DEFINITION", "DUTCH TRANSLATION", "PoS", "EXAMPLE"):
+            item[k] = str(item[k]).strip()
+        out.append(item)
+    return out
+
+
+def entry_rows(rows: list[tuple]) -> list[bot.VocabEntry]:
+    out = []
+    for _id, row in enumerate(rows, 1):
+        word = bot._clean_text(row[0])
+        out.append(bot.VocabEntry(
+            id=_id,
+            word=word,
+            unit=int(row[1]),
+            pos=bot._clean_text(row[4]),
+            definition=bot._clean_text(row[3]),
+            dutch=bot._clean_text(row[8]),
+            example=bot._clean_text(row[5]),
+            word_lower=word.lower(),
+        ))
+    return out
+
+
+def _measure(fn, n: int) -> tuple[int, float]:
+    # строки из Excel внутри замера: после загрузки ими владеют только записи
+    tracemalloc.start()
+    rows = synthetic_rows(n)
+    t0 = time.perf_counter()
+    result = fn(rows)
+    elapsed = time.perf_counter() - t0
+    del rows
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size, elapsed
+
+
+def bench_memory(args) -> None:
+    print(f"rows: {args.rows}")
+    for name, fn in (("dict rows", legacy_dict_rows), ("VocabEntry", entry_rows)):
+        size, elapsed = _measure(fn, args.rows)
+        print(f"{name:12s} {size / 1024 / 1024:8.2f} MiB  {size / args.rows:7.1f} B/word  {elapsed * 1000:8.1f} ms")
+
+
+def _load_streaming(path: str, sheet_names: list[str], chunk_size: int) -> bot.VocabIndex:
+    index = bot.VocabIndex()
+    for chunk in bot.iter_vocab_chunks(path, sheet_names, chunk_size=chunk_size):
+        index.extend(chunk)
+    return index
+
+
+def _peak_overhead(fn, *args) -> tuple[int, int]:
+    # сколько памяти сверх итогового индекса понадобилось во время загрузки
+    tracemalloc.start()
+    result = fn(*args)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak - size, size
+
+
+def bench_load(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "vocab.xlsx")
+        t0 = time.perf_counter()
+        names = write_synthetic_workbook(path, args.rows, sheets=args.sheets)
+        print(f"workbook: {args.sheets} x {args.rows} rows, {os.path.getsize(path) / 1024 / 1024:.1f} MiB "
+              f"(generated in {time.perf_counter() - t0:.1f}s)")
+
+        # peak extra не должен расти вместе с --rows: он ограничен размером пачки
+        first = names[:1]
+        for chunk_size in (500, bot.VOCAB_CHUNK_SIZE, 10000):
+            extra, size = _peak_overhead(_load_streaming, path, first, chunk_size)
+            print(f"1 sheet, chunk={chunk_size:<5d}: index {size / 1024 / 1024:7.1f} MiB, "
+                  f"peak extra {extra / 1024 / 1024:5.1f} MiB")
+
+        t0 = time.perf_counter()
+        index = _load_streaming(path, first, bot.VOCAB_CHUNK_SIZE)
+        print(f"1 sheet parse: {time.perf_counter() - t0:.2f}s ({len(index.vocab)} words)")
+
+        if args.sheets > 1:
+            t0 = time.perf_counter()
+            total = 0
+            for name in names:
+                total += len(_load_streaming(path, [name], bot.VOCAB_CHUNK_SIZE).vocab)
+            print(f"{args.sheets} sheets one by one: {time.perf_counter() - t0:.2f}s ({total} words)")
+
+            t0 = time.perf_counter()
+            index = _load_streaming(path, names, bot.VOCAB_CHUNK_SIZE)
+            print(f"{args.sheets} sheets in parallel: {time.perf_counter() - t0:.2f}s ({len(index.vocab)} words)")
+
+
+def _linear_find(vocab: list[bot.VocabEntry], q: str) -> list[bot.VocabEntry]:
+    # старый /find: подстрока в WORD, первые 30 по порядку файла
+    q = q.strip().lower()
+    return [it for it in vocab if q in it.word_lower][:30]
+
+
+def _time_per_call(fn, *args, min_time: float = 0.2) -> float:
+    n = 0
+    t0 = time.perf_counter()
+    while True:
+        fn(*args)
+        n += 1
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time:
+            return elapsed / n
+
+
+def bench_search(args) -> None:
+    vocab = entry_rows(synthetic_rows(args.rows))
+    t0 = time.perf_counter()
+    index = bot.VocabIndex(vocab)
+    print(f"rows: {args.rows}, index built in {time.perf_counter() - t0:.2f}s, "
+          f"{len(index.search.sorted_tokens)} distinct tokens")
+
+    word = vocab[len(vocab) // 2].word_lower
+    queries = {
+        "exact word": word,
+        "prefix": word[:4],
+        "substring": word[2:6],
+        "typo": word[:2] + word[3:] if len(word) > 5 else word + "x",
+        "two tokens": f"{word} {vocab[len(vocab) // 2].definition.split()[0]}",
+        "1 letter": word[:1],
+        "stop word": "the",
+        "miss": "qqqzzz",
+    }
+    print(f"{'query':12s} {'linear scan':>12s} {'VocabSearch':>12s}  hits")
+    for name, q in queries.items():
+        lin = _time_per_call(_linear_find, vocab, q)
+        eng = _time_per_call(index.search.search, q, 30)
+        hits = len(index.search.search(q, 30))
+        print(f"{name:12s} {lin * 1e6:10.0f}us {eng * 1e6:10.0f}us  {hits:3d}  ({q!r})")
+
+
+def _install_vocab(vocab: list[bot.VocabEntry]) -> bot.VocabIndex:
+    index = bot.VocabIndex(vocab)
+    bot.apply_vocab_state((index.vocab, index.by_id, index, None))
+    return index
+
+
+def bench_inline(args) -> None:
+    vocab = entry_rows(synthetic_rows(args.rows))
+    _install_vocab(vocab)
+
+    # поток "нажатий клавиш": каждый пользователь набирает слово по букве,
+    # слова берём с перекосом к началу списка, как популярные
+    rnd = random.Random(7)
+    stream = []
+    for _ in range(args.users):
+        word = vocab[min(int(rnd.expovariate(1 / 300)), len(vocab) - 1)].word_lower
+        stream.extend(word[:i] for i in range(1, len(word) + 1))
+
+    for label, offset in (("first page", 0), ("next page", bot.INLINE_PAGE_SIZE)):
+        bot.INLINE_CACHE.clear()
+        bot.INLINE_CACHE.hits = bot.INLINE_CACHE.misses = 0
+        t0 = time.perf_counter()
+        for q in stream:
+            bot.inline_page(q, offset)
+        elapsed = time.perf_counter() - t0
+        hits, misses = bot.INLINE_CACHE.hits, bot.INLINE_CACHE.misses
+        print(f"{label:10s}: {len(stream)} queries, {len(stream) / elapsed:8.0f} q/s, "
+              f"cache hit rate {hits / max(1, hits + misses):.0%}")
+
+
+class StubMyMemory:
+    """Локальная заглушка MyMemory: считает запросы и одновременность, отвечает с задержкой."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.peers: set[tuple] = set()  # адреса клиентов = сколько было TCP-соединений
+        self.runner: web.AppRunner | None = None
+        self.url = ""
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        self.peers.add(request.transport.get_extra_info("peername"))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            q = request.query.get("q", "")
+            return web.json_response({"responseData": {"translatedText": f"hy:{q}"}})
+        finally:
+            self.active -= 1
+
+    async def __aenter__(self) -> "StubMyMemory":
+        app = web.Application()
+        app.router.add_get("/get", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}/get"
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.runner.cleanup()
+
+
+class FakeBotAPI:
+    """
+    Локальный Bot API: считает вызовы по методам и, как настоящий, отвечает
+    429 с retry_after, если чат получает сообщения быстрее chat_rate.
+    """
+
+    def __init__(self, chat_rate: float = 1.0, chat_burst: float = 3, retry_after: int = 1):
+        self.limiter = bot.RateLimiter(chat_rate, chat_burst)
+        self.retry_after = retry_after
+        self.calls: dict[str, int] = {}
+        self.too_many = 0
+        self.message_id = 0
+        self.runner: web.AppRunner | None = None
+        self.url = ""
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if "chat_id" not in data:
+            return web.json_response({"ok": True, "result": True})
+
+        chat_id = int(data["chat_id"])
+        if self.limiter.hit(chat_id) > 0:
+            self.too_many += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+        self.message_id += 1
+        return web.json_response({"ok": True, "result": {
+            "message_id": self.message_id, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": data.get("text", ""),
+        }})
+
+    async def __aenter__(self) -> "FakeBotAPI":
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.runner.cleanup()
+
+
+async def _fetch_new_session(url: str, text: str) -> str:
+    # как было раньше: своя сессия (и своё соединение) на каждый запрос
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url, params={"q": text, "langpair": "en|hy"}, timeout=25) as r:
+            r.raise_for_status()
+            data = await r.json()
+    return data["responseData"]["translatedText"]
+
+
+async def _bench_translate(args) -> None:
+    async with StubMyMemory() as stub:
+        bot.MYMEMORY_URL = stub.url
+        # глобальный лимит на MyMemory (2/с) здесь мерил бы сам себя — снимаем
+        bot.TR_GLOBAL_BUCKET = bot.TokenBucket(1e9, 1e9)
+
+        for label, fetch in (
+            ("new session per call", lambda i: _fetch_new_session(stub.url, f"w{i}")),
+            ("shared session", lambda i: bot.fetch_mymemory(f"w{i}", "en")),
+        ):
+            lat = []
+            stub.peers.clear()
+            for i in range(args.requests):
+                t0 = time.perf_counter()
+                await fetch(i)
+                lat.append(time.perf_counter() - t0)
+            lat.sort()
+            print(f"{label:22s}: p50 {lat[len(lat) // 2] * 1e3:6.2f} ms, "
+                  f"p99 {lat[int(len(lat) * 0.99)] * 1e3:6.2f} ms, {len(stub.peers)} connections")
+        # общая сессия держит keep-alive: последовательные запросы идут по одному соединению
+        assert len(stub.peers) == 1, f"shared session opened {len(stub.peers)} connections"
+
+        # всплеск: 100 одновременных /tr при задержке upstream 50 мс
+        stub.delay = 0.05
+        stub.max_active = 0
+        t0 = time.perf_counter()
+        await asyncio.gather(*(bot.fetch_mymemory(f"burst{i}", "en") for i in range(100)))
+        print(f"burst of 100: {time.perf_counter() - t0:.2f}s, "
+              f"max concurrent upstream requests {stub.max_active} (limit {bot.TR_MAX_CONCURRENCY})")
+        assert stub.max_active <= bot.TR_MAX_CONCURRENCY, "TR_SEMAPHORE let through too many requests"
+
+        # класс из 50 учеников одновременно переводит одно и то же слово
+        before = stub.requests
+        await asyncio.gather(*(bot.fetch_mymemory("boring", "en") for _ in range(50)))
+        print(f"50 identical, no coalescing:   {stub.requests - before} upstream requests")
+        assert stub.requests - before == 50
+        before = stub.requests
+        await asyncio.gather(*(bot.translate_to_armenian("boring") for _ in range(50)))
+        print(f"50 identical, translate_to_armenian: {stub.requests - before} upstream requests")
+        assert stub.requests - before == 1, "identical in-flight /tr were not coalesced"
+
+        await bot.close_http_session()
+
+
+def bench_translate(args) -> None:
+    asyncio.run(_bench_translate(args))
+
+
+def bench_ratelimit(args) -> None:
+    rate, burst = bot.RATE_LIMITS["tr"]
+    limiter = bot.RateLimiter(rate, burst)
+
+    # args.users разных пользователей, по 100 сообщений в секунду (виртуальное время)
+    tracemalloc.start()
+    now = 0.0
+    max_len = 0
+    t0 = time.perf_counter()
+    for uid in range(args.users):
+        now += 0.01
+        limiter.hit(uid, now=now)
+        max_len = max(max_len, len(limiter))
+    elapsed = time.perf_counter() - t0
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{args.users} distinct users: max buckets alive {max_len}, "
+          f"peak {peak / 1024:.0f} KiB, {elapsed / args.users * 1e6:.2f} us/hit")
+
+    async def handler(event, data):
+        return None
+
+    mw = bot.RateLimitMiddleware({"heavy": bot.RateLimiter(1e9, 1e9)})
+    user = type("User", (), {"id": 1})()
+    flagged = {"handler": HandlerObject(callback=handler, flags={"rate_limit": "heavy"}), "event_from_user": user}
+    plain = {"handler": HandlerObject(callback=handler, flags={}), "event_from_user": user}
+
+    async def run(data, n):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            await mw(handler, None, data)
+        return (time.perf_counter() - t0) / n
+
+    async def direct(n):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            await handler(None, {})
+        return (time.perf_counter() - t0) / n
+
+    n = 200_000
+    base = asyncio.run(direct(n))
+    print(f"handler call alone        {base * 1e6:.2f} us")
+    print(f"middleware, no flag       {asyncio.run(run(plain, n)) * 1e6:.2f} us")
+    print(f"middleware, rate-limited  {asyncio.run(run(flagged, n)) * 1e6:.2f} us")
+
+
+def _answer_lists(data: dict, i: int) -> None:
+    # прежняя раскладка: пул и порядок списками, тексты вариантов, список ошибок
+    data["quiz_pos"] = i + 1
+    data["quiz_options"] = ["a definition of the first option"] * 3
+    if i % 3 == 0:
+        data["quiz_wrong"].append(data["quiz_order"][i])
+
+
+def _answer_compact(data: dict, i: int) -> None:
+    sess = data["quiz"]
+    sess["pos"] = i + 1
+    sess["cur"] = sess["opts"][0] = bot.word_key(f"word{i}", "a definition")
+    if i % 3 == 0 and len(sess["missed"]) < bot.QUIZ_MISSED_SHOWN:
+        sess["missed"].append(sess["cur"])
+
+
+async def _quiz_answers(storage, users: int, answers: int, pool_size: int,
+                        compact: bool, sync: bool = False) -> tuple[list[float], int]:
+    """
+    Ответы на тест. Прежняя раскладка — как было в quiz_answer/send_next_question:
+    3 get_data + 3 set_data на ответ; компактная — 1 get_data + 1 set_data.
+    sync=True — каждый ответ сразу коммитится (как хранилище без пакетной записи).
+    """
+    pool = list(range(1, pool_size + 1))
+    lat: list[float] = []
+    size = 0
+
+    async def one_user(uid: int) -> None:
+        nonlocal size
+        key = StorageKey(bot_id=1, chat_id=uid, user_id=uid)
+        await storage.set_state(key, bot.QuizState.in_quiz)
+        if compact:
+            sess = {"src": ["u", 1, 2, 3], "seed": uid, "mode": "wd", "n": answers,
+                    "pos": 0, "score": 0, "missed": [],
+                    "cur": 0, "opts": [bot.word_key(f"option{j}", "a definition") for j in range(3)]}
+            await storage.set_data(key, {"quiz": sess})
+        else:
+            await storage.set_data(key, {"quiz_pool_ids": pool, "quiz_order": pool[:answers], "quiz_pos": 0,
+                                         "quiz_wrong": [], "quiz_label": "Units: 1, 2, 3", "quiz_mode": "wd"})
+        for i in range(answers):
+            t0 = time.perf_counter()
+            if compact:
+                data = await storage.get_data(key)
+                _answer_compact(data, i)
+                await storage.set_data(key, data)
+            else:
+                for _ in range(3):
+                    data = await storage.get_data(key)
+                    _answer_lists(data, i)
+                    await storage.set_data(key, data)
+            if sync:
+                await storage.flush()
+            lat.append(time.perf_counter() - t0)
+            await asyncio.sleep(0)
+        size = len(json.dumps(await storage.get_data(key), separators=(",", ":")))
+
+    await asyncio.gather(*(one_user(uid) for uid in range(users)))
+    return lat, size
+
+
+async def _bench_storage(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "fsm.sqlite3")
+        variants = (
+            ("MemoryStorage", MemoryStorage, False),
+            ("SQLite, batched", lambda: bot.SQLiteStorage(path), False),
+            ("SQLite, per answer", lambda: bot.SQLiteStorage(path + ".1"), True),
+        )
+        for compact in (False, True):
+            print("compact session (seed + pool descriptor)" if compact
+                  else f"ID lists in state (pool of {args.pool})")
+            for name, factory, sync in variants:
+                storage = factory()
+                t0 = time.perf_counter()
+                lat, size = await _quiz_answers(storage, args.users, args.answers, args.pool, compact, sync)
+                await storage.close()
+                elapsed = time.perf_counter() - t0
+                lat.sort()
+                print(f"  {name:18} {len(lat) / elapsed:8.0f} answers/s  "
+                      f"p50 {lat[len(lat) // 2] * 1e6:8.1f} us  p99 {lat[int(len(lat) * 0.99)] * 1e6:8.1f} us  "
+                      f"state {size} B")
+
+        # после перезапуска состояние на месте
+        storage = bot.SQLiteStorage(path)
+        key = StorageKey(bot_id=1, chat_id=0, user_id=0)
+        state, data = await storage.get_state(key), await storage.get_data(key)
+        await storage.close()
+        print(f"after reopen: state={state} pos={data['quiz']['pos']}")
+
+
+def _legacy_pick_options(correct_id: int, pool_ids: list[int]) -> list[int]:
+    # старый pick_options: копия пула без правильного на каждый вопрос
+    others = [x for x in pool_ids if x != correct_id and x in bot.VOCAB_BY_ID]
+    options = [correct_id, *random.sample(others, 2)]
+    random.shuffle(options)
+    return options
+
+
+def _hardness(index: bot.VocabIndex, pick, questions: list[int]) -> tuple[float, float]:
+    # доля вариантов той же части речи и среднее число общих слов definition с правильным
+    same_pos = shared = total = 0
+    for q in questions:
+        it = index.by_id[q]
+        toks = set(bot._tokens(it.definition))
+        for o in pick(q):
+            if o == q:
+                continue
+            other = index.by_id[o]
+            same_pos += other.pos == it.pos
+            shared += len(toks & set(bot._tokens(other.definition)))
+            total += 1
+    return same_pos / total, shared / total
+
+
+def bench_distractors(args) -> None:
+    vocab = entry_rows(synthetic_rows(args.rows))
+    index = bot.VocabIndex()
+    index.extend(vocab)
+    index.search.finish()
+    t0 = time.perf_counter()
+    index._build_neighbours()
+    print(f"rows: {args.rows}, neighbours for {len(index.quiz_ids)} quiz words in "
+          f"{time.perf_counter() - t0:.2f}s, {len(index.neighbours) * 4 / 1024 / 1024:.1f} MiB")
+    bot.apply_vocab_state((index.vocab, index.by_id, index, None))
+
+    # снимок: соседи лежат в нём, при загрузке повторно не считаются
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "vocab.xlsx")
+        with open(path, "wb") as f:
+            f.write(b"fake")
+        snap = path + ".snapshot"
+        bot.save_vocab_snapshot(path, [None], index.vocab, snap, index.neighbours)
+        rows, neighbours, _search, _keys = bot.load_vocab_snapshot(path, [None], snap)
+        for name, nb in (("from snapshot", neighbours), ("rebuilt", None)):
+            fresh = bot.VocabIndex()
+            fresh.extend(rows)
+            t0 = time.perf_counter()
+            fresh.finish(nb)
+            print(f"finish(), neighbours {name:13s}: {time.perf_counter() - t0:.2f}s")
+
+    rnd = random.Random(3)
+    whole = ["r", 1, index.max_id]
+    pool = bot.QuizPool(index, whole)
+    pool_ids = [pool.id_at(i) for i in range(len(pool))]
+    questions = [rnd.choice(pool_ids) for _ in range(200)]
+    print(f"whole-book pool: {len(pool)} words")
+
+    it = iter(questions * 1000)
+    legacy = _time_per_call(lambda: _legacy_pick_options(next(it), pool_ids), min_time=0.5)
+    print(f"old pick_options (3)      {legacy * 1e6:10.1f} us/question")
+    for k in (3, 5):
+        for hard in (False, True):
+            it = iter(questions * 100000)
+            t = _time_per_call(lambda: pool.options(next(it), k, "wd", hard))
+            print(f"QuizPool k={k} {'hard  ' if hard else 'random'}     {t * 1e6:10.1f} us/question")
+
+    print(f"{'':14s} same PoS  shared def tokens")
+    for name, pick in (
+        ("random", lambda q: pool.options(q, 3, "wd")),
+        ("hard", lambda q: pool.options(q, 3, "wd", hard=True)),
+    ):
+        pos_share, shared = _hardness(index, pick, questions)
+        print(f"{name:14s} {pos_share:7.0%}  {shared:6.2f}")
+
+
+async def _bench_review(args) -> None:
+    rnd = random.Random(5)
+    alive = lambda key: True
+    sched = bot.ReviewScheduler()
+    now = time.time()
+
+    # одна колода на args.cards слов, все уже когда-то отвечены
+    t0 = time.perf_counter()
+    for key in range(1, args.cards + 1):
+        sched.record(1, key, rnd.random() < 0.8, now=now - rnd.uniform(0, 30 * bot.DAY))
+    print(f"{args.cards} cards recorded in {time.perf_counter() - t0:.2f}s")
+    deck = sched.deck(1)
+
+    def naive_next(now: float) -> int | None:
+        # без кучи: минимум по всем карточкам
+        key, card = min(deck.cards.items(), key=lambda kv: kv[1].due)
+        return key if card.due <= now else None
+
+    def answer_next(now: float) -> None:
+        key = sched.next_due(1, alive, now=now)
+        if key is not None:
+            sched.record(1, key, rnd.random() < 0.8, now=now)
+
+    t_naive = _time_per_call(naive_next, now)
+    t_heap = _time_per_call(answer_next, now)
+    print(f"next due card: min() over cards {t_naive * 1e6:9.1f} us, heap next_due + record {t_heap * 1e6:6.1f} us")
+    print(f"heap size {len(deck.heap)} for {len(deck.cards)} cards")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "review.sqlite3")
+        sched.open(path)
+        n = len(sched._dirty)
+        t0 = time.perf_counter()
+        await sched.flush()
+        print(f"flush of {n} dirty cards: {time.perf_counter() - t0:.2f}s (one transaction)")
+
+        for i in range(200):
+            sched.record(1, rnd.randint(1, args.cards), True, now=now)
+        t0 = time.perf_counter()
+        await sched.flush()
+        print(f"flush of 200 dirty cards: {(time.perf_counter() - t0) * 1000:.1f} ms")
+        await sched.close()
+
+        fresh = bot.ReviewScheduler()
+        fresh.open(path)
+        t0 = time.perf_counter()
+        await fresh.load(1)
+        print(f"deck of {args.cards} cards loaded from SQLite in {(time.perf_counter() - t0) * 1000:.0f} ms "
+              f"(in a thread, the event loop is free meanwhile)")
+        await fresh.close()
+
+
+def bench_review(args) -> None:
+    asyncio.run(_bench_review(args))
+
+
+async def _bench_answerlog(args) -> None:
+    rnd = random.Random(9)
+    events = [(rnd.randrange(1000), rnd.randrange(1, 20001), rnd.choice("wd dw".split()),
+               rnd.random() < 0.7, rnd.uniform(1, 15)) for _ in range(args.events)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # как было бы без буфера: INSERT + commit прямо в хендлере
+        db = bot.open_db(os.path.join(tmp, "sync.sqlite3"))
+        db.execute("CREATE TABLE answer_log (ts REAL, user_id INTEGER, word_id INTEGER,"
+                   " mode TEXT, correct INTEGER, latency_ms INTEGER)")
+        n = min(2000, args.events)
+        t0 = time.perf_counter()
+        for user_id, word_id, mode, correct, latency in events[:n]:
+            with db:
+                db.execute("INSERT INTO answer_log VALUES (?, ?, ?, ?, ?, ?)",
+                           (time.time(), user_id, word_id, mode, int(correct), int(latency * 1000)))
+        print(f"INSERT + commit per answer: {(time.perf_counter() - t0) / n * 1e6:8.1f} us in the handler")
+
+        log = bot.AnswerLog()
+        path = os.path.join(tmp, "log.sqlite3")
+        log.open(path)
+        writer = asyncio.create_task(log.run())
+        t0 = time.perf_counter()
+        lat = []
+        for i, ev in enumerate(events):
+            t1 = time.perf_counter()
+            log.append(*ev)
+            lat.append(time.perf_counter() - t1)
+            if i % 100 == 0:
+                await asyncio.sleep(0)  # даём писателю работать, как между апдейтами
+        await log.close()
+        elapsed = time.perf_counter() - t0
+        writer.cancel()
+        lat.sort()
+        print(f"AnswerLog.append:           {lat[len(lat) // 2] * 1e6:8.1f} us in the handler "
+              f"(p99 {lat[int(len(lat) * 0.99)] * 1e6:.1f} us); {len(events)} events written "
+              f"in batches, {len(events) / elapsed:.0f} events/s end to end")
+
+        user_id = events[0][0]
+        t0 = time.perf_counter()
+        await log.hardest_words()
+        print(f"/hard, first call (query over answer_word_stats, in a thread): "
+              f"{(time.perf_counter() - t0) * 1e6:8.1f} us")
+        t = _time_per_call(lambda: log.user_report(user_id))
+        t0 = time.perf_counter()
+        for _ in range(10_000):
+            await log.hardest_words()
+        t += (time.perf_counter() - t0) / 10_000
+        print(f"/stats + /hard from aggregates: {t * 1e6:8.1f} us")
+
+        db = bot.open_db(path)
+
+        def rescan():
+            db.execute("SELECT mode, COUNT(*), SUM(correct), SUM(latency_ms) FROM answer_log"
+                       " WHERE user_id = ? GROUP BY mode", (user_id,)).fetchall()
+            db.execute("SELECT word_key, COUNT(*) AS n, SUM(1 - correct) AS wrong FROM answer_log"
+                       " GROUP BY word_key HAVING n >= 3 ORDER BY (wrong + 1.0) / (n + 2) DESC LIMIT 20").fetchall()
+
+        t = _time_per_call(rescan, min_time=1.0)
+        print(f"/stats + /hard rescanning the log: {t * 1e6:8.1f} us")
+
+        fresh = bot.AnswerLog()
+        t0 = time.perf_counter()
+        fresh.open(path)
+        same = fresh.user_stats == log.user_stats
+        print(f"aggregates reloaded in {(time.perf_counter() - t0) * 1000:.0f} ms, match in-memory: {same}")
+
+
+def bench_answerlog(args) -> None:
+    asyncio.run(_bench_answerlog(args))
+
+
+def bench_render(args) -> None:
+    index = _install_vocab(entry_rows(synthetic_rows(args.rows)))
+    unit_no = max(index.unit_counts, key=index.unit_counts.get)
+    max_page = -(-index.unit_counts[unit_no] // bot.PAGE_SIZE)
+    pages = [(unit_no, p) for p in range(1, max_page + 1)]
+    print(f"rows: {args.rows}, unit {unit_no}: {index.unit_counts[unit_no]} words, {max_page} pages")
+
+    def old_unit_page(unit_no: int, page: int) -> str:
+        # как было: фильтр + срез + format_items на каждый показ
+        items = [it for it in bot.VOCAB if it.unit == unit_no]
+        chunk = items[(page - 1) * bot.PAGE_SIZE:page * bot.PAGE_SIZE]
+        return bot.format_items(chunk)
+
+    def old_units() -> str:
+        counts = {}
+        for it in bot.VOCAB:
+            if it.unit:
+                counts[it.unit] = counts.get(it.unit, 0) + 1
+        return "\n".join(f"/unit {u} : {counts[u]} words" for u in sorted(counts))
+
+    it = iter(pages * 100000)
+    old = _time_per_call(lambda: old_unit_page(*next(it)))
+    def render_all_cold():
+        # все страницы unit-а с пустым кэшем: границы страниц + форматирование каждой
+        bot.RENDER_CACHE.clear()
+        for unit_no, page in pages:
+            bot.render_unit_page(unit_no, page)
+
+    cold = _time_per_call(render_all_cold) / len(pages)
+    it = iter(pages * 100000)
+    warm = _time_per_call(lambda: bot.render_unit_page(*next(it)))
+    print(f"unit page: VOCAB scan {old * 1e6:8.1f} us, first view {cold * 1e6:7.1f} us, "
+          f"cached {warm * 1e6:5.2f} us")
+
+    old = _time_per_call(old_units)
+    bot.RENDER_CACHE.clear()
+    warm = _time_per_call(bot.render_units_list)
+    print(f"/units:    VOCAB scan {old * 1e6:8.1f} us, cached {warm * 1e6:5.2f} us")
+
+    # Bot API вызовов на одно "➡️ Дальше"
+    calls = []
+
+    class FakeMessage:
+        async def answer(self, text, **kw):
+            calls.append(("sendMessage", len(text)))
+
+        async def edit_text(self, text, **kw):
+            calls.append(("editMessageText", len(text)))
+
+    class FakeCallback:
+        def __init__(self, data):
+            self.data, self.message = data, FakeMessage()
+
+        async def answer(self, *a, **kw):
+            calls.append(("answerCallbackQuery", 0))
+
+    async def turn_pages():
+        for unit_no, page in pages:
+            await bot.unitpage_cb(FakeCallback(f"unitpage:{unit_no}:{page}"))
+
+    asyncio.run(turn_pages())
+    new_calls = len(calls) / len(pages)
+    # старый unitpage_cb: answerCallbackQuery + "⏭ Открываю…" + куски по 3500 символов + "Навигация:"
+    old_calls = sum(3 + -(-len(f"📘 Unit header\n\n{old_unit_page(u, p)}") // 3500) for u, p in pages) / len(pages)
+    longest = max(n for _name, n in calls)
+    print(f"API calls per page turn: {old_calls:.1f} -> {new_calls:.1f} (edit in place; longest page {longest} chars)")
+
+
+async def _unmerged_answer(m, texts, reply_markup=None):
+    # как было до объединения: вердикт, правильная пара и вопрос — отдельными сообщениями
+    parts = [p for t in texts[:-1] for p in t.split("\n", 1)] + [texts[-1]]
+    for p in parts[:-1]:
+        await m.answer(p)
+    await m.answer(parts[-1], reply_markup=reply_markup)
+
+
+async def _quiz_over_api(api: FakeBotAPI, chats: int, questions: int, think: float,
+                         scheduler: bot.SendScheduler | None) -> tuple[int, float, float]:
+    """
+    chats пользователей одновременно проходят тест через настоящие хендлеры и Bot API.
+    -> (сколько чатов упало на 429, секунд всего, вызовов API на один ответ)
+    """
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api.url))
+    tg = Bot("42:BENCH", session=session)
+    if scheduler is not None:
+        session.middleware(scheduler)
+    storage = bot.MemoryStorage()
+    failed = 0
+    answer_calls = 0
+
+    async def one_chat(uid: int) -> None:
+        nonlocal failed, answer_calls
+        user = User(id=uid, is_bot=False, first_name="u")
+        chat = Chat(id=uid, type="private")
+
+        def message(text: str) -> Message:
+            return Message(message_id=1, date=datetime.now(), chat=chat, from_user=user, text=text).as_(tg)
+
+        state = FSMContext(storage, bot.StorageKey(bot_id=42, chat_id=uid, user_id=uid))
+        try:
+            await bot.quiz_set_units(message("1-400"), state)
+            sess = (await state.get_data())["quiz"]
+            sess["mode"] = "wd"
+            await state.set_data({"quiz": sess})
+            await bot.quiz_set_count(message(str(questions)), state)
+            for _ in range(questions):
+                await asyncio.sleep(think)
+                cb = CallbackQuery(id="1", from_user=user, chat_instance="c", data="quizans:0",
+                                   message=message("q")).as_(tg)
+                before = sum(api.calls.values())
+                await bot.quiz_answer(cb, state)
+                if chats == 1:
+                    answer_calls += sum(api.calls.values()) - before
+        except TelegramRetryAfter:
+            failed += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one_chat(uid) for uid in range(1, chats + 1)))
+    elapsed = time.perf_counter() - t0
+    await session.close()
+    return failed, elapsed, answer_calls / questions
+
+
+async def _bench_sends(args) -> None:
+    _install_vocab(entry_rows(synthetic_rows(2000)))
+    merged = bot.answer_merged
+    print(f"load: {args.chats} chats x {args.questions} questions, an answer every {args.think}s; "
+          f"fake API allows 1 msg/s per chat (burst 3)")
+    for name, answer, make_scheduler in (
+        ("separate messages, no pacing", _unmerged_answer, lambda: None),
+        ("merged, no pacing", merged, lambda: None),
+        ("merged + SendScheduler", merged, bot.SendScheduler),
+    ):
+        bot.answer_merged = answer
+        try:
+            # вызовов на ответ — один чат, без лимитов; потом нагрузка с лимитами
+            async with FakeBotAPI(chat_rate=1e9) as api:
+                _f, _e, per_answer = await _quiz_over_api(api, 1, args.questions, 0, None)
+            scheduler = make_scheduler()
+            async with FakeBotAPI() as api:
+                failed, elapsed, _ = await _quiz_over_api(api, args.chats, args.questions, args.think, scheduler)
+        finally:
+            bot.answer_merged = merged
+        print(f"{name:30s} API calls/answer {per_answer:4.1f} | load: 429s {api.too_many:4d}, "
+              f"chats failed {failed:3d}/{args.chats}, {elapsed:5.1f}s"
+              + (f", retried {scheduler.retries}" if scheduler else ""))
+        if answer is merged:
+            # ответ на callback + одно склеенное сообщение (итог и следующий вопрос)
+            assert per_answer == 2, f"{name}: {per_answer} API calls per answer, expected 2"
+        if scheduler is not None:
+            assert failed == 0, f"{name}: {failed} chats hit 429 despite SendScheduler"
+            # бюджет чата ниже лимита API — до 429 вообще не доходит
+            assert api.too_many == 0, f"{name}: {api.too_many} 429s despite SendScheduler"
+
+
+def bench_sends(args) -> None:
+    asyncio.run(_bench_sends(args))
+
+
+def _percentiles(lat: list[float]) -> str:
+    lat = sorted(lat)
+    return f"p50 {lat[len(lat) // 2] * 1e3:6.2f} ms, p99 {lat[int(len(lat) * 0.99)] * 1e3:6.2f} ms"
+
+
+async def _bench_webhook(args) -> None:
+    vocab = entry_rows(synthetic_rows(args.rows))
+    _install_vocab(vocab)
+    words = [e.word_lower for e in vocab[:: max(1, len(vocab) // 200)]]
+    texts = ("/start", "/units", "/unit {unit}", "/find {word}")
+
+    async with FakeBotAPI(chat_rate=1e9) as api:
+        tg = Bot("42:BENCH", session=AiohttpSession(api=TelegramAPIServer.from_base(api.url)))
+        dp = bot.Dispatcher(storage=MemoryStorage())
+        dp.include_router(bot.router)
+
+        done: dict[int, float] = {}
+
+        async def track(handler, event, data):
+            try:
+                return await handler(event, data)
+            finally:
+                done[event.update_id] = time.perf_counter()
+
+        dp.update.outer_middleware(track)
+
+        secret = "bench-secret"
+        app, handler = bot.build_webhook_app(dp, tg, secret)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        base = f"http://127.0.0.1:{runner.addresses[0][1]}"
+        url = base + bot.WEBHOOK_PATH
+
+        rnd = random.Random(1)
+        updates = []
+        for i in range(1, args.updates + 1):
+            uid = rnd.randrange(1, args.users + 1)
+            text = rnd.choice(texts).format(unit=rnd.randint(1, 12), word=rnd.choice(words))
+            updates.append({"update_id": i, "message": {
+                "message_id": i, "date": int(time.time()), "text": text,
+                "chat": {"id": uid, "type": "private"},
+                "from": {"id": uid, "is_bot": False, "first_name": "u"},
+            }})
+
+        sent: dict[int, float] = {}
+        http_lat: list[float] = []
+        queue = iter(updates)
+
+        async with aiohttp.ClientSession() as client:
+            async with client.post(url, json=updates[0], headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as r:
+                bad_secret = r.status
+            async with client.get(base + "/healthz") as r:
+                health = (r.status, await r.json())
+
+            # как Telegram: не больше concurrency запросов одновременно
+            async def connection() -> None:
+                for upd in queue:
+                    t0 = sent[upd["update_id"]] = time.perf_counter()
+                    async with client.post(url, json=upd,
+                                           headers={"X-Telegram-Bot-Api-Secret-Token": secret}) as r:
+                        assert r.status == 200, r.status
+                    http_lat.append(time.perf_counter() - t0)
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(connection() for _ in range(args.concurrency)))
+            posted = time.perf_counter() - t0
+            in_flight = handler.in_flight
+            await runner.cleanup()  # как на SIGTERM: дожидается начатых апдейтов
+            elapsed = time.perf_counter() - t0
+
+        handler_lat = [done[i] - sent[i] for i in sent if i in done]
+        print(f"{args.updates} updates from {args.users} users, {args.concurrency} connections, "
+              f"{len(vocab)} words; wrong secret -> {bad_secret}, /healthz -> {health[0]} {health[1]}")
+        print(f"HTTP response : {_percentiles(http_lat)}  (posted in {posted:.2f}s)")
+        print(f"handler done  : {_percentiles(handler_lat)}  "
+              f"({len(handler_lat) / elapsed:.0f} updates/s, {sum(api.calls.values())} Bot API calls)")
+        print(f"shutdown      : {in_flight} in flight at SIGTERM, "
+              f"{args.updates - len(handler_lat)} lost")
+
+
+def bench_webhook(args) -> None:
+    asyncio.run(_bench_webhook(args))
+
+
+class NullSession(BaseSession):
+    """Bot API без сети: каждый вызов сразу «удался» — меряем только свою работу."""
+
+    async def make_request(self, bot, method, timeout=None):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return True
+        return Message(message_id=1, date=datetime.now(), chat=Chat(id=chat_id, type="private"),
+                       text=getattr(method, "text", None))
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+def _private_mb(pid: int) -> tuple[float, float]:
+    """(PSS, своя память) процесса в МБ — по /proc/<pid>/smaps_rollup."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return fields["Pss"] / 1024, (fields["Private_Clean"] + fields["Private_Dirty"]) / 1024
+
+
+def bench_workers(args) -> None:
+    vocab = entry_rows(synthetic_rows(args.rows))
+    _install_vocab(vocab)
+    words = [e.word_lower for e in vocab[:: max(1, len(vocab) // 500)]]
+    # у каждого пользователя — короткая сессия, в пределах лимитов "heavy"
+    rnd = random.Random(1)
+    updates = []
+    for uid in range(1, args.updates // 5 + 1):
+        a = rnd.randint(1, len(vocab) - 40)
+        for text in (f"/range {a} {a + 40}", f"/find {rnd.choice(words)}",
+                     f"/unit {rnd.randint(1, 12)}", "/test", f"{a}-{a + 200}"):
+            updates.append(json.dumps({"update_id": len(updates) + 1, "message": {
+                "message_id": len(updates) + 1, "date": int(time.time()), "text": text,
+                "chat": {"id": uid, "type": "private"},
+                "from": {"id": uid, "is_bot": False, "first_name": "u"},
+            }}).encode())
+
+    # лимиты Bot API тут не при чём — меряем обработку
+    bot.SEND_SCHEDULER = bot.SendScheduler(*(1e9,) * 6)
+    bot.SEND_GLOBAL_RATE = bot.SEND_GLOBAL_BURST = 1e9
+    bot.SEND_GROUP_RATE = bot.SEND_GROUP_BURST = 1e9
+    bot.VOCAB_WATCH_INTERVAL = 0
+
+    print(f"{len(updates)} updates from {args.updates // 5} users, {len(vocab)} words, "
+          f"{os.cpu_count()} CPUs; parent RSS {_private_mb(os.getpid())[0]:.0f} MB PSS")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.workers:
+            bot.DB_PATH = os.path.join(tmp, f"bot{n}.sqlite3")
+            pool = bot.WorkerPool(n, make_bot=lambda: Bot("42:BENCH", session=NullSession()))
+            pool.start()
+            assert pool.wait_ready()
+            mem = [_private_mb(p.pid) for p in pool.processes]
+            # как после /reload: процессы заменяются форкнутыми заново, словарь всё так же общий
+            t0 = time.perf_counter()
+            assert not asyncio.run(pool.rotate())
+            rotated = time.perf_counter() - t0
+            mem_rotated = [_private_mb(p.pid) for p in pool.processes]
+            t0 = time.perf_counter()
+            for raw in updates:
+                pool.dispatch(raw)
+            pool.close()
+            elapsed = time.perf_counter() - t0
+            gc.unfreeze()
+            print(f"{n} workers: {len(updates) / elapsed:7.0f} updates/s | per worker: "
+                  f"PSS {sum(m[0] for m in mem) / n:5.1f} MB, private {sum(m[1] for m in mem) / n:5.1f} MB | "
+                  f"split {min(pool.dispatched)}..{max(pool.dispatched)} | rotate {rotated:.2f}s, "
+                  f"then private {sum(m[1] for m in mem_rotated) / n:5.1f} MB")
+
+
+async def _bench_metrics(args) -> None:
+    vocab = entry_rows(synthetic_rows(2000))
+    _install_vocab(vocab)
+    tg = Bot("42:BENCH", session=NullSession())
+    words = [e.word_lower for e in vocab[::20]]
+    updates = [Update.model_validate({"update_id": i, "message": {
+        "message_id": i, "date": int(time.time()), "text": text,
+        "chat": {"id": i, "type": "private"}, "from": {"id": i, "is_bot": False, "first_name": "u"},
+    }}, context={"bot": tg}) for i, text in enumerate(
+        ("/start" if i % 2 else f"/find {words[i % len(words)]}") for i in range(args.updates))]
+
+    observers = (bot.router.message, bot.router.callback_query, bot.router.inline_query)
+    update_mw = bot.UpdateMetricsMiddleware()
+    dp = bot.Dispatcher(storage=MemoryStorage())
+    dp.include_router(bot.router)
+
+    def set_metrics(on: bool) -> None:
+        for o in observers:
+            if bot.METRICS_MIDDLEWARE in o.middleware:
+                o.middleware.unregister(bot.METRICS_MIDDLEWARE)
+            if on:
+                o.middleware._middlewares.insert(0, bot.METRICS_MIDDLEWARE)  # как при импорте: до rate limit
+        if update_mw in dp.update.outer_middleware:
+            dp.update.outer_middleware.unregister(update_mw)
+        if on:
+            dp.update.outer_middleware(update_mw)
+
+    best = {False: float("inf"), True: float("inf")}
+    for _round in range(args.rounds):
+        for metrics in (False, True):
+            set_metrics(metrics)
+            # rate limit не должен срабатывать: вёдра сбрасываются перед каждым проходом
+            for limiter in bot.RATE_LIMITERS.values():
+                limiter._state.clear()
+            t0 = time.perf_counter()
+            for upd in updates:
+                await dp.feed_update(tg, upd)
+            best[metrics] = min(best[metrics], (time.perf_counter() - t0) / len(updates))
+
+    off, on = best[False], best[True]
+    print(f"{args.updates} updates (/start, /find), best of {args.rounds}: "
+          f"without metrics {off * 1e6:6.1f} us/update, with {on * 1e6:6.1f} us/update "
+          f"(+{(on - off) * 1e6:.1f} us, {(on - off) / off * 100:+.1f}%)")
+
+    n = 100_000
+    t0 = time.perf_counter()
+    for i in range(n):
+        bot.METRICS.observe("bench_seconds", (("handler", "x"),), i * 1e-6)
+    print(f"METRICS.observe: {(time.perf_counter() - t0) / n * 1e9:.0f} ns")
+
+    t0 = time.perf_counter()
+    text = bot.METRICS.render()
+    print(f"/metrics render: {(time.perf_counter() - t0) * 1e3:.2f} ms, "
+          f"{len(text.splitlines())} lines, {len(text)} bytes")
+    print("\n".join(line for line in text.splitlines() if line.startswith("bot_handler_seconds_count")))
+
+
+def bench_metrics(args) -> None:
+    asyncio.run(_bench_metrics(args))
+
+
+# ===================== suite: всё сразу, JSON-отчёт и сравнение с baseline =====================
+SUITE_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+# кейсы быстрее этого (по baseline) на общей CI-машине гуляют в 2-3 раза от запуска
+# к запуску — их только показываем, деплой из-за них не останавливаем
+SUITE_GATE_MIN = 1e-3
+
+
+def _best_time(fn, repeat: int = 5, min_time: float = 0.05) -> float:
+    """
+    Лучший из repeat замеров (в каждом — столько вызовов, сколько влезает в min_time):
+    медленные замеры — это соседи по машине, а не код.
+    """
+    return min(_time_per_call(fn, min_time=min_time) for _ in range(repeat))
+
+
+def _best_atime(loop: asyncio.AbstractEventLoop, fn, repeat: int = 5, min_time: float = 0.05) -> float:
+    async def sample() -> float:
+        n = 0
+        t0 = time.perf_counter()
+        while True:
+            await fn()
+            n += 1
+            elapsed = time.perf_counter() - t0
+            if elapsed >= min_time:
+                return elapsed / n
+
+    return min(loop.run_until_complete(sample()) for _ in range(repeat))
+
+
+def _calibrate() -> float:
+    """
+    Эталонная работа на чистом Python. Результаты сравниваются в долях от неё,
+    а не в секундах — так baseline с одной машины годится для другой (CI).
+    """
+    def work() -> None:
+        d = {str(i): i * i for i in range(20000)}
+        sorted(d, key=d.get)
+        "".join(d)
+
+    return _best_time(work, repeat=15)
+
+
+def _suite_size(n: int, tmp: str, loop, tg: Bot, dp: bot.Dispatcher, uid: list[int]) -> dict[str, float]:
+    res = {}
+    path = os.path.join(tmp, f"vocab{n}.xlsx")
+    names = write_synthetic_workbook(path, n)
+    once = 1 if n >= 100_000 else 3
+
+    res["load_openpyxl"] = _best_time(lambda: bot.load_vocab_openpyxl(path, names), repeat=once, min_time=0)
+    snap = path + ".snapshot"
+    bot.load_vocab(path, names, snapshot_path=snap, rebuild=True)
+    res["load_snapshot"] = _best_time(lambda: bot.load_vocab(path, names, snapshot_path=snap),
+                                        repeat=once, min_time=0)
+    index = bot.load_vocab(path, names, snapshot_path=snap)
+    bot.apply_vocab_state((index.vocab, index.by_id, index, None))
+
+    items = index.vocab[n // 2:n // 2 + 30]
+    res["format_items_30"] = _best_time(lambda: bot.format_items(items))
+
+    def message(text: str) -> Message:
+        return Message(message_id=1, date=datetime.now(), chat=Chat(id=1, type="private"),
+                       from_user=User(id=1, is_bot=False, first_name="u"), text=text).as_(tg)
+
+    m = message("/unit 3")
+
+    async def unit_cold() -> None:
+        bot.RENDER_CACHE.clear()  # как первый показ после перезагрузки словаря
+        await bot.send_unit_page(m, 3, 1)
+
+    res["unit_page_cold"] = _best_atime(loop, unit_cold)
+    res["unit_page_cached"] = _best_atime(loop, lambda: bot.send_unit_page(m, 3, 1))
+
+    rnd = random.Random(n)
+    finds = [message(f"/find {index.vocab[rnd.randrange(n)].word_lower[:q]}") for q in (3, 5, 20) for _ in range(10)]
+    it = iter(range(1 << 62))
+    res["find"] = _best_atime(loop, lambda: bot.find_cmd(finds[next(it) % len(finds)]))
+
+    res["quiz_pool_build"] = _best_time(lambda: bot.QuizPool(index, bot.parse_quiz_source("1-3,5")))
+    pool = bot.QuizPool(index, bot.parse_quiz_source("1-3,5"))
+    res["pick_options"] = _best_time(lambda: pool.options(pool.random_id(), 4, "wd"))
+    res["pick_options_hard"] = _best_time(lambda: pool.options(pool.random_id(), 4, "wd", True))
+
+    # целый тест из 10 вопросов — апдейтами через Dispatcher, как от Telegram
+    def update(user: int, text: str | None = None, data: str | None = None) -> Update:
+        chat = {"id": user, "type": "private"}
+        frm = {"id": user, "is_bot": False, "first_name": "u"}
+        msg = {"message_id": 1, "date": 0, "chat": chat, "from": frm, "text": text or "q"}
+        if data is None:
+            return Update.model_validate({"update_id": 1, "message": msg}, context={"bot": tg})
+        return Update.model_validate({"update_id": 1, "callback_query": {
+            "id": "1", "from": frm, "chat_instance": "c", "data": data, "message": msg,
+        }}, context={"bot": tg})
+
+    async def quiz() -> None:
+        uid[0] += 1
+        user = uid[0]
+        for upd in (update(user, "/test"), update(user, "1-3,5"), update(user, data="quizmode:wd"),
+                    update(user, "10"), *(update(user, data="quizans:0") for _ in range(10))):
+            await dp.feed_update(tg, upd)
+
+    res["quiz_10_questions"] = _best_atime(loop, quiz, min_time=0.2)
+    return res
+
+
+def bench_suite(args) -> None:
+    bot.VOCAB_WATCH_INTERVAL = 0
+    loop = asyncio.new_event_loop()
+    tg = Bot("42:BENCH", session=NullSession())
+    dp = bot.Dispatcher(storage=MemoryStorage())
+    dp.include_router(bot.router)
+    uid = [0]
+
+    results: dict[str, dict[str, float]] = {}
+    calibration: dict[int, float] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            t0 = time.perf_counter()
+            # скорость общей машины плавает — эталон меряется рядом с самими замерами,
+            # до и после них: среднее ближе к тому, что было во время замеров
+            before = _calibrate()
+            size_results = _suite_size(n, tmp, loop, tg, dp, uid)
+            calibration[n] = (before + _calibrate()) / 2
+            for name, seconds in size_results.items():
+                results[f"{n}/{name}"] = {"seconds": seconds, "norm": seconds / calibration[n]}
+            print(f"rows {n}: {time.perf_counter() - t0:.1f}s", flush=True)
+    loop.close()
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "calibration_seconds": {str(n): c for n, c in calibration.items()},
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    regressions = []
+    print(f"\n{'case':34s} {'time':>11s} {'baseline':>11s} {'ratio':>7s}")
+    for key, row in results.items():
+        line = f"{key:34s} {_fmt_seconds(row['seconds']):>11s}"
+        base = (baseline or {}).get(key)
+        if base:
+            # сравниваем в долях эталона, а показываем в секундах этой машины
+            ratio = row["norm"] / base["norm"]
+            slow = ratio > 1 + args.tolerance
+            gated = base["seconds"] >= args.gate_min
+            base_seconds = row["seconds"] / ratio
+            line += f" {_fmt_seconds(base_seconds):>11s} {ratio:6.2f}x"
+            if slow:
+                line += "  REGRESSION" if gated else "  slower (report only)"
+            if slow and gated:
+                regressions.append(key)
+        print(line)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nbaseline saved: {args.baseline}")
+    elif baseline is not None:
+        print(f"\n{len(regressions)} regressions (> {args.tolerance:.0%} slower than baseline, "
+              f"cases from {_fmt_seconds(args.gate_min)} up)")
+        if regressions:
+            sys.exit(1)
+
+
+def _fmt_seconds(s: float) -> str:
+    if s >= 1:
+        return f"{s:.2f} s"
+    if s >= 1e-3:
+        return f"{s * 1e3:.2f} ms"
+    return f"{s * 1e6:.1f} us"
+
+
+def bench_storage(args) -> None:
+    asyncio.run(_bench_storage(args))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("memory", help="память: dict на строку vs VocabEntry")
+    p.add_argument("--rows", type=int, default=10000)
+    p.set_defaults(func=bench_memory)
+
+    p = sub.add_parser("load", help="загрузка Excel: потоково vs целиком, несколько листов параллельно")
+    p.add_argument("--rows", type=int, default=100000)
+    p.add_argument("--sheets", type=int, default=1)
+    p.set_defaults(func=bench_load)
+
+    p = sub.add_parser("search", help="/find: линейный проход vs VocabSearch")
+    p.add_argument("--rows", type=int, default=100000)
+    p.set_defaults(func=bench_search)
+
+    p = sub.add_parser("inline", help="inline-режим: запросов в секунду на поток нажатий клавиш")
+    p.add_argument("--rows", type=int, default=100000)
+    p.add_argument("--users", type=int, default=500)
+    p.set_defaults(func=bench_inline)
+
+    p = sub.add_parser("translate", help="MyMemory через локальную заглушку: сессия на запрос vs общая")
+    p.add_argument("--requests", type=int, default=200)
+    p.set_defaults(func=bench_translate)
+
+    p = sub.add_parser("ratelimit", help="память и накладные расходы rate limit-а")
+    p.add_argument("--users", type=int, default=100000)
+    p.set_defaults(func=bench_ratelimit)
+
+    p = sub.add_parser("storage", help="FSM: MemoryStorage vs SQLite с пакетной записью")
+    p.add_argument("--users", type=int, default=200)
+    p.add_argument("--answers", type=int, default=20)
+    p.add_argument("--pool", type=int, default=1000)
+    p.set_defaults(func=bench_storage)
+
+    p = sub.add_parser("distractors", help="варианты ответа: копия пула vs QuizPool, случайные vs похожие")
+    p.add_argument("--rows", type=int, default=100000)
+    p.set_defaults(func=bench_distractors)
+
+    p = sub.add_parser("review", help="/review: следующая карточка из кучи vs проход по всем, запись пачкой")
+    p.add_argument("--cards", type=int, default=50000)
+    p.set_defaults(func=bench_review)
+
+    p = sub.add_parser("answerlog", help="журнал ответов: запись пачками и /stats по агрегатам")
+    p.add_argument("--events", type=int, default=200000)
+    p.set_defaults(func=bench_answerlog)
+
+    p = sub.add_parser("render", help="страницы /unit и /units: рендер на каждый показ vs кэш")
+    p.add_argument("--rows", type=int, default=10000)
+    p.set_defaults(func=bench_render)
+
+    p = sub.add_parser("sends", help="Bot API через заглушку: вызовов на вопрос теста, 429 без/с SendScheduler")
+    p.add_argument("--chats", type=int, default=30)
+    p.add_argument("--questions", type=int, default=6)
+    p.add_argument("--think", type=float, default=0.3)
+    p.set_defaults(func=bench_sends)
+
+    p = sub.add_parser("webhook", help="webhook-режим: синтетические апдейты по HTTP, задержка хендлеров")
+    p.add_argument("--rows", type=int, default=10000)
+    p.add_argument("--updates", type=int, default=2000)
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--concurrency", type=int, default=40)
+    p.set_defaults(func=bench_webhook)
+
+    p = sub.add_parser("workers", help="WorkerPool: апдейтов в секунду на 1/2/4/8 процессах, общая память")
+    p.add_argument("--rows", type=int, default=10000)
+    p.add_argument("--updates", type=int, default=5000)
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.set_defaults(func=bench_workers)
+
+    p = sub.add_parser("metrics", help="метрики: цена middleware на апдейт, observe и отдача /metrics")
+    p.add_argument("--updates", type=int, default=5000)
+    p.add_argument("--rounds", type=int, default=5)
+    p.set_defaults(func=bench_metrics)
+
+    p = sub.add_parser("suite", help="всё сразу на 1k/10k/100k строк: JSON-отчёт и сравнение с baseline")
+    p.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    p.add_argument("--json", help="куда записать отчёт")
+    p.add_argument("--baseline", default=SUITE_BASELINE)
+    p.add_argument("--save-baseline", action="store_true", help="записать результат как новый baseline")
+    p.add_argument("--tolerance", type=float, default=1.0, help="во сколько медленнее baseline — уже регрессия")
+    p.add_argument("--gate-min", type=float, default=SUITE_GATE_MIN,
+                   help="кейсы быстрее (секунд, по baseline) — только в отчёте, без регрессий")
+    p.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,40 @@
 import os
 import re
+import json
+import pickle
+import sqlite3
+import hashlib
+import logging
+import argparse
 import random
 import asyncio
 import aiohttp
 import time
 import math
+import sys
+import cProfile
+import pstats
+import tracemalloc
+import gc
+import heapq
+import signal
+import threading
+import multiprocessing
+from array import array
+from dataclasses import dataclass
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Iterable, Iterator, Mapping, Sequence
 from pathlib import Path
+from queue import Empty as QueueEmpty
 
+from aiohttp import web
 from dotenv import load_dotenv
 from openpyxl import load_workbook
 
-from aiogram import Bot, Dispatcher, Router, F
+from aiogram import BaseMiddleware, Bot, Dispatcher, Router, F
+from aiogram.dispatcher.flags import get_flag
 from aiogram.filters import Command, StateFilter
 from aiogram.types import (
     Message,
@@ -19,96 +43,503 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     CallbackQuery,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
 )
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import DataNotDictLikeError, TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 MYMEMORY_EMAIL = os.getenv("MYMEMORY_EMAIL")
+# ADMIN_IDS=123,456 — кому доступны служебные команды (/reload, /profile)
+ADMIN_IDS = {int(x) for x in re.split(r"[,\s]+", os.getenv("ADMIN_IDS", "")) if x.isdigit()}
 BASE_DIR = Path(__file__).resolve().parent
 
 
-PAGE_SIZE = 20
-
-# --- translate cache (очень простой) ---
-TR_CACHE: dict[tuple[str, str], str] = {}   # key=(src_lang, text)
-
-# --- simple rate limit for /tr ---
-TR_LAST_TS: dict[int, float] = {}           # key=user_id -> last_ts
-TR_MIN_INTERVAL = 2.0  # seconds
+PAGE_SIZE = 20               # слов на странице /unit максимум (меньше, если не влезают в сообщение)
+TG_MESSAGE_LIMIT = 4096      # символов в одном сообщении Telegram (считаются в UTF-16)
+RENDER_CACHE_SIZE = 1024     # готовых страниц /unit и списков /units в памяти
+QUIZ_POOL_CACHE_SIZE = 256  # пулов теста в памяти (без копий ID — ссылки на индекс)
+QUIZ_OPTIONS = min(5, max(3, int(os.getenv("QUIZ_OPTIONS", "3"))))  # вариантов ответа: A–C .. A–E
+QUIZ_NEIGHBOURS = 8          # "похожих" слов на каждое тестовое — для сложных вариантов
+QUIZ_MISSED_SHOWN = 30       # ошибок в итоге теста (и в сессии) — остальные только числом
+
+# --- inline mode (@bot слово в любом чате) ---
+INLINE_PAGE_SIZE = 20        # результатов в одном ответе (Telegram даёт максимум 50)
+INLINE_MAX_RESULTS = 200     # сколько всего можно долистать по одному запросу
+INLINE_CACHE_SIZE = 2048     # запросов в LRU
+INLINE_CACHE_TIME = 300      # сек: столько Telegram сам отвечает на повтор запроса
+
+# --- MyMemory: одна общая HTTP-сессия на весь процесс ---
+MYMEMORY_URL = os.getenv("MYMEMORY_URL", "https://api.mymemory.translated.net/get")
+TR_MAX_CONCURRENCY = int(os.getenv("TR_MAX_CONCURRENCY", "4"))  # одновременных запросов к API
+TR_TIMEOUT = 25  # seconds
+
+# --- translate cache: LRU в памяти + копия в SQLite (переживает рестарт) ---
+DB_PATH = os.getenv("BOT_DB_PATH", str(BASE_DIR / "botdata.sqlite3"))
+TR_CACHE_MAX_ITEMS = 50_000
+TR_CACHE_MAX_BYTES = 16 * 1024 * 1024
+TR_CACHE_TTL = 30 * 24 * 3600         # удачный перевод
+TR_CACHE_NEGATIVE_TTL = 10 * 60       # "не получилось" — недолго, потом спросим API снова
+TR_FAIL_TEXT = "Не получилось перевести 😕"
+
+# --- заранее переведённые слова из Excel (python botenglish.py --pretranslate) ---
+PRETRANSLATE_RETRIES = 3
+PRETRANSLATE_COMMIT_EVERY = 50
+VOCAB_TR: dict[tuple[str, str], str] = {}   # key=(src_lang, text.lower()) -> hy
+
+# --- FSM: где хранить состояние теста (sqlite | memory | redis://...) ---
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_FLUSH_INTERVAL = 0.05   # сек: записи в SQLite копятся и уходят одной транзакцией
+FSM_MAX_BATCH = 256
+
+# --- /review: интервальное повторение (SM-2) ---
+REVIEW_FLUSH_INTERVAL = 5.0   # сек: изменённые карточки пишутся в SQLite пачкой
+REVIEW_RELEARN = 10 * 60      # сек: через сколько снова спросить слово после ошибки
+REVIEW_DECK_IDLE = 30 * 60    # сек: колоду без обращений выгружаем из памяти после записи
+REVIEW_MAX_DECKS = 10_000     # колод в памяти; сверх — выгружаем давно не нужные
+
+# --- журнал ответов в тестах (/stats, /hard) ---
+ANSWER_LOG_FLUSH_INTERVAL = 2.0   # сек
+ANSWER_LOG_BATCH = 500            # событий — пишем раньше, не дожидаясь таймера
+ANSWER_HARD_TTL = 60.0            # сек: как долго /hard отдаёт уже посчитанный список
+
+# --- исходящие запросы к Bot API (SendScheduler) ---
+SEND_CHAT_RATE, SEND_CHAT_BURST = 0.8, 2          # личный чат: лимит ~1 в секунду, держимся ниже
+SEND_GROUP_RATE, SEND_GROUP_BURST = 20 / 60, 3    # группа: 20 сообщений в минуту
+SEND_GLOBAL_RATE, SEND_GLOBAL_BURST = 30.0, 30    # весь бот: 30 сообщений в секунду
+SEND_MAX_RETRIES = 3                              # повторов после 429
+
+# --- webhook вместо long polling: включается, если задан WEBHOOK_URL ---
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")  # публичный адрес за прокси: https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")       # пусто — выводится из BOT_TOKEN
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))          # PORT — как у web-процесса в Procfile
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+WEBHOOK_DRAIN_TIMEOUT = 20.0  # сек: при остановке ждём уже начатые апдейты
+
+# --- WORKERS=N: приёмник апдейтов + N процессов-обработчиков (1 — всё в одном процессе) ---
+WORKERS = max(1, int(os.getenv("WORKERS", "1")))
+WORKER_VNODES = 256           # точек на процесс в кольце консистентного хеширования
+WORKER_START_TIMEOUT = 60.0   # сек: ждём, пока процессы откроют базы, прежде чем принимать апдейты
+POLL_TIMEOUT = 30             # сек: long polling getUpdates в приёмнике
+WORKER_RELOAD_TIMEOUT = 60.0  # сек: ждём, пока приёмник перечитает словарь после /reload
+
+# --- метрики: GET /metrics в формате Prometheus, только локально ---
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0 — выключено; процессы WORKERS — на следующих портах
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # сек
+
+# --- /profile: профиль работающего процесса (только ADMIN_IDS) ---
+PROFILE_DIR = os.getenv("PROFILE_DIR", str(BASE_DIR / "profiles"))
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 600
+PROFILE_SAMPLE_INTERVAL = 0.01   # сек между снимками стеков всех потоков
+PROFILE_TRACEMALLOC_FRAMES = 1   # кадров на аллокацию: считаем по строкам, не по цепочкам
+PROFILE_TOP = 12                 # строк в каждом списке в чате (в файле — 100)
+
+# --- rate limit: token bucket на пользователя (rate — токенов в секунду, burst — запас) ---
+RATE_LIMITS = {
+    "tr": (0.5, 3),      # /tr и перевод кнопкой: в среднем раз в 2 с, но 3 подряд можно
+    "heavy": (2.0, 6),   # списки слов, поиск, разбор unit-ов для теста
+    "inline": (4.0, 12), # inline-поиск: клиент шлёт запрос почти на каждую букву
+}
+# общий на всех — под квоту MyMemory (запросов в секунду и запас)
+TR_GLOBAL_RATE = float(os.getenv("TR_GLOBAL_RATE", "2"))
+TR_GLOBAL_BURST = 10
 
 # ==== НАСТРОЙКИ ФАЙЛА ====
 FILE_PATH = str(BASE_DIR / "vocab.xlsx")
+# скомпилированный снимок Excel рядом с ним (см. load_vocab / --compile-vocab)
+SNAPSHOT_PATH = FILE_PATH + ".snapshot"
+SNAPSHOT_VERSION = 5
+# как часто проверять, не поменялся ли vocab.xlsx (0 — не следить)
+VOCAB_WATCH_INTERVAL = float(os.getenv("VOCAB_WATCH_INTERVAL", "10"))
 
 SHEET_NAME = "THINK L2 DUTCH"   # если будет ошибка листа — поставь None
 # SHEET_NAME = None
 
+# Несколько листов сразу: VOCAB_SHEETS="THINK L2 DUTCH,Лист1" (читаются параллельно,
+# ID идут подряд в этом порядке). По умолчанию — только SHEET_NAME.
+SHEET_NAMES: list[str | None] = [
+    s.strip() for s in os.getenv("VOCAB_SHEETS", "").split(",") if s.strip()
+] or [SHEET_NAME]
+VOCAB_CHUNK_SIZE = 2000  # слов в пачке при потоковой загрузке
+VOCAB_PREFETCH_CHUNKS = 4  # сколько пачек процесс листа читает наперёд
+
+logger = logging.getLogger("botenglish")
+
 router = Router()
-VOCAB: list[dict] = []
-VOCAB_BY_ID: dict[int, dict] = {}
+VOCAB: list["VocabEntry"] = []
+VOCAB_BY_ID: dict[int, "VocabEntry"] = {}
+VOCAB_INDEX: "VocabIndex | None" = None
+VOCAB_VERSION = 0                           # +1 на каждую (пере)загрузку
+VOCAB_FILE_STAT: tuple[int, int] | None = None
+VOCAB_RELOAD_LOCK = asyncio.Lock()
 
 
-def tr_rate_limited(user_id: int) -> bool:
-    now = time.time()
-    last = TR_LAST_TS.get(user_id, 0.0)
-    if now - last < TR_MIN_INTERVAL:
-        return True
-    TR_LAST_TS[user_id] = now
-    return False
+# ===================== Metrics =====================
+class Histogram:
+    __slots__ = ("counts", "sum")
 
+    def __init__(self):
+        self.counts = [0] * (len(METRICS_BUCKETS) + 1)  # последняя ячейка — +Inf
+        self.sum = 0.0
 
-# ===================== Excel =====================
-def load_vocab_openpyxl(path: str, sheet_name: str | None) -> list[dict]:
-    wb = load_workbook(path, read_only=True, data_only=True)
-    ws = wb[sheet_name] if sheet_name else wb.worksheets[0]
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(METRICS_BUCKETS, value)] += 1
+        self.sum += value
 
-    headers = []
-    for cell in ws[1]:
-        val = cell.value if cell.value is not None else ""
-        headers.append(str(val).strip())
 
-    # В твоём файле 1-я колонка пустая — там слово
-    if headers and headers[0] == "":
-        headers[0] = "WORD"
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
 
-    rows: list[dict] = []
-    _id = 1
 
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        if not row:
-            continue
+def _format_value(value: float) -> str:
+    # целые — как есть (":g" превращал 1234567 в 1.23457e+06), дробные — repr без потери точности
+    if isinstance(value, int):
+        return str(int(value))
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
 
-        item: dict = {}
-        for i, h in enumerate(headers):
-            if not h:
-                continue
-            item[h] = row[i] if i < len(row) else None
 
-        word = str(item.get("WORD") or "").strip()
-        if not word or word.lower() in ("none", "nan"):
-            continue
+class Metrics:
+    """
+    Счётчики и гистограммы в памяти, отдаются в текстовом формате Prometheus.
+    Запись — поиск в dict и пара сложений: всё в одном event loop, без блокировок.
+    То, что объекты и так считают сами (кэши, SendScheduler), не дублируется —
+    это читают collect-функции в момент запроса /metrics.
+    """
 
-        item["ID"] = _id
-        _id += 1
+    def __init__(self):
+        self.counters: dict[tuple[str, tuple], float] = {}
+        self.histograms: dict[tuple[str, tuple], Histogram] = {}
+        # -> [(имя, тип, метки, значение)]
+        self.collectors: list[Callable[[], Iterable[tuple[str, str, tuple, float]]]] = []
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1) -> None:
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, labels: tuple, value: float) -> None:
+        h = self.histograms.get((name, labels))
+        if h is None:
+            h = self.histograms[(name, labels)] = Histogram()
+        h.observe(value)
+
+    @staticmethod
+    def _labels(labels: tuple, extra: str = "") -> str:
+        parts = [f'{k}="{_escape_label(v)}"' for k, v in labels]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        series: dict[str, tuple[str, list[str]]] = {}  # имя -> (тип, строки)
+
+        def add(name: str, kind: str, line: str) -> None:
+            series.setdefault(name, (kind, []))[1].append(line)
+
+        for (name, labels), value in self.counters.items():
+            add(name, "counter", f"{name}{self._labels(labels)} {_format_value(value)}")
+        for (name, labels), h in self.histograms.items():
+            total = 0
+            for le, n in zip((*METRICS_BUCKETS, "+Inf"), h.counts):
+                total += n
+                bucket = self._labels(labels, 'le="%s"' % le)
+                add(name, "histogram", f"{name}_bucket{bucket} {total}")
+            add(name, "histogram", f"{name}_sum{self._labels(labels)} {_format_value(h.sum)}")
+            add(name, "histogram", f"{name}_count{self._labels(labels)} {total}")
+        for collect in self.collectors:
+            for name, kind, labels, value in collect():
+                add(name, kind, f"{name}{self._labels(labels)} {_format_value(value)}")
+
+        out = []
+        for name in sorted(series):
+            kind, lines = series[name]
+            if name in METRIC_HELP:
+                out.append(f"# HELP {name} {METRIC_HELP[name]}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
+
+
+METRIC_HELP = {
+    "bot_updates_total": "Updates received, by type",
+    "bot_update_seconds": "Time to process one update, by type",
+    "bot_handler_seconds": "Handler latency (including middlewares), by handler",
+    "bot_handler_errors_total": "Exceptions raised by handlers",
+    "bot_rate_limited_total": "Requests rejected by per-user rate limits",
+    "bot_translate_total": "translate_to_armenian calls by answer source",
+    "bot_tr_upstream_total": "MyMemory requests by result",
+    "bot_tr_upstream_seconds": "MyMemory request latency, including quota wait",
+    "bot_vocab_reloads_total": "Vocabulary (re)loads by result",
+    "bot_vocab_reload_seconds": "Vocabulary load time",
+    "bot_pool_dispatched_total": "Updates handed to each worker process (WORKERS > 1)",
+}
+METRICS = Metrics()
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Время и ошибки хендлера. Внутренний middleware роутера: хендлер уже выбран
+    (data["handler"]), а в замер входят и внутренние middleware после него (rate limit).
+    """
 
-        unit_raw = item.get("UNIT NO")
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: dict[str, Any],
+    ) -> Any:
+        labels = (("handler", data["handler"].callback.__name__),)
+        t0 = time.perf_counter()
         try:
-            item["UNIT NO"] = int(unit_raw)
+            return await handler(event, data)
         except Exception:
-            item["UNIT NO"] = 0
+            METRICS.inc("bot_handler_errors_total", labels)
+            raise
+        finally:
+            METRICS.observe("bot_handler_seconds", labels, time.perf_counter() - t0)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware Dispatcher-а: поток апдейтов и полное время на каждый."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: dict[str, Any],
+    ) -> Any:
+        labels = (("type", event.event_type),)
+        METRICS.inc("bot_updates_total", labels)
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            METRICS.observe("bot_update_seconds", labels, time.perf_counter() - t0)
 
-        for k in ["DEFINITION", "DUTCH TRANSLATION", "PoS", "EXAMPLE SENTENCE", "EXAMPLE"]:
-            if k in item and item[k] is not None:
-                item[k] = str(item[k]).strip()
 
-        rows.append(item)
+METRICS_MIDDLEWARE = MetricsMiddleware()
+router.message.middleware(METRICS_MIDDLEWARE)
+router.callback_query.middleware(METRICS_MIDDLEWARE)
+router.inline_query.middleware(METRICS_MIDDLEWARE)
 
-    return rows
+
+def collect_runtime_metrics() -> Iterable[tuple[str, str, tuple, float]]:
+    """То, что уже считают сами объекты: читается только при запросе /metrics."""
+    yield "bot_vocab_words", "gauge", (), len(VOCAB)
+    yield "bot_vocab_version", "gauge", (), VOCAB_VERSION
+    for result, value in (("hit", TR_CACHE.hits), ("negative_hit", TR_CACHE.negative_hits),
+                          ("miss", TR_CACHE.misses)):
+        yield "bot_tr_cache_lookups_total", "counter", (("result", result),), value
+    yield "bot_tr_cache_evictions_total", "counter", (), TR_CACHE.evictions
+    yield "bot_tr_cache_items", "gauge", (), len(TR_CACHE)
+    yield "bot_tr_cache_bytes", "gauge", (), TR_CACHE.bytes
+    for name, cache in (("inline", INLINE_CACHE), ("render", RENDER_CACHE), ("quiz_pool", QUIZ_POOL_CACHE)):
+        yield "bot_cache_lookups_total", "counter", (("cache", name), ("result", "hit")), cache.hits
+        yield "bot_cache_lookups_total", "counter", (("cache", name), ("result", "miss")), cache.misses
+        yield "bot_cache_items", "gauge", (("cache", name),), len(cache)
+    for name, limiter in RATE_LIMITERS.items():
+        yield "bot_rate_limit_tracked_users", "gauge", (("limit", name),), len(limiter)
+    yield "bot_send_calls_total", "counter", (), SEND_SCHEDULER.calls
+    yield "bot_send_retries_total", "counter", (), SEND_SCHEDULER.retries
+
+
+METRICS.collectors.append(collect_runtime_metrics)
+
+
+async def _hold_metrics(runner: web.AppRunner) -> None:
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def start_metrics(host: str, port: int) -> asyncio.Task | None:
+    """
+    GET /metrics на host:port. Порт открывается здесь же, до запуска задачи: если он
+    занят, это видно сразу в логе, а бот работает дальше без /metrics (тогда None).
+    Задача держит сервер, пока её не отменят.
+    """
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=METRICS.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError:
+        logger.exception("Metrics: can't listen on %s:%d, /metrics is disabled", host, port)
+        await runner.cleanup()
+        return None
+    logger.info("Metrics: http://%s:%d/metrics", host, port)
+    return asyncio.create_task(_hold_metrics(runner))
+
+
+# ===================== Rate limit =====================
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "ts")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.ts = time.monotonic()
+
+    def take(self, cost: float = 1.0) -> float:
+        """0 — можно; иначе сколько секунд ждать до нужного числа токенов."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    async def acquire(self, cost: float = 1.0) -> None:
+        while (wait := self.take(cost)) > 0:
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Token bucket на каждый ключ (user_id). Ведро, которое простояло burst/rate секунд,
+    уже полное — оно ничем не отличается от нового, поэтому его просто выкидываем.
+    Память ~ число пользователей, активных за последние burst/rate секунд.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = float(burst)
+        self.idle = burst / rate
+        self._state: OrderedDict[int, tuple[float, float]] = OrderedDict()  # key -> (tokens, ts)
+
+    def hit(self, key: int, cost: float = 1.0, now: float | None = None) -> float:
+        """0 — можно; иначе сколько секунд ждать."""
+        if now is None:
+            now = time.monotonic()
+
+        state = self._state
+        # самые давние — в начале: выкидываем, пока не встретим недавнее
+        while state:
+            first = next(iter(state.values()))
+            if now - first[1] < self.idle:
+                break
+            state.popitem(last=False)
+
+        tokens, ts = state.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - ts) * self.rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / self.rate
+        state[key] = (tokens, now)
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+
+RATE_LIMITERS = {name: RateLimiter(rate, burst) for name, (rate, burst) in RATE_LIMITS.items()}
+TR_GLOBAL_BUCKET = TokenBucket(TR_GLOBAL_RATE, TR_GLOBAL_BURST)
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """Хендлеры с flags={"rate_limit": "<имя из RATE_LIMITS>"} ограничиваются по пользователю."""
+
+    def __init__(self, limiters: dict[str, RateLimiter]):
+        self.limiters = limiters
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: dict[str, Any],
+    ) -> Any:
+        name = get_flag(data, "rate_limit")
+        user = data.get("event_from_user")
+        if not name or user is None:
+            return await handler(event, data)
+        # "❌ Отмена" не ограничиваем никогда
+        if isinstance(event, Message) and is_cancel_text(event.text):
+            return await handler(event, data)
+
+        wait = self.limiters[name].hit(user.id)
+        if wait <= 0:
+            return await handler(event, data)
+
+        METRICS.inc("bot_rate_limited_total", (("limit", name),))
+        if isinstance(event, InlineQuery):
+            # пустая выдача без кеша — следующая буква спросит заново
+            await event.answer([], cache_time=0, is_personal=True)
+            return None
+        # у Message это ответ в чат, у CallbackQuery — всплывашка
+        await event.answer(f"⏳ Слишком часто. Подожди {math.ceil(wait)} с 🙂")
+        return None
+
+
+router.message.middleware(RateLimitMiddleware(RATE_LIMITERS))
+router.callback_query.middleware(RateLimitMiddleware(RATE_LIMITERS))
+router.inline_query.middleware(RateLimitMiddleware(RATE_LIMITERS))
+
+
+class LRUCache:
+    """Простой LRU: при переполнении выкидывает то, к чему дольше всего не обращались."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+INLINE_CACHE = LRUCache(INLINE_CACHE_SIZE)  # (VOCAB_VERSION, запрос) -> ID результатов
+RENDER_CACHE = LRUCache(RENDER_CACHE_SIZE)  # (VOCAB_VERSION, что, ...) -> готовый текст
+QUIZ_POOL_CACHE = LRUCache(QUIZ_POOL_CACHE_SIZE)  # (VOCAB_VERSION, источник) -> QuizPool
 
 
+# ===================== Excel =====================
 def _clean_text(x) -> str:
     if x is None:
         return ""
@@ -118,35 +549,935 @@ def _clean_text(x) -> str:
     return s
 
 
-def format_items(items: list[dict]) -> str:
+@dataclass(frozen=True, slots=True)
+class VocabEntry:
+    """Одно слово из Excel. Все строки уже очищены (_clean_text) при загрузке."""
+    id: int
+    word: str
+    unit: int = 0
+    pos: str = ""
+    definition: str = ""
+    dutch: str = ""
+    example: str = ""
+    word_lower: str = ""
+
+    @property
+    def quiz_ok(self) -> bool:
+        # в тест попадают только слова, где есть и WORD и DEFINITION
+        return bool(self.word and self.definition)
+
+    @property
+    def key(self) -> int:
+        """Устойчивый ключ слова для всего, что хранится в базе (см. word_key)."""
+        return word_key(self.word_lower, self.definition)
+
+
+def word_key(word_lower: str, definition: str) -> int:
+    """
+    ID — это номер строки и сдвигается, если в Excel вставить или удалить строку;
+    карточки и статистика хранятся по хэшу слова и definition (63 бита — влезает
+    в INTEGER SQLite), а текущий ID находится через VocabIndex.id_by_key.
+    """
+    digest = hashlib.blake2b(f"{word_lower}\0{definition}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") >> 1
+
+
+def iter_sheet_rows(path: str, sheet_name: str | None) -> Iterator[tuple]:
+    """
+    Потоково читает лист и отдаёт уже очищенные поля VocabEntry без ID:
+    (word, unit, pos, definition, dutch, example, word_lower).
+    """
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name] if sheet_name else wb.worksheets[0]
+
+        headers = []
+        for cell in ws[1]:
+            val = cell.value if cell.value is not None else ""
+            headers.append(str(val).strip())
+
+        # В твоём файле 1-я колонка пустая — там слово
+        if headers and headers[0] == "":
+            headers[0] = "WORD"
+
+        col = {h: i for i, h in enumerate(headers) if h}
+
+        def get(row: tuple, name: str):
+            i = col.get(name)
+            return row[i] if i is not None and i < len(row) else None
+
+        for row in ws.iter_rows(min_row=2, values_only=True):
+            if not row:
+                continue
+
+            word = _clean_text(get(row, "WORD"))
+            if not word:
+                continue
+
+            try:
+                unit = int(get(row, "UNIT NO"))
+            except Exception:
+                unit = 0
+
+            yield (
+                word,
+                unit,
+                _clean_text(get(row, "PoS")),
+                _clean_text(get(row, "DEFINITION")),
+                _clean_text(get(row, "DUTCH TRANSLATION")),
+                _clean_text(get(row, "EXAMPLE SENTENCE")) or _clean_text(get(row, "EXAMPLE")),
+                word.lower(),
+            )
+    finally:
+        wb.close()
+
+
+def _chunked(rows: Iterable[tuple], size: int) -> Iterator[list[tuple]]:
+    chunk: list[tuple] = []
+    for r in rows:
+        chunk.append(r)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _stream_sheet(path: str, sheet_name: str | None, chunk_size: int, q) -> None:
+    # в отдельном процессе: лист пачками в очередь, в конце None (или ошибка)
+    try:
+        for rows in _chunked(iter_sheet_rows(path, sheet_name), chunk_size):
+            q.put(rows)
+    except BaseException as e:
+        # исключение openpyxl может не пережить pickle — передаём текстом
+        q.put(RuntimeError(f"лист {sheet_name!r}: {type(e).__name__}: {e}"))
+        return
+    q.put(None)
+
+
+def _sheet_chunks(proc, q) -> Iterator[list[tuple]]:
+    while True:
+        try:
+            item = q.get(timeout=1.0)
+        except QueueEmpty:
+            if proc.is_alive():
+                continue
+            # процесс мог успеть дописать и выйти между get и is_alive
+            try:
+                item = q.get(timeout=1.0)
+            except QueueEmpty:
+                raise RuntimeError(f"{proc.name} завершился с кодом {proc.exitcode}") from None
+        if item is None:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def iter_vocab_chunks(
+    path: str,
+    sheet_names: Sequence[str | None],
+    chunk_size: int = VOCAB_CHUNK_SIZE,
+) -> Iterator[list[VocabEntry]]:
+    """
+    Слова пачками по chunk_size, ID сквозные по листам в порядке sheet_names.
+    Один лист читается потоково; несколько (если ядер больше одного) — параллельно
+    в отдельных процессах, каждый отдаёт пачки через очередь на
+    VOCAB_PREFETCH_CHUNKS штук, так что в памяти не больше нескольких пачек на лист.
+    """
+    procs: list[tuple] = []  # (process, queue) в порядке sheet_names
+    workers = min(len(sheet_names), os.cpu_count() or 1)
+    if workers <= 1:
+        # один лист или одно ядро — процессы ничего не дадут, читаем по очереди
+        sources = (
+            _chunked(iter_sheet_rows(path, name), chunk_size) for name in (sheet_names or [None])
+        )
+    else:
+        # forkserver, а не fork: перезагрузка идёт из потока to_thread, а форк
+        # многопоточного процесса может унести чужие захваченные локи. Сервер
+        # однопоточный и импортирует модуль один раз — дальше листы стартуют
+        # форком от него, без повторного импорта aiogram, как при spawn
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload([__name__])
+
+        def start(i: int) -> None:
+            q = ctx.Queue(VOCAB_PREFETCH_CHUNKS)
+            p = ctx.Process(
+                target=_stream_sheet, args=(path, sheet_names[i], chunk_size, q),
+                name=f"vocab-sheet-{i}", daemon=True,
+            )
+            p.start()
+            procs.append((p, q))
+
+        def sheets() -> Iterator[Iterator[list[tuple]]]:
+            for i in range(len(sheet_names)):
+                # держим запущенными не больше workers листов впереди текущего
+                while len(procs) < min(len(sheet_names), i + workers):
+                    start(len(procs))
+                yield _sheet_chunks(*procs[i])
+
+        sources = sheets()
+
+    try:
+        next_id = 1
+        for source in sources:
+            for rows in source:
+                chunk = [VocabEntry(next_id + i, *r) for i, r in enumerate(rows)]
+                next_id += len(chunk)
+                yield chunk
+    finally:
+        for p, q in procs:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+            q.close()
+            q.cancel_join_thread()
+
+
+def load_vocab_openpyxl(path: str, sheet_names: Sequence[str | None]) -> list[VocabEntry]:
+    rows: list[VocabEntry] = []
+    for chunk in iter_vocab_chunks(path, sheet_names):
+        rows.extend(chunk)
+    return rows
+
+
+# ===================== Vocab snapshot =====================
+# Формат файла: pickle подряд — заголовок (версия, листы, mtime/size/sha256 Excel),
+# сами строки кортежами полей VocabEntry, соседи для теста (VocabIndex.neighbours),
+# готовый индекс поиска (VocabSearch.dump) и word_key -> ID двумя array.
+# Заголовок читается без загрузки строк.
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _snapshot_header(path: str, sheet_names: Sequence[str | None], sha256: str | None = None) -> dict:
+    st = os.stat(path)
+    return {
+        "version": SNAPSHOT_VERSION,
+        "sheets": list(sheet_names),
+        "neighbours": QUIZ_NEIGHBOURS,
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+        "sha256": sha256 or _file_sha256(path),
+    }
+
+
+def save_vocab_snapshot(
+    path: str,
+    sheet_names: Sequence[str | None],
+    vocab: list[VocabEntry],
+    snapshot_path: str,
+    neighbours: array | None = None,
+    search: tuple | None = None,
+    id_by_key: dict[int, int] | None = None,
+) -> None:
+    header = _snapshot_header(path, sheet_names)
+    rows = [tuple(getattr(it, f) for f in VocabEntry.__slots__) for it in vocab]
+
+    tmp = f"{snapshot_path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(neighbours, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(search, f, protocol=pickle.HIGHEST_PROTOCOL)
+        keys = (array("Q", id_by_key), array("I", id_by_key.values())) if id_by_key else None
+        pickle.dump(keys, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, snapshot_path)
+
+
+def load_vocab_snapshot(
+    path: str,
+    sheet_names: Sequence[str | None],
+    snapshot_path: str,
+) -> tuple[list[VocabEntry], array | None, tuple | None, dict[int, int] | None] | None:
+    """
+    (строки, соседи, индекс поиска, word_key -> ID) из снимка, если он собран
+    из этой же версии Excel, иначе None.
+    """
+    try:
+        with open(snapshot_path, "rb") as f:
+            header = pickle.load(f)
+            if header.get("version") != SNAPSHOT_VERSION or header.get("sheets") != list(sheet_names):
+                return None
+            if header.get("neighbours") != QUIZ_NEIGHBOURS:
+                return None
+
+            st = os.stat(path)
+            if header.get("size") != st.st_size:
+                return None
+            if header.get("mtime_ns") != st.st_mtime_ns:
+                # mtime меняется и без правок (git clone/checkout) — тогда решает хэш
+                if header.get("sha256") != _file_sha256(path):
+                    return None
+
+            rows = pickle.load(f)
+            neighbours = pickle.load(f)
+            search = pickle.load(f)
+            keys = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning("vocab snapshot %s is unreadable, rebuilding", snapshot_path, exc_info=True)
+        return None
+
+    id_by_key = dict(zip(*keys)) if keys is not None else None
+    return [VocabEntry(*r) for r in rows], neighbours, search, id_by_key
+
+
+def load_vocab(
+    path: str,
+    sheet_names: Sequence[str | None],
+    snapshot_path: str | None = SNAPSHOT_PATH,
+    rebuild: bool = False,
+) -> "VocabIndex":
+    """
+    Снимок, если он актуален; иначе Excel пачками идёт прямо в индекс,
+    а снимок пересобирается.
+    """
+    index = VocabIndex()
+
+    if snapshot_path and not rebuild:
+        snapshot = load_vocab_snapshot(path, sheet_names, snapshot_path)
+        if snapshot is not None:
+            vocab, neighbours, search, id_by_key = snapshot
+            # postings и ключи уже в снимке — не токенизируем и не хэшируем слова заново
+            index.extend(vocab, search=search is None)
+            return index.finish(neighbours, search, id_by_key)
+
+    for chunk in iter_vocab_chunks(path, sheet_names):
+        index.extend(chunk)
+    index.finish()
+
+    if snapshot_path:
+        try:
+            save_vocab_snapshot(
+                path, sheet_names, index.vocab, snapshot_path,
+                index.neighbours, index.search.dump(), index.id_by_key,
+            )
+        except OSError:
+            logger.warning("can't write vocab snapshot %s", snapshot_path, exc_info=True)
+    return index
+
+
+def compile_vocab_snapshot() -> None:
+    t0 = time.perf_counter()
+    index = load_vocab(FILE_PATH, SHEET_NAMES, rebuild=True)
+    print(f"{SNAPSHOT_PATH}: {len(index.vocab)} words, {time.perf_counter() - t0:.2f}s")
+
+
+# ===================== Search =====================
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _tokens(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _trigrams(s: str) -> set[str]:
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+class VocabSearch:
+    """
+    Поиск для /find: инвертированный индекс токенов по полям + триграммы по словарю токенов.
+
+    Каждый токен запроса сопоставляется токенам словаря: точное совпадение, префикс,
+    подстрока (через триграммы), а если ничего нет — опечатка (одна правка).
+    Вес документа по токену = лучший (вес поля × вес совпадения); токены запроса — AND,
+    если так ничего не нашлось — OR. Слово, совпадающее с запросом или начинающееся с него,
+    поднимается наверх; при равенстве — по порядку в файле.
+    """
+
+    FIELDS = (("word", 10.0), ("dutch", 6.0), ("definition", 2.0), ("example", 1.0))
+    EXACT, PREFIX, SUBSTRING, TYPO = 3.0, 2.0, 1.0, 0.6
+    MAX_EXPAND = 200       # сколько токенов словаря максимум разворачиваем из одного токена запроса
+    AND_SCAN_LIMIT = 300   # до скольких кандидатов остальные токены проверяем прямо по записи
+
+    def __init__(self):
+        self.by_id: dict[int, VocabEntry] = {}
+        # по словарю на поле: токен -> ID слов по возрастанию (array — чтобы 100k слов не съели память)
+        self.postings: list[dict[str, array]] = [{} for _ in self.FIELDS]
+        self.known: set[str] = set()
+        self.sorted_tokens: list[str] = []
+        self.trigrams: dict[str, list[str]] = {}
+        self.alphabet: str = ""
+
+    def extend(self, entries: Iterable[VocabEntry]) -> None:
+        for it in entries:
+            self.by_id[it.id] = it
+            for postings, (field, _w) in zip(self.postings, self.FIELDS):
+                for tok in set(_tokens(getattr(it, field))):
+                    arr = postings.get(tok)
+                    if arr is None:
+                        arr = postings[tok] = array("I")
+                    arr.append(it.id)
+
+    def finish(self) -> None:
+        """Словарь токенов, триграммы и алфавит — после того, как все слова добавлены."""
+        known: set[str] = set()
+        for postings in self.postings:
+            known.update(postings)
+        self.known = known
+        self.sorted_tokens = sorted(known)
+
+        trigrams: dict[str, list[str]] = {}
+        for tok in self.sorted_tokens:
+            for g in _trigrams(tok):
+                trigrams.setdefault(g, []).append(tok)
+        self.trigrams = trigrams
+        self.alphabet = "".join(sorted(set().union(*known))) if known else ""
+
+    def dump(self) -> tuple:
+        """
+        Всё, что строят extend и finish, кроме by_id — для снимка словаря.
+        postings каждого поля — плоско (токены, все ID подряд, длины): сотни тысяч
+        отдельных array распаковываются из pickle в разы дольше одного.
+        """
+        flat = []
+        for postings in self.postings:
+            ids, lens = array("I"), array("I")
+            for arr in postings.values():
+                ids.extend(arr)
+                lens.append(len(arr))
+            flat.append((list(postings), ids, lens))
+        return flat, self.sorted_tokens, self.trigrams, self.alphabet
+
+    def restore(self, state: tuple) -> None:
+        """Вместо finish: индекс из dump(); by_id к этому моменту уже заполнен."""
+        flat, self.sorted_tokens, self.trigrams, self.alphabet = state
+        self.postings = []
+        for tokens, ids, lens in flat:
+            postings: dict[str, array] = {}
+            off = 0
+            for tok, n in zip(tokens, lens):
+                postings[tok] = ids[off:off + n]
+                off += n
+            self.postings.append(postings)
+        self.known = set(self.sorted_tokens)
+
+    # --- сопоставление одного токена запроса с токенами словаря ---
+    def _prefix_tokens(self, q: str) -> list[str]:
+        lo = bisect_left(self.sorted_tokens, q)
+        out = []
+        for tok in self.sorted_tokens[lo:lo + self.MAX_EXPAND]:
+            if not tok.startswith(q):
+                break
+            out.append(tok)
+        return out
+
+    def _substring_tokens(self, q: str) -> list[str]:
+        lists = [self.trigrams.get(g) for g in _trigrams(q)]
+        if not lists or not all(lists):
+            return []
+        rarest = min(lists, key=len)
+        return [tok for tok in rarest if q in tok][:self.MAX_EXPAND]
+
+    def _typo_tokens(self, q: str) -> list[str]:
+        # все варианты на расстоянии одной правки, буквы — только из той же письменности
+        blocks = {ord(c) >> 7 for c in q}
+        letters = [c for c in self.alphabet if ord(c) >> 7 in blocks]
+        splits = [(q[:i], q[i:]) for i in range(len(q) + 1)]
+        variants = {a + b[1:] for a, b in splits if b}
+        variants.update(a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1)
+        variants.update(a + c + b[1:] for a, b in splits if b for c in letters)
+        variants.update(a + c + b for a, b in splits for c in letters)
+        variants.discard(q)
+        return [v for v in variants if v in self.known][:self.MAX_EXPAND]
+
+    def _match_token(self, q: str, typos: bool) -> dict[str, float]:
+        matches: dict[str, float] = {}
+        for tok in self._substring_tokens(q):
+            matches[tok] = self.SUBSTRING
+        for tok in self._prefix_tokens(q):
+            matches[tok] = self.PREFIX
+        if q in self.known:
+            matches[q] = self.EXACT
+        if typos and not matches and len(q) >= 4:
+            for tok in self._typo_tokens(q):
+                matches[tok] = self.TYPO
+        return matches
+
+    # --- оценка документов ---
+    def _score_all(self, matches: dict[str, float]) -> dict[int, float]:
+        scores: dict[int, float] = {}
+        for postings, (_field, fw) in zip(self.postings, self.FIELDS):
+            for tok, mw in matches.items():
+                ids = postings.get(tok)
+                if not ids:
+                    continue
+                w = fw * mw
+                for _id in ids:
+                    if scores.get(_id, 0.0) < w:
+                        scores[_id] = w
+        return scores
+
+    def _score_top(self, matches: dict[str, float], k: int) -> dict[int, float]:
+        """
+        Как _score_all, но с ранней остановкой: группы (поле, токен) идут по убыванию веса,
+        поэтому первый найденный вес документа — его лучший. Как только набрали k документов,
+        дальше смотреть незачем. Поле WORD всегда читаем целиком — от него зависят бонусы.
+        """
+        groups: dict[float, list[tuple[bool, array]]] = {}
+        for fi, (postings, (_field, fw)) in enumerate(zip(self.postings, self.FIELDS)):
+            for tok, mw in matches.items():
+                ids = postings.get(tok)
+                if ids:
+                    groups.setdefault(fw * mw, []).append((fi == 0, ids))
+
+        scores: dict[int, float] = {}
+        for w in sorted(groups, reverse=True):
+            if len(scores) >= k:
+                break
+            rest = []
+            for is_word, ids in groups[w]:
+                if not is_word:
+                    rest.append(ids)
+                    continue
+                for _id in ids:
+                    scores.setdefault(_id, w)
+
+            need = k - len(scores)
+            if need <= 0 or not rest:
+                continue
+            # внутри группы при равном весе выигрывает меньший ID — берём первые need новых
+            for _id in heapq.merge(*rest):
+                if _id not in scores:
+                    scores[_id] = w
+                    need -= 1
+                    if not need:
+                        break
+        return scores
+
+    def _score_entry(self, it: VocabEntry, matches: dict[str, float]) -> float:
+        best = 0.0
+        for field, fw in self.FIELDS:
+            for tok in _tokens(getattr(it, field)):
+                mw = matches.get(tok)
+                if mw and fw * mw > best:
+                    best = fw * mw
+        return best
+
+    def _score_and(self, per_token: list[dict[str, float]]) -> dict[int, float]:
+        # начинаем с самого редкого токена запроса
+        def size(matches):
+            return sum(len(p.get(tok, ())) for p in self.postings for tok in matches)
+
+        per_token = sorted(per_token, key=size)
+        scores = self._score_all(per_token[0])
+
+        if len(scores) <= self.AND_SCAN_LIMIT:
+            for matches in per_token[1:]:
+                for _id in list(scores):
+                    s = self._score_entry(self.by_id[_id], matches)
+                    if s:
+                        scores[_id] += s
+                    else:
+                        del scores[_id]
+            return scores
+
+        for matches in per_token[1:]:
+            other = self._score_all(matches)
+            scores = {_id: s + other[_id] for _id, s in scores.items() if _id in other}
+        return scores
+
+    def search(self, query: str, limit: int = 30, offset: int = 0, typos: bool = True) -> list[VocabEntry]:
+        q_tokens = list(dict.fromkeys(_tokens(query)))
+        if not q_tokens:
+            return []
+
+        k = offset + limit
+        per_token = [self._match_token(q, typos) for q in q_tokens]
+        if len(per_token) == 1:
+            scores = self._score_top(per_token[0], k)
+        else:
+            scores = self._score_and(per_token) if all(per_token) else {}
+            if not scores:
+                scores = {}
+                for matches in per_token:
+                    for _id, s in self._score_all(matches).items():
+                        scores[_id] = scores.get(_id, 0.0) + s
+
+        phrase = " ".join(q_tokens)
+        ranked = []
+        for _id, score in scores.items():
+            word = self.by_id[_id].word_lower
+            if word == phrase:
+                score += 100.0
+            elif word.startswith(phrase):
+                score += 20.0
+            ranked.append((score, -_id))
+
+        top = heapq.nlargest(k, ranked)[offset:]
+        return [self.by_id[-neg_id] for _score, neg_id in top]
+
+
+class VocabIndex:
+    """
+    Индексы поверх VOCAB. Заполняются пачками при загрузке (extend), дальше только lookup-ы:
+      - ID -> слово, отсортированные ID для выборки диапазона через bisect
+      - unit -> ID слов по порядку (и отдельно только "тестовые": есть WORD и DEFINITION)
+      - количество слов в каждом unit-е
+      - для каждого тестового слова — QUIZ_NEIGHBOURS похожих (сложные варианты ответа)
+    """
+
+    def __init__(self, vocab: Iterable[VocabEntry] = ()):
+        self.vocab: list[VocabEntry] = []
+        self.by_id: dict[int, VocabEntry] = {}
+        self.ids: list[int] = []
+        self.quiz_ids: list[int] = []
+        self.unit_ids: dict[int, list[int]] = {}
+        self.unit_quiz_ids: dict[int, list[int]] = {}
+        self.id_by_key: dict[int, int] = {}  # word_key -> ID (у дублей — первый)
+        self._unit_counts: dict[int, int] | None = None
+        self.search = VocabSearch()
+        # соседи quiz_ids[i] — в neighbours[i*K:(i+1)*K], 0 = пусто
+        self.neighbours = array("I")
+        if vocab:
+            self.extend(vocab)
+            self.finish()
+
+    def extend(self, entries: Iterable[VocabEntry], search: bool = True) -> None:
+        """search=False — индекс поиска придёт готовым в finish (из снимка)."""
+        # ID приходят по возрастанию, поэтому self.ids и self.vocab остаются параллельными
+        entries = list(entries)
+        for it in entries:
+            self.vocab.append(it)
+            self.by_id[it.id] = it
+            self.ids.append(it.id)
+            self.unit_ids.setdefault(it.unit, []).append(it.id)
+            if it.quiz_ok:
+                self.quiz_ids.append(it.id)
+                self.unit_quiz_ids.setdefault(it.unit, []).append(it.id)
+        if search:
+            self.search.extend(entries)
+        else:
+            self.search.by_id.update((it.id, it) for it in entries)
+        self._unit_counts = None
+
+    def finish(
+        self,
+        neighbours: array | None = None,
+        search: tuple | None = None,
+        id_by_key: dict[int, int] | None = None,
+    ) -> "VocabIndex":
+        """
+        Достраивает то, что нельзя вести пачками (поиск, соседи, ключи); вызывать после
+        последнего extend. Аргументы — готовое из снимка, чтобы не считать это заново.
+        """
+        if search is not None:
+            self.search.restore(search)
+        else:
+            self.search.finish()
+        if id_by_key is not None and len(id_by_key) <= len(self.vocab):
+            self.id_by_key = id_by_key
+        else:
+            id_by_key = self.id_by_key
+            for it in self.vocab:
+                id_by_key.setdefault(it.key, it.id)
+        if neighbours is not None and len(neighbours) == QUIZ_NEIGHBOURS * len(self.quiz_ids):
+            self.neighbours = neighbours
+        else:
+            self._build_neighbours()
+        return self
+
+    def _build_neighbours(self, window: int = 4, max_postings: int = 16) -> None:
+        """
+        Кандидаты в "похожие" для каждого тестового слова:
+          - та же часть речи и близкая длина definition (соседи в отсортированном списке),
+          - то же + тот же unit,
+          - общее самое редкое слово в definition (через индекс поиска).
+        Из них берём QUIZ_NEIGHBOURS лучших по очкам.
+        """
+        k = QUIZ_NEIGHBOURS
+        ids = self.quiz_ids
+        slot = {_id: i for i, _id in enumerate(ids)}
+        items = [self.by_id[_id] for _id in ids]
+        pos = [it.pos.lower() for it in items]
+        units = [it.unit for it in items]
+        dtoks = [_tokens(it.definition) for it in items]
+        dlen = [len(t) for t in dtoks]
+        content = [frozenset(t for t in toks if len(t) > 3) for toks in dtoks]
+        def_postings = self.search.postings[[f for f, _w in VocabSearch.FIELDS].index("definition")]
+
+        by_len: dict[str, list[int]] = {}
+        for i in range(len(ids)):
+            by_len.setdefault(pos[i], []).append(i)
+        by_unit: dict[str, list[int]] = {}
+        rank_len = [0] * len(ids)
+        rank_unit = [0] * len(ids)
+        for p, group in by_len.items():
+            group.sort(key=dlen.__getitem__)
+            for r, i in enumerate(group):
+                rank_len[i] = r
+            by_unit[p] = sorted(group, key=lambda i: (units[i], dlen[i]))
+            for r, i in enumerate(by_unit[p]):
+                rank_unit[i] = r
+
+        out = array("I", bytes(4 * k * len(ids)))
+        for i in range(len(ids)):
+            p = pos[i]
+            r = rank_len[i]
+            cand = set(by_len[p][max(0, r - window):r + window + 1])
+            r = rank_unit[i]
+            cand.update(by_unit[p][max(0, r - window):r + window + 1])
+            rare = min(content[i], key=lambda t: len(def_postings[t]), default=None)
+            if rare is not None and len(def_postings[rare]) <= max_postings:
+                cand.update(slot[_id] for _id in def_postings[rare] if _id in slot)
+            cand.discard(i)
+
+            toks, u, d = content[i], units[i], dlen[i]
+            best = heapq.nlargest(
+                k, cand,
+                key=lambda c: (3 * len(toks & content[c]) + 2 * (units[c] == u)
+                               + (pos[c] == p) + 1 / (1 + abs(dlen[c] - d))),
+            )
+            for j, c in enumerate(best):
+                out[i * k + j] = ids[c]
+        self.neighbours = out
+
+    def neighbours_of(self, _id: int) -> array:
+        i = bisect_left(self.quiz_ids, _id)
+        if i == len(self.quiz_ids) or self.quiz_ids[i] != _id or not self.neighbours:
+            return array("I")
+        return self.neighbours[i * QUIZ_NEIGHBOURS:(i + 1) * QUIZ_NEIGHBOURS]
+
+    @property
+    def unit_counts(self) -> dict[int, int]:
+        if self._unit_counts is None:
+            self._unit_counts = {
+                u: len(ids) for u, ids in sorted(self.unit_ids.items()) if u
+            }
+        return self._unit_counts
+
+    @property
+    def max_id(self) -> int:
+        return self.ids[-1] if self.ids else 0
+
+    def items_in_range(self, a: int, b: int) -> list[VocabEntry]:
+        lo = bisect_left(self.ids, a)
+        hi = bisect_right(self.ids, b)
+        return self.vocab[lo:hi]
+
+
+# ===================== Vocab reload =====================
+def _vocab_file_stat(path: str) -> tuple[int, int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def build_vocab_state(path: str, sheet_names: Sequence[str | None], rebuild: bool = False):
+    """Всё тяжёлое (парсинг + индексы) — здесь; вызывается в отдельном потоке."""
+    stat = _vocab_file_stat(path)
+    index = load_vocab(path, sheet_names, rebuild=rebuild)
+    return index.vocab, index.by_id, index, stat
+
+
+def apply_vocab_state(vocab_state) -> None:
+    # Подмена одним синхронным куском, без await: хендлеры видят либо старый
+    # словарь целиком, либо новый целиком.
+    global VOCAB, VOCAB_BY_ID, VOCAB_INDEX, VOCAB_VERSION, VOCAB_FILE_STAT
+    VOCAB, VOCAB_BY_ID, VOCAB_INDEX, VOCAB_FILE_STAT = vocab_state
+    VOCAB_VERSION += 1
+    INLINE_CACHE.clear()
+    QUIZ_POOL_CACHE.clear()
+    RENDER_CACHE.clear()
+
+
+async def reload_vocab(rebuild: bool = False) -> float:
+    """Перечитывает словарь, не блокируя event loop. Возвращает время в секундах."""
+    async with VOCAB_RELOAD_LOCK:
+        t0 = time.perf_counter()
+        try:
+            vocab_state = await asyncio.to_thread(build_vocab_state, FILE_PATH, SHEET_NAMES, rebuild)
+        except Exception:
+            METRICS.inc("bot_vocab_reloads_total", (("result", "error"),))
+            raise
+        apply_vocab_state(vocab_state)
+        elapsed = time.perf_counter() - t0
+    METRICS.inc("bot_vocab_reloads_total", (("result", "ok"),))
+    METRICS.observe("bot_vocab_reload_seconds", (), elapsed)
+
+    logger.info("vocab v%d: %d words loaded in %.3fs", VOCAB_VERSION, len(VOCAB), elapsed)
+    return elapsed
+
+
+async def watch_vocab(interval: float, reload: Callable[[], Awaitable[Any]] = reload_vocab) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if _vocab_file_stat(FILE_PATH) == VOCAB_FILE_STAT:
+                continue
+            await reload()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # например, файл ещё дописывается — попробуем на следующем тике
+            logger.exception("vocab reload failed")
+
+
+def format_items(items: list[VocabEntry]) -> str:
     out = []
     for it in items:
-        _id = it.get("ID", "")
-        word = _clean_text(it.get("WORD"))
-        dutch = _clean_text(it.get("DUTCH TRANSLATION"))
-        pos = _clean_text(it.get("PoS"))
-        definition = _clean_text(it.get("DEFINITION"))
-        example = _clean_text(it.get("EXAMPLE SENTENCE")) or _clean_text(it.get("EXAMPLE"))
-
         extra = []
-        if dutch:
-            extra.append(dutch)
-        if pos:
-            extra.append(pos)
+        if it.dutch:
+            extra.append(it.dutch)
+        if it.pos:
+            extra.append(it.pos)
         extra_txt = f" ({', '.join(extra)})" if extra else ""
 
-        block = [f"{_id}. {word}{extra_txt}", f"— {definition}"]
-        if example:
-            block.append(f"💬 Example: {example}")
+        block = [f"{it.id}. {it.word}{extra_txt}", f"— {it.definition}"]
+        hy = VOCAB_TR.get(("en", it.word_lower))
+        if hy:
+            block.append(f"🇦🇲 {hy}")
+        if it.example:
+            block.append(f"💬 Example: {it.example}")
 
         out.append("\n".join(block))
 
     return "\n\n".join(out)
 
 
-async def send_long(m: Message, text: str, chunk: int = 3500):
-    for i in range(0, len(text), chunk):
-        await m.answer(text[i:i + chunk])
+def _tg_len(text: str) -> int:
+    # Telegram считает длину в UTF-16: эмодзи-флаг 🇦🇲 — это 4
+    return len(text.encode("utf-16-le")) // 2
+
+
+def split_message(text: str, limit: int = TG_MESSAGE_LIMIT) -> list[str]:
+    """
+    Режет текст на сообщения по границам записей (пустая строка между словами).
+    Запись, которая сама не влезает, режется по строкам, а строка — по символам;
+    строки такой записи в одном сообщении остаются через "\n", без пустых строк.
+    """
+    # (разделитель перед куском, если он попадёт в то же сообщение, кусок)
+    pieces: list[tuple[str, str]] = []
+    for block in text.split("\n\n"):
+        if _tg_len(block) <= limit:
+            pieces.append(("\n\n", block))
+            continue
+        sep = "\n\n"
+        for line in block.split("\n"):
+            while _tg_len(line) > limit:
+                # самый длинный префикс, который влезает (символ — 1 или 2 единицы UTF-16)
+                lo, hi = limit // 2, limit
+                while lo < hi:
+                    mid = (lo + hi + 1) // 2
+                    if _tg_len(line[:mid]) <= limit:
+                        lo = mid
+                    else:
+                        hi = mid - 1
+                pieces.append((sep, line[:lo]))
+                sep, line = "", line[lo:]
+            pieces.append((sep, line))
+            sep = "\n"
+
+    chunks: list[str] = []
+    cur: list[str] = []
+    size = 0
+    for sep, piece in pieces:
+        n = _tg_len(piece)
+        if cur and size + len(sep) + n > limit:
+            chunks.append("".join(cur))
+            cur, size = [], 0
+        if cur:
+            cur.append(sep)
+            size += len(sep)
+        cur.append(piece)
+        size += n
+    if cur:
+        chunks.append("".join(cur))
+    return chunks
+
+
+async def send_long(m: Message, text: str, limit: int = TG_MESSAGE_LIMIT):
+    for chunk in split_message(text, limit):
+        await m.answer(chunk)
+
+
+# ===================== Outbound sends =====================
+class SendScheduler(BaseRequestMiddleware):
+    """
+    Все запросы к Bot API проходят здесь (bot.session.middleware). Запрос в чат
+    (у метода есть chat_id) ждёт бюджета этого чата и общего бюджета бота, а на
+    429 Too Many Requests — retry_after, после чего повторяется; пока пауза не
+    истекла, в этот чат ничего не шлём.
+    """
+
+    def __init__(
+        self,
+        chat_rate: float = SEND_CHAT_RATE,
+        chat_burst: float = SEND_CHAT_BURST,
+        group_rate: float = SEND_GROUP_RATE,
+        group_burst: float = SEND_GROUP_BURST,
+        global_rate: float = SEND_GLOBAL_RATE,
+        global_burst: float = SEND_GLOBAL_BURST,
+        max_retries: int = SEND_MAX_RETRIES,
+    ):
+        self.chats = RateLimiter(chat_rate, chat_burst)
+        self.groups = RateLimiter(group_rate, group_burst)
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.max_retries = max_retries
+        self._paused: dict[int | str, float] = {}  # chat_id -> monotonic, до которого молчим
+        self.calls = 0
+        self.retries = 0
+
+    async def _wait_budget(self, chat_id: int | str) -> None:
+        until = self._paused.get(chat_id)
+        if until is not None:
+            delay = until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._paused.pop(chat_id, None)
+
+        # группы и каналы (отрицательный id или @username) Telegram ограничивает строже
+        limiter = self.chats if isinstance(chat_id, int) and chat_id > 0 else self.groups
+        while (wait := limiter.hit(chat_id)) > 0:
+            await asyncio.sleep(wait)
+        await self.global_bucket.acquire()
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        attempt = 0
+        while True:
+            if chat_id is not None:
+                await self._wait_budget(chat_id)
+            self.calls += 1
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                self.retries += 1
+                logger.warning("%s to %s: retry after %s s", type(method).__name__, chat_id, e.retry_after)
+                if chat_id is not None:
+                    self._paused[chat_id] = time.monotonic() + e.retry_after
+                await asyncio.sleep(e.retry_after)
+
+
+SEND_SCHEDULER = SendScheduler()
+
+
+async def answer_merged(m: Message, texts: Sequence[str], reply_markup: Any = None) -> None:
+    """
+    Несколько коротких ответов подряд — одним сообщением (или сколькими нужно, чтобы
+    влезть в лимит); кнопки — у последнего.
+
+    Склеиваем здесь, а не в SendScheduler: ему приходят уже готовые sendMessage, и
+    каждый вызывающий ждёт свой Message в ответ — склейка там меняла бы результат чужих вызовов.
+    """
+    chunks = split_message("\n\n".join(texts))
+    for chunk in chunks[:-1]:
+        await m.answer(chunk)
+    await m.answer(chunks[-1], reply_markup=reply_markup)
 
 
 # ===================== Translation (RU/EN -> HY) =====================
@@ -170,6 +1501,200 @@ def detect_source_lang(text: str) -> str:
     return "en"
 
 
+def open_db(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+class TranslationCache:
+    """
+    Кэш переводов: key=(src_lang, text) -> перевод.
+    LRU с лимитом по числу записей и по байтам, TTL на запись, отдельный короткий TTL
+    для пустого ответа API (negative cache). Удачные переводы пишутся в SQLite
+    и подгружаются при старте.
+    """
+
+    def __init__(
+        self,
+        max_items: int = TR_CACHE_MAX_ITEMS,
+        max_bytes: int = TR_CACHE_MAX_BYTES,
+        ttl: float = TR_CACHE_TTL,
+        negative_ttl: float = TR_CACHE_NEGATIVE_TTL,
+    ):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data: OrderedDict[tuple[str, str], tuple[str, float]] = OrderedDict()  # -> (value, expires)
+        self.bytes = 0
+        self.db: sqlite3.Connection | None = None
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(key: tuple[str, str], value: str) -> int:
+        return len(key[1].encode()) + len(value.encode()) + 64
+
+    def open(self, path: str) -> None:
+        self.db = open_db(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS tr_cache ("
+            " src TEXT NOT NULL, text TEXT NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL,"
+            " PRIMARY KEY (src, text))"
+        )
+        # протухшее и то, что всё равно не влезет в память, в файле не держим
+        self.db.execute("DELETE FROM tr_cache WHERE expires <= ?", (time.time(),))
+        self.db.execute(
+            "DELETE FROM tr_cache WHERE rowid NOT IN"
+            " (SELECT rowid FROM tr_cache ORDER BY expires DESC LIMIT ?)",
+            (self.max_items,),
+        )
+        self.db.commit()
+
+        rows = self.db.execute(
+            "SELECT src, text, value, expires FROM tr_cache ORDER BY expires DESC LIMIT ?",
+            (self.max_items,),
+        ).fetchall()
+        # самые свежие — в конец, как недавно использованные
+        for src, text, value, expires in reversed(rows):
+            self._put((src, text), value, expires)
+
+    def close(self) -> None:
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def _put(self, key: tuple[str, str], value: str, expires: float) -> None:
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.bytes -= self._size(key, old[0])
+        self._data[key] = (value, expires)
+        self.bytes += self._size(key, value)
+
+        while self._data and (len(self._data) > self.max_items or self.bytes > self.max_bytes):
+            k, (v, _exp) = self._data.popitem(last=False)
+            self.bytes -= self._size(k, v)
+            self.evictions += 1
+
+    def get(self, key: tuple[str, str]) -> str | None:
+        """Перевод; "" — API недавно вернул пустоту; None — в кэше нет."""
+        item = self._data.get(key)
+        if item is None or item[1] <= time.time():
+            if item is not None:
+                del self._data[key]
+                self.bytes -= self._size(key, item[0])
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        if item[0]:
+            self.hits += 1
+        else:
+            self.negative_hits += 1
+        return item[0]
+
+    def set(self, key: tuple[str, str], value: str) -> None:
+        if not value:
+            self._put(key, "", time.time() + self.negative_ttl)
+            return
+
+        expires = time.time() + self.ttl
+        self._put(key, value, expires)
+        if self.db is not None:
+            self.db.execute(
+                "INSERT OR REPLACE INTO tr_cache (src, text, value, expires) VALUES (?, ?, ?, ?)",
+                (key[0], key[1], value, expires),
+            )
+            self.db.commit()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+TR_CACHE = TranslationCache()
+# запросы к API, которые уже в пути: одинаковые (src, text) ждут один и тот же future
+TR_INFLIGHT: dict[tuple[str, str], asyncio.Future] = {}
+
+HTTP_SESSION: aiohttp.ClientSession | None = None
+# всплеск /tr встаёт в очередь здесь, а не бьёт в API разом
+TR_SEMAPHORE = asyncio.Semaphore(TR_MAX_CONCURRENCY)
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=TR_MAX_CONCURRENCY * 2,
+        ttl_dns_cache=300,
+        keepalive_timeout=60,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=TR_TIMEOUT),
+    )
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    # main() создаёт сессию заранее; здесь — на случай вызова вне main()
+    global HTTP_SESSION
+    if HTTP_SESSION is None or HTTP_SESSION.closed:
+        HTTP_SESSION = create_http_session()
+    return HTTP_SESSION
+
+
+async def close_http_session() -> None:
+    global HTTP_SESSION
+    if HTTP_SESSION is not None:
+        await HTTP_SESSION.close()
+        HTTP_SESSION = None
+
+
+class MyMemoryError(Exception):
+    def __init__(self, status: int, details: str):
+        super().__init__(f"{status}: {details}")
+        self.status = status
+
+
+async def fetch_mymemory(text: str, src: str) -> str:
+    """Один запрос к MyMemory (src -> hy). Пустая строка, если перевода нет."""
+    params = {"q": text, "langpair": f"{src}|hy"}
+    if MYMEMORY_EMAIL:
+        params["de"] = MYMEMORY_EMAIL
+
+    t0 = time.perf_counter()
+    try:
+        async with TR_SEMAPHORE:
+            await TR_GLOBAL_BUCKET.acquire()
+            async with get_http_session().get(MYMEMORY_URL, params=params) as r:
+                r.raise_for_status()
+                data = await r.json(content_type=None)
+    except Exception:
+        METRICS.inc("bot_tr_upstream_total", (("result", "error"),))
+        raise
+    finally:
+        METRICS.observe("bot_tr_upstream_seconds", (), time.perf_counter() - t0)
+
+    # при исчерпанной квоте MyMemory отвечает 200, а предупреждение кладёт в translatedText
+    status = data.get("responseStatus", 200)
+    if str(status) != "200":
+        METRICS.inc("bot_tr_upstream_total", (("result", f"status_{status}"),))
+        raise MyMemoryError(int(status) if str(status).isdigit() else 0, data.get("responseDetails") or "")
+
+    translated = ((data.get("responseData") or {}).get("translatedText")) or ""
+    METRICS.inc("bot_tr_upstream_total", (("result", "ok" if translated.strip() else "empty"),))
+    return translated.strip()
+
+
+async def _fetch_and_cache(cache_key: tuple[str, str]) -> str:
+    src, text = cache_key
+    translated = await fetch_mymemory(text, src)
+    TR_CACHE.set(cache_key, translated)
+    return translated
+
+
 async def translate_to_armenian(text: str) -> str:
     text = (text or "").strip()
     if not text:
@@ -179,25 +1704,133 @@ async def translate_to_armenian(text: str) -> str:
     if src == "hy":
         return text
 
+    pre = VOCAB_TR.get((src, text.lower()))
+    if pre:
+        METRICS.inc("bot_translate_total", (("source", "pretranslated"),))
+        return pre
+
     cache_key = (src, text)
-    if cache_key in TR_CACHE:
-        return TR_CACHE[cache_key]
+    cached = TR_CACHE.get(cache_key)
+    if cached is not None:
+        METRICS.inc("bot_translate_total", (("source", "cache"),))
+        return cached or TR_FAIL_TEXT
+
+    fut = TR_INFLIGHT.get(cache_key)
+    if fut is None:
+        METRICS.inc("bot_translate_total", (("source", "upstream"),))
+        fut = asyncio.ensure_future(_fetch_and_cache(cache_key))
+        TR_INFLIGHT[cache_key] = fut
+        fut.add_done_callback(lambda _f: TR_INFLIGHT.pop(cache_key, None))
+    else:
+        METRICS.inc("bot_translate_total", (("source", "coalesced"),))
+
+    # shield: если один из ждущих отменён, общий запрос продолжается для остальных
+    translated = await asyncio.shield(fut)
+    return translated or TR_FAIL_TEXT
+
+# ===================== Pre-translated vocab =====================
+# Слова (и по желанию definition) из Excel переводятся пачкой заранее и лежат в SQLite:
+# /tr и списки слов отвечают из памяти, в API уходит только свободный текст.
+def _open_vocab_tr(path: str) -> sqlite3.Connection:
+    db = open_db(path)
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS vocab_tr ("
+        " src TEXT NOT NULL, text TEXT NOT NULL, value TEXT NOT NULL,"
+        " PRIMARY KEY (src, text))"
+    )
+    return db
 
 
-    url = "https://api.mymemory.translated.net/get"
-    params = {"q": text, "langpair": f"{src}|hy"}
-    if MYMEMORY_EMAIL:
-        params["de"] = MYMEMORY_EMAIL
+def load_vocab_translations(path: str) -> dict[tuple[str, str], str]:
+    db = _open_vocab_tr(path)
+    try:
+        # value="" — API ничего не вернул; храним, чтобы не спрашивать снова
+        return {(src, text): value for src, text, value in db.execute("SELECT src, text, value FROM vocab_tr") if value}
+    finally:
+        db.close()
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, params=params, timeout=25) as r:
-            r.raise_for_status()
-            data = await r.json()
 
-    translated = ((data.get("responseData") or {}).get("translatedText")) or ""
-    translated = translated.strip()
-    TR_CACHE[cache_key] = translated or "Не получилось перевести 😕"
-    return TR_CACHE[cache_key]
+async def _pretranslate_one(text: str) -> str:
+    delay = 1.0
+    for attempt in range(PRETRANSLATE_RETRIES):
+        try:
+            return await fetch_mymemory(text, "en")
+        except MyMemoryError as e:
+            if e.status == 429:  # дневная квота кончилась — ретраи не помогут
+                raise
+            err = e
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            err = e
+        if attempt + 1 < PRETRANSLATE_RETRIES:
+            await asyncio.sleep(delay)
+            delay *= 2
+    raise err
+
+
+async def pretranslate_vocab(with_definitions: bool = False) -> None:
+    """
+    Переводит все WORD (и DEFINITION) из VOCAB на армянский. Можно прерывать и запускать
+    снова: уже переведённое пропускается. Параллельность — TR_MAX_CONCURRENCY.
+    """
+    index = await asyncio.to_thread(load_vocab, FILE_PATH, SHEET_NAMES)
+    db = _open_vocab_tr(DB_PATH)
+    done = {text for (text,) in db.execute("SELECT text FROM vocab_tr WHERE src = 'en'")}
+
+    todo: list[str] = []
+    for it in index.vocab:
+        texts = [it.word_lower]
+        if with_definitions and it.definition:
+            texts.append(it.definition.lower())
+        for t in texts:
+            if t not in done:
+                done.add(t)
+                todo.append(t)
+
+    print(f"to translate: {len(todo)} (already done: {len(done) - len(todo)})")
+    queue: asyncio.Queue[str] = asyncio.Queue()
+    for t in todo:
+        queue.put_nowait(t)
+
+    stop = asyncio.Event()
+    progress = {"ok": 0, "failed": 0, "pending": 0}
+
+    async def worker():
+        while not stop.is_set():
+            try:
+                text = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                value = await _pretranslate_one(text)
+            except MyMemoryError as e:
+                if e.status == 429:
+                    print(f"quota exhausted: {e}")
+                    stop.set()
+                    return
+                progress["failed"] += 1
+                continue
+            except Exception as e:
+                progress["failed"] += 1
+                logger.warning("pretranslate %r failed: %s", text, e)
+                continue
+
+            db.execute("INSERT OR REPLACE INTO vocab_tr (src, text, value) VALUES ('en', ?, ?)", (text, value))
+            progress["ok"] += 1
+            progress["pending"] += 1
+            if progress["pending"] >= PRETRANSLATE_COMMIT_EVERY:
+                db.commit()
+                progress["pending"] = 0
+                print(f"  {progress['ok']}/{len(todo)}")
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(TR_MAX_CONCURRENCY)))
+    finally:
+        db.commit()
+        db.close()
+        await close_http_session()
+
+    print(f"done: {progress['ok']} translated, {progress['failed']} failed, {queue.qsize()} left for the next run")
+
 
 def is_cancel_text(text: str | None) -> bool:
     return (text or "").strip() in {"❌ Отмена", "Отмена"}
@@ -214,6 +1847,188 @@ class QuizState(StatesGroup):
     in_quiz = State()
 
 
+# ===================== FSM storage =====================
+_KEEP = object()  # поле записи не менялось — берём из более старого слоя
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM в SQLite (WAL): состояние теста переживает рестарт, а несколько процессов
+    бота могут работать с одним файлом.
+
+    Записи копятся в памяти и раз в flush_interval (или по max_batch штук) пишутся
+    одной транзакцией в отдельном потоке. Чтение: сначала ещё не записанное,
+    потом то, что пишется прямо сейчас, потом сама база (в своём потоке, чтобы не
+    держать event loop на диске). data хранится компактным JSON.
+    """
+
+    def __init__(self, path: str, flush_interval: float = FSM_FLUSH_INTERVAL, max_batch: int = FSM_MAX_BATCH):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+
+        db = open_db(path)
+        db.execute("CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}')")
+        db.commit()
+        db.close()
+
+        self._rdb: sqlite3.Connection | None = None   # чтение — в self._read_executor
+        self._wdb: sqlite3.Connection | None = None   # запись — в self._executor
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._read_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite-read")
+
+        # key -> [state, data_json]; _KEEP — поле не трогали
+        self._pending: dict[str, list] = {}
+        self._flushing: dict[str, list] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._flush_task: asyncio.Task | None = None
+
+    # --- запись ---
+    def _schedule(self, key: str, state: Any = _KEEP, data: Any = _KEEP) -> None:
+        entry = self._pending.setdefault(key, [_KEEP, _KEEP])
+        if state is not _KEEP:
+            entry[0] = state
+        if data is not _KEEP:
+            entry[1] = data
+
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self.flush())
+
+    def _write_batch(self, batch: dict[str, list]) -> None:
+        if self._wdb is None:
+            self._wdb = open_db(self.path)
+        with self._wdb:
+            for key, (state, data) in batch.items():
+                if state is not _KEEP and data is not _KEEP:
+                    if state is None and data == "{}":
+                        self._wdb.execute("DELETE FROM fsm WHERE key = ?", (key,))
+                    else:
+                        self._wdb.execute(
+                            "INSERT OR REPLACE INTO fsm (key, state, data) VALUES (?, ?, ?)",
+                            (key, state, data),
+                        )
+                elif state is not _KEEP:
+                    self._wdb.execute(
+                        "INSERT INTO fsm (key, state) VALUES (?, ?)"
+                        " ON CONFLICT (key) DO UPDATE SET state = excluded.state",
+                        (key, state),
+                    )
+                else:
+                    self._wdb.execute(
+                        "INSERT INTO fsm (key, data) VALUES (?, ?)"
+                        " ON CONFLICT (key) DO UPDATE SET data = excluded.data",
+                        (key, data),
+                    )
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            if not self._pending:
+                return
+
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+            try:
+                await asyncio.get_running_loop().run_in_executor(self._executor, self._write_batch, batch)
+            except Exception:
+                logger.exception("fsm flush failed, %d keys will be retried", len(batch))
+                for key, (state, data) in batch.items():
+                    entry = self._pending.setdefault(key, [_KEEP, _KEEP])
+                    if entry[0] is _KEEP:
+                        entry[0] = state
+                    if entry[1] is _KEEP:
+                        entry[1] = data
+                if self._flush_handle is None:
+                    self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+            finally:
+                self._flushing = {}
+
+    # --- чтение ---
+    def _unflushed(self, key: str, field: int) -> Any:
+        for layer in (self._pending, self._flushing):
+            entry = layer.get(key)
+            if entry is not None and entry[field] is not _KEEP:
+                return entry[field]
+        return _KEEP
+
+    def _read_row(self, key: str) -> tuple | None:
+        if self._rdb is None:
+            self._rdb = open_db(self.path)
+        return self._rdb.execute("SELECT state, data FROM fsm WHERE key = ?", (key,)).fetchone()
+
+    async def _lookup(self, key: str, field: int) -> Any:
+        value = self._unflushed(key, field)
+        if value is not _KEEP:
+            return value
+
+        row = await asyncio.get_running_loop().run_in_executor(self._read_executor, self._read_row, key)
+        # пока читали, ключ могли переписать — свежая запись важнее прочитанной
+        value = self._unflushed(key, field)
+        if value is not _KEEP:
+            return value
+        if row is None:
+            return None if field == 0 else "{}"
+        return row[field]
+
+    # --- BaseStorage ---
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        self._schedule(self.key_builder.build(key), state=state)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return await self._lookup(self.key_builder.build(key), 0)
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        self._schedule(self.key_builder.build(key), data=json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return json.loads(await self._lookup(self.key_builder.build(key), 1))
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._flush_task is not None:
+            await self._flush_task
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close_writer)
+        self._executor.shutdown(wait=True)
+        await asyncio.get_running_loop().run_in_executor(self._read_executor, self._close_reader)
+        self._read_executor.shutdown(wait=True)
+
+    def _close_reader(self) -> None:
+        if self._rdb is not None:
+            self._rdb.close()
+            self._rdb = None
+
+    def _close_writer(self) -> None:
+        if self._wdb is not None:
+            self._wdb.close()
+            self._wdb = None
+
+
+def create_fsm_storage() -> BaseStorage:
+    """FSM_STORAGE: sqlite (по умолчанию) | memory | redis://... (нужен пакет redis)."""
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    if FSM_STORAGE.startswith(("redis://", "rediss://", "unix://")):
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(FSM_STORAGE)
+    return SQLiteStorage(DB_PATH)
+
+
 # ===================== Keyboards =====================
 def build_kb() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
@@ -236,6 +2051,12 @@ def build_mode_kb() -> InlineKeyboardMarkup:
             [
                 InlineKeyboardButton(text="🧩 Definition → WORD", callback_data="quizmode:dw"),
             ],
+            [
+                InlineKeyboardButton(text="🔥 Похожие варианты: WORD → Def", callback_data="quizmode:wd:hard"),
+            ],
+            [
+                InlineKeyboardButton(text="🔥 Похожие варианты: Def → WORD", callback_data="quizmode:dw:hard"),
+            ],
             [
                 InlineKeyboardButton(text="❌ Stop", callback_data="quiz:stop"),
             ],
@@ -243,13 +2064,15 @@ def build_mode_kb() -> InlineKeyboardMarkup:
     )
 
 
-def build_quiz_answers_kb() -> InlineKeyboardMarkup:
+QUIZ_LETTERS = "ABCDE"
+
+
+def build_quiz_answers_kb(k: int = 3) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
             [
-                InlineKeyboardButton(text="A", callback_data="quizans:0"),
-                InlineKeyboardButton(text="B", callback_data="quizans:1"),
-                InlineKeyboardButton(text="C", callback_data="quizans:2"),
+                InlineKeyboardButton(text=letter, callback_data=f"quizans:{i}")
+                for i, letter in enumerate(QUIZ_LETTERS[:k])
             ],
             [InlineKeyboardButton(text="❌ Stop test", callback_data="quiz:stop")],
         ]
@@ -269,25 +2092,97 @@ def build_unit_page_kb(unit_no: int, page: int, max_page: int) -> InlineKeyboard
 
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
-async def send_unit_page(m: Message, unit_no: int, page: int):
-    items = [it for it in VOCAB if it.get("UNIT NO") == unit_no]
-    if not items:
-        await m.answer(f"Unit {unit_no} не найден или пустой.")
-        return
+PAGE_HEADER_RESERVE = 100  # место под строку "📘 Unit … — страница …"
+
+
+def unit_pages(unit_no: int) -> list[tuple[int, int]] | None:
+    """
+    Границы страниц unit-а [(start, end), ...] по его списку ID: не больше PAGE_SIZE слов
+    и чтобы страница с шапкой влезла в одно сообщение. None — unit-а нет.
+    """
+    key = (VOCAB_VERSION, "pages", unit_no)
+    pages = RENDER_CACHE.get(key)
+    if pages is None:
+        unit_ids = VOCAB_INDEX.unit_ids.get(unit_no)
+        if not unit_ids:
+            return None
+
+        budget = TG_MESSAGE_LIMIT - PAGE_HEADER_RESERVE
+        pages = []
+        start = size = 0
+        for i, _id in enumerate(unit_ids):
+            n = _tg_len(format_items([VOCAB_BY_ID[_id]])) + 2
+            if i > start and (i - start >= PAGE_SIZE or size + n > budget):
+                pages.append((start, i))
+                start, size = i, 0
+            size += n
+        pages.append((start, len(unit_ids)))
+        RENDER_CACHE.set(key, pages)
+    return pages
+
+
+def render_unit_page(unit_no: int, page: int) -> tuple[str, int, int] | None:
+    """
+    (текст, страница, всего страниц) для /unit; None — unit-а нет.
+    Текст одинаков для всех, пока не перечитали словарь, поэтому берётся из RENDER_CACHE.
+    """
+    pages = unit_pages(unit_no)
+    if pages is None:
+        return None
 
-    total = len(items)
-    max_page = max(1, math.ceil(total / PAGE_SIZE))
+    max_page = len(pages)
     page = max(1, min(page, max_page))
 
-    start = (page - 1) * PAGE_SIZE
-    end = start + PAGE_SIZE
-    chunk = items[start:end]
+    key = (VOCAB_VERSION, "unit", unit_no, page)
+    text = RENDER_CACHE.get(key)
+    if text is None:
+        unit_ids = VOCAB_INDEX.unit_ids[unit_no]
+        start, end = pages[page - 1]
+        chunk = [VOCAB_BY_ID[_id] for _id in unit_ids[start:end]]
+
+        text = f"📘 Unit {unit_no} — страница {page}/{max_page} (слова {start+1}-{end} из {len(unit_ids)})\n\n"
+        text += format_items(chunk)
+        # одна запись длиннее сообщения — лучше обрезать, чем не показать страницу вовсе
+        if _tg_len(text) > TG_MESSAGE_LIMIT:
+            text = split_message(text, TG_MESSAGE_LIMIT - 1)[0] + "…"
+        RENDER_CACHE.set(key, text)
+    return text, page, max_page
+
+
+def render_units_list() -> str | None:
+    key = (VOCAB_VERSION, "units")
+    text = RENDER_CACHE.get(key)
+    if text is None:
+        counts = VOCAB_INDEX.unit_counts
+        if not counts:
+            return None
+        text = "Units Enter /unit 4 :\n" + "\n".join([f"/unit {u} : {counts[u]} words" for u in sorted(counts)])
+        RENDER_CACHE.set(key, text)
+    return text
+
+
+async def send_unit_page(m: Message, unit_no: int, page: int, edit: bool = False):
+    """Страница unit-а одним сообщением с кнопками; edit=True — листаем, меняя это же сообщение."""
+    rendered = render_unit_page(unit_no, page)
+    if rendered is None:
+        await m.answer(f"Unit {unit_no} не найден или пустой.")
+        return
 
-    text = f"📘 Unit {unit_no} — страница {page}/{max_page} (слова {start+1}-{min(end, total)} из {total})\n\n"
-    text += format_items(chunk)
+    text, page, max_page = rendered
+    kb = build_unit_page_kb(unit_no, page, max_page)
+    if not edit:
+        await m.answer(text, reply_markup=kb)
+        return
 
-    await send_long(m, text)
-    await m.answer("Навигация:", reply_markup=build_unit_page_kb(unit_no, page, max_page))
+    try:
+        await m.edit_text(text, reply_markup=kb)
+    except TelegramBadRequest as e:
+        # двойной клик по той же кнопке — страница уже такая
+        if "message is not modified" in str(e):
+            return
+        # сообщение слишком старое для правки, удалено и т.п. — шлём страницу заново
+        logger.info("can't edit unit page, sending a new one: %s", e)
+        await m.answer(text, reply_markup=kb)
 
 
 
@@ -299,31 +2194,28 @@ async def start(m: Message):
         "Команды:\n"
         "/range 100 141 — слова по номерам\n"
         "/unit 5 — слова из Unit\n"
-        "/find boring — поиск по слову\n"
+        "/find boring — поиск (слово, перевод, definition)\n"
         "/units — список unit-ов\n"
-        "/tr text — перевод на армянский\n\n"
+        "/tr text — перевод на армянский\n"
+        "/review — повторить слова, которые пора повторить\n"
+        "/stats — твоя статистика тестов, /hard — самые трудные слова\n"
+        "@бот слово — поиск из любого чата\n\n"
         "Кнопки: 🇦🇲 Перевод, 🧪 Тест",
         reply_markup=build_kb(),
     )
 
 
-@router.message(Command("units"))
+@router.message(Command("units"), flags={"rate_limit": "heavy"})
 async def units_cmd(m: Message):
-    counts = {}
-    for it in VOCAB:
-        u = it.get("UNIT NO", 0)
-        if u:
-            counts[u] = counts.get(u, 0) + 1
-
-    if not counts:
+    text = render_units_list()
+    if text is None:
         await m.answer("Units не найдены.")
         return
 
-    text = "Units Enter /unit 4 :\n" + "\n".join([f"/unit {u} : {counts[u]} words" for u in sorted(counts)])
     await m.answer(text)
 
 
-@router.message(Command("range"))
+@router.message(Command("range"), flags={"rate_limit": "heavy"})
 async def range_cmd(m: Message):
     parts = (m.text or "").split()
     if len(parts) < 3:
@@ -344,16 +2236,16 @@ async def range_cmd(m: Message):
         return
 
     a = max(a, 1)
-    b = min(b, VOCAB[-1]["ID"])
+    b = min(b, VOCAB_INDEX.max_id)
 
-    items = [it for it in VOCAB if a <= it["ID"] <= b]
+    items = VOCAB_INDEX.items_in_range(a, b)
     if not items:
         await m.answer("Ничего не найдено.")
         return
 
     await send_long(m, f"Слова {a}–{b}:\n\n" + format_items(items))
 
-@router.message(Command("unit"))
+@router.message(Command("unit"), flags={"rate_limit": "heavy"})
 async def unit_cmd(m: Message):
     parts = (m.text or "").split()
 
@@ -373,7 +2265,7 @@ async def unit_cmd(m: Message):
 
     await send_unit_page(m, unit_no, page)
 
-@router.callback_query(F.data.startswith("unitpage:"))
+@router.callback_query(F.data.startswith("unitpage:"), flags={"rate_limit": "heavy"})
 async def unitpage_cb(cb: CallbackQuery):
     if cb.data == "unitpage:close":
         await cb.message.delete()
@@ -384,20 +2276,18 @@ async def unitpage_cb(cb: CallbackQuery):
     unit_no = int(unit_s)
     page = int(page_s)
 
+    await send_unit_page(cb.message, unit_no, page, edit=True)
     await cb.answer()
-    await cb.message.answer(f"⏭ Открываю Unit {unit_no}, страница {page}…")
-    await send_unit_page(cb.message, unit_no, page)
 
 
-@router.message(Command("find"))
+@router.message(Command("find"), flags={"rate_limit": "heavy"})
 async def find_cmd(m: Message):
     parts = (m.text or "").split(maxsplit=1)
     if len(parts) < 2 or not parts[1].strip():
         await m.answer("Пример: /find boring")
         return
 
-    q = parts[1].strip().lower()
-    items = [it for it in VOCAB if q in _clean_text(it.get("WORD")).lower()][:30]
+    items = VOCAB_INDEX.search.search(parts[1], limit=30)
 
     if not items:
         await m.answer("Не нашёл.")
@@ -406,8 +2296,30 @@ async def find_cmd(m: Message):
     await send_long(m, f"Найдено (первые {len(items)}):\n\n" + format_items(items))
 
 
+@router.message(Command("reload"))
+async def reload_cmd(m: Message):
+    if m.from_user.id not in ADMIN_IDS:
+        return
+
+    try:
+        if WORKER_CONTROL is not None:
+            # WORKERS>1: словарь перечитывает приёмник, процессы перезапускаются уже с ним
+            elapsed, words, version = await WORKER_CONTROL.request_reload(rebuild=True)
+        else:
+            elapsed = await reload_vocab(rebuild=True)
+            words, version = len(VOCAB), VOCAB_VERSION
+    except Exception as e:
+        await m.answer(f"Не смог перечитать словарь 😕 ({type(e).__name__}: {e})")
+        return
+
+    text = f"🔄 Словарь перечитан: {words} слов за {elapsed:.2f} с (версия {version})"
+    if WORKER_CONTROL is not None:
+        text += f"\nПроцессы ({WORKER_CONTROL.n}) перезапускаются с ним — несколько секунд ответы подождут."
+    await m.answer(text)
+
+
 # ---- buttons (подсказки) ----
-@router.message(F.text == "📚 Units")
+@router.message(F.text == "📚 Units", flags={"rate_limit": "heavy"})
 async def units_button(m: Message):
     await units_cmd(m)
 
@@ -424,6 +2336,54 @@ async def unit_help(m: Message):
     await m.answer("Пример: /unit 4")
 
 
+# ===================== Inline mode =====================
+def inline_search(query: str) -> list[int]:
+    """ID результатов для inline-запроса (до INLINE_MAX_RESULTS), с LRU по запросу."""
+    q = " ".join(query.lower().split())
+    key = (VOCAB_VERSION, q)
+    ids = INLINE_CACHE.get(key)
+    if ids is None:
+        if q:
+            ids = [it.id for it in VOCAB_INDEX.search.search(q, limit=INLINE_MAX_RESULTS)]
+        else:
+            # пустой запрос (@bot и пробел) — просто слова по порядку
+            ids = VOCAB_INDEX.ids[:INLINE_MAX_RESULTS]
+        INLINE_CACHE.set(key, ids)
+    return ids
+
+
+def inline_article(it: VocabEntry) -> InlineQueryResultArticle:
+    extra = ", ".join(x for x in (it.dutch, it.pos) if x)
+    return InlineQueryResultArticle(
+        id=str(it.id),
+        title=f"{it.word} ({extra})" if extra else it.word,
+        description=it.definition or None,
+        input_message_content=InputTextMessageContent(message_text=format_items([it])),
+    )
+
+
+def inline_page(query: str, offset: int) -> tuple[list[InlineQueryResultArticle], str]:
+    ids = inline_search(query)
+    page = ids[offset:offset + INLINE_PAGE_SIZE]
+    results = [inline_article(VOCAB_BY_ID[_id]) for _id in page if _id in VOCAB_BY_ID]
+
+    end = offset + len(page)
+    next_offset = str(end) if end < len(ids) else ""
+    return results, next_offset
+
+
+@router.inline_query(flags={"rate_limit": "inline"})
+async def inline_query_handler(iq: InlineQuery):
+    offset = int(iq.offset) if (iq.offset or "").isdigit() else 0
+    results, next_offset = inline_page(iq.query or "", offset)
+    await iq.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=next_offset,
+    )
+
+
 # ===================== Translate (button flow) =====================
 @router.message(F.text == "🇦🇲 Перевод")
 async def tr_button(m: Message, state: FSMContext):
@@ -431,12 +2391,8 @@ async def tr_button(m: Message, state: FSMContext):
     await m.answer("Напиши слово/текст — переведу на армянский 🇦🇲\n(или нажми ❌ Отмена)")
 
 
-@router.message(Command("tr"))
+@router.message(Command("tr"), flags={"rate_limit": "tr"})
 async def tr_cmd(m: Message):
-    if tr_rate_limited(m.from_user.id):
-        await m.answer("⏳ Слишком часто. Подожди 2 секунды 🙂")
-        return
-    
     text = (m.text or "").split(maxsplit=1)
     if len(text) < 2 or not text[1].strip():
         await m.answer("Пример: /tr Hello world")
@@ -449,16 +2405,13 @@ async def tr_cmd(m: Message):
         await m.answer(f"Не смог перевести 😕 ({type(e).__name__})")
 
 
-@router.message(TranslateState.waiting_text)
+@router.message(TranslateState.waiting_text, flags={"rate_limit": "tr"})
 async def tr_state_handler(m: Message, state: FSMContext):
     if is_cancel_text(m.text):
         await state.clear()
         await m.answer("Отменил ✅", reply_markup=build_kb())
         return
-    
-    if tr_rate_limited(m.from_user.id):
-        await m.answer("⏳ Слишком часто. Подожди 2 секунды 🙂")
-        return
+
     if (m.text or "").startswith("/"):
         await m.answer("Если хочешь выйти — нажми ❌ Отмена. Если хочешь перевод — напиши текст без /")
         return
@@ -477,13 +2430,391 @@ async def cancel_any(m: Message, state: FSMContext):
 
 
 
+# ===================== Spaced repetition =====================
+DAY = 24 * 60 * 60
+
+
+@dataclass(slots=True)
+class Card:
+    """Карточка SM-2: как хорошо пользователь знает одно слово."""
+    ef: float = 2.5          # easiness factor
+    interval: float = 0.0    # дней до следующего повторения
+    reps: int = 0            # верных ответов подряд
+    lapses: int = 0          # сколько раз забывал
+    due: float = 0.0         # unix time, когда спросить снова
+
+    def review(self, correct: bool, now: float) -> None:
+        q = 4 if correct else 1  # оценка 0..5 по SM-2; пока только верно/неверно
+        self.ef = max(1.3, self.ef + 0.1 - (5 - q) * (0.08 + (5 - q) * 0.02))
+        if correct:
+            self.reps += 1
+            self.interval = 1.0 if self.reps == 1 else 6.0 if self.reps == 2 else self.interval * self.ef
+            self.due = now + self.interval * DAY
+        else:
+            self.reps = 0
+            self.lapses += 1
+            self.interval = 0.0
+            self.due = now + REVIEW_RELEARN
+
+
+class Deck:
+    """Карточки одного пользователя по word_key + куча (due, key) — ближайшая к повторению сверху."""
+
+    __slots__ = ("cards", "heap", "used")
+
+    def __init__(self):
+        self.cards: dict[int, Card] = {}
+        self.heap: list[tuple[float, int]] = []
+        self.used = time.monotonic()   # для выгрузки из памяти (ReviewScheduler.evict)
+
+    def push(self, key: int, card: Card) -> None:
+        # старую запись из кучи не ищем: она станет "протухшей" (due не совпадёт) и выкинется в peek
+        heapq.heappush(self.heap, (card.due, key))
+        if len(self.heap) > 2 * len(self.cards) + 64:
+            self.heap = [(c.due, w) for w, c in self.cards.items()]
+            heapq.heapify(self.heap)
+
+    def peek(self, alive: Callable[[int], bool]) -> tuple[float, int] | None:
+        """Самая ранняя актуальная карточка; протухшие записи и пропавшие слова — выкидываем."""
+        heap = self.heap
+        while heap:
+            due, key = heap[0]
+            card = self.cards.get(key)
+            if card is not None and card.due == due and alive(key):
+                return heap[0]
+            heapq.heappop(heap)
+        return None
+
+
+class ReviewScheduler:
+    """
+    Интервальное повторение для /review: ответы из всех тестов обновляют карточки SM-2,
+    а /review спрашивает сначала то, что пора повторить. Карточки — по word_key.
+
+    Колода пользователя читается из SQLite в потоке (load) при входе в тест, /review
+    и /stats; изменённые карточки копятся в памяти и пишутся одной транзакцией
+    раз в REVIEW_FLUSH_INTERVAL. После записи колоды без несохранённых карточек,
+    к которым давно не обращались, выгружаются (LRU) — при следующем load прочитаются снова.
+    """
+
+    def __init__(self):
+        self.db: sqlite3.Connection | None = None
+        self.path: str | None = None
+        # user_id -> колода; порядок — от давно не нужной к недавней
+        self.decks: OrderedDict[int, Deck] = OrderedDict()
+        self._dirty: dict[tuple[int, int], Card] = {}
+        self._flush_lock = asyncio.Lock()
+
+    def open(self, path: str) -> None:
+        self.path = path
+        self.db = open_db(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS review_cards ("
+            " user_id INTEGER NOT NULL, word_key INTEGER NOT NULL,"
+            " ef REAL NOT NULL, interval REAL NOT NULL, reps INTEGER NOT NULL,"
+            " lapses INTEGER NOT NULL, due REAL NOT NULL,"
+            " PRIMARY KEY (user_id, word_key)) WITHOUT ROWID"
+        )
+        self.db.commit()
+
+    def _read_cards(self, user_id: int, db: sqlite3.Connection) -> dict[int, Card]:
+        rows = db.execute(
+            "SELECT word_key, ef, interval, reps, lapses, due FROM review_cards WHERE user_id = ?",
+            (user_id,),
+        )
+        return {key: Card(*rest) for key, *rest in rows}
+
+    def _read_cards_in_thread(self, user_id: int) -> dict[int, Card]:
+        db = open_db(self.path)
+        try:
+            return self._read_cards(user_id, db)
+        finally:
+            db.close()
+
+    def _install(self, user_id: int, cards: dict[int, Card]) -> Deck:
+        deck = self.decks[user_id] = Deck()
+        deck.cards = cards
+        deck.heap = [(c.due, k) for k, c in cards.items()]
+        heapq.heapify(deck.heap)
+        return deck
+
+    def _touch(self, user_id: int) -> Deck | None:
+        deck = self.decks.get(user_id)
+        if deck is not None:
+            deck.used = time.monotonic()
+            self.decks.move_to_end(user_id)
+        return deck
+
+    async def load(self, user_id: int) -> Deck:
+        """Колода пользователя; при первом обращении читается из SQLite в потоке."""
+        deck = self._touch(user_id)
+        if deck is not None:
+            return deck
+        if self.path is None:
+            return self.deck(user_id)
+        cards = await asyncio.to_thread(self._read_cards_in_thread, user_id)
+        # пока читали, колоду мог загрузить (и уже изменить) другой апдейт — та главнее
+        return self._touch(user_id) or self._install(user_id, cards)
+
+    def deck(self, user_id: int) -> Deck:
+        """
+        Уже загруженная колода. Хендлеры сначала зовут load(); синхронное чтение
+        здесь — только запасной путь (например, для бенчмарков).
+        """
+        deck = self._touch(user_id)
+        if deck is None:
+            cards = self._read_cards(user_id, self.db) if self.db is not None else {}
+            deck = self._install(user_id, cards)
+        return deck
+
+    def record(self, user_id: int, key: int, correct: bool, now: float | None = None) -> Card:
+        now = time.time() if now is None else now
+        deck = self.deck(user_id)
+        card = deck.cards.get(key)
+        if card is None:
+            card = deck.cards[key] = Card()
+        card.review(correct, now)
+        deck.push(key, card)
+        self._dirty[(user_id, key)] = card
+        return card
+
+    def next_due(self, user_id: int, alive: Callable[[int], bool], now: float | None = None) -> int | None:
+        """word_key слова, которое пора повторить (самое просроченное), или None. O(log n)."""
+        now = time.time() if now is None else now
+        top = self.deck(user_id).peek(alive)
+        if top is None or top[0] > now:
+            return None
+        return top[1]
+
+    def due_count(self, user_id: int, now: float | None = None) -> int:
+        now = time.time() if now is None else now
+        return sum(1 for c in self.deck(user_id).cards.values() if c.due <= now)
+
+    def _write(self, batch: dict[tuple[int, int], tuple]) -> None:
+        db = open_db(self.path)
+        try:
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO review_cards (user_id, word_key, ef, interval, reps, lapses, due)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(*key, *row) for key, row in batch.items()],
+                )
+        finally:
+            db.close()
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._dirty or self.path is None:
+                return
+            # снимок значений: карточки дальше меняются, пока пишем
+            batch = {key: (c.ef, c.interval, c.reps, c.lapses, c.due) for key, c in self._dirty.items()}
+            dirty, self._dirty = self._dirty, {}
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception:
+                logger.exception("review flush failed, %d cards will be retried", len(batch))
+                dirty.update(self._dirty)
+                self._dirty = dirty
+                return
+        self.evict()
+
+    def evict(self, idle: float = REVIEW_DECK_IDLE, max_decks: int = REVIEW_MAX_DECKS,
+              now: float | None = None) -> int:
+        """
+        Выгружает колоды, к которым не обращались дольше idle, и самые давние сверх max_decks.
+        Колоды с ещё не записанными карточками не трогаем. Возвращает, сколько выгружено.
+        """
+        now = time.monotonic() if now is None else now
+        unsaved = {user_id for user_id, _ in self._dirty}
+        excess = len(self.decks) - max_decks
+        victims = []
+        for user_id, deck in self.decks.items():
+            if now - deck.used < idle and len(victims) >= excess:
+                break   # дальше только более свежие
+            if user_id not in unsaved:
+                victims.append(user_id)
+        for user_id in victims:
+            del self.decks[user_id]
+        return len(victims)
+
+    async def run_flusher(self, interval: float = REVIEW_FLUSH_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    async def close(self) -> None:
+        await self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+REVIEW = ReviewScheduler()
+
+
+# ===================== Answer log =====================
+class AnswerLog:
+    """
+    Журнал ответов в тестах: (время, пользователь, слово, режим, верно ли, сколько думал).
+    Слово везде — word_key, а не ID: статистика не переезжает на соседей при правке Excel.
+
+    append() только кладёт событие в буфер — хендлер не ждёт диск. Фоновая задача (run)
+    раз в ANSWER_LOG_FLUSH_INTERVAL или по ANSWER_LOG_BATCH событий пишет буфер одной
+    транзакцией: сами события в answer_log и приращения в агрегаты по пользователю
+    и по слову. Агрегат по пользователю ведётся ещё и в памяти — /stats читает его:
+    все ответы пользователя идут через один процесс (WorkerPool раздаёт по user_id).
+    Агрегат по словам общий для всех процессов, поэтому /hard читает его из SQLite
+    (в потоке, не чаще раза в ANSWER_HARD_TTL).
+    """
+
+    def __init__(self, batch: int = ANSWER_LOG_BATCH):
+        self.batch = batch
+        self.path: str | None = None
+        self._buffer: list[tuple] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        # user_id -> mode -> [ответов, верных, сумма latency в мс]
+        self.user_stats: dict[int, dict[str, list[int]]] = {}
+        self._hardest: tuple | None = None
+
+    def open(self, path: str) -> None:
+        self.path = path
+        db = open_db(path)
+        try:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS answer_log ("
+                " ts REAL NOT NULL, user_id INTEGER NOT NULL, word_key INTEGER NOT NULL,"
+                " mode TEXT NOT NULL, correct INTEGER NOT NULL, latency_ms INTEGER NOT NULL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS answer_user_stats ("
+                " user_id INTEGER NOT NULL, mode TEXT NOT NULL,"
+                " answers INTEGER NOT NULL, correct INTEGER NOT NULL, latency_ms INTEGER NOT NULL,"
+                " PRIMARY KEY (user_id, mode)) WITHOUT ROWID"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS answer_word_stats ("
+                " word_key INTEGER PRIMARY KEY,"
+                " answers INTEGER NOT NULL, wrong INTEGER NOT NULL, latency_ms INTEGER NOT NULL)"
+            )
+            db.commit()
+            for user_id, mode, *row in db.execute("SELECT * FROM answer_user_stats"):
+                self.user_stats.setdefault(user_id, {})[mode] = row
+        finally:
+            db.close()
+
+    def append(self, user_id: int, key: int, mode: str, correct: bool, latency: float) -> None:
+        latency_ms = max(0, int(latency * 1000))
+        self._buffer.append((time.time(), user_id, key, mode, int(correct), latency_ms))
+
+        us = self.user_stats.setdefault(user_id, {}).setdefault(mode, [0, 0, 0])
+        us[0] += 1
+        us[1] += correct
+        us[2] += latency_ms
+
+        if len(self._buffer) >= self.batch:
+            self._wakeup.set()
+
+    def _write(self, events: list[tuple]) -> None:
+        users: dict[tuple[int, str], list[int]] = {}
+        words: dict[int, list[int]] = {}
+        for _ts, user_id, key, mode, correct, latency_ms in events:
+            u = users.setdefault((user_id, mode), [0, 0, 0])
+            u[0] += 1
+            u[1] += correct
+            u[2] += latency_ms
+            w = words.setdefault(key, [0, 0, 0])
+            w[0] += 1
+            w[1] += 1 - correct
+            w[2] += latency_ms
+
+        db = open_db(self.path)
+        try:
+            with db:
+                db.executemany("INSERT INTO answer_log VALUES (?, ?, ?, ?, ?, ?)", events)
+                db.executemany(
+                    "INSERT INTO answer_user_stats VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT (user_id, mode) DO UPDATE SET"
+                    " answers = answers + excluded.answers, correct = correct + excluded.correct,"
+                    " latency_ms = latency_ms + excluded.latency_ms",
+                    [(*key, *row) for key, row in users.items()],
+                )
+                db.executemany(
+                    "INSERT INTO answer_word_stats VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT (word_key) DO UPDATE SET"
+                    " answers = answers + excluded.answers, wrong = wrong + excluded.wrong,"
+                    " latency_ms = latency_ms + excluded.latency_ms",
+                    [(key, *row) for key, row in words.items()],
+                )
+        finally:
+            db.close()
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._buffer or self.path is None:
+                return
+            events, self._buffer = self._buffer, []
+            try:
+                await asyncio.to_thread(self._write, events)
+            except Exception:
+                logger.exception("answer log flush failed, %d events will be retried", len(events))
+                self._buffer[:0] = events
+
+    async def run(self, interval: float = ANSWER_LOG_FLUSH_INTERVAL) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def close(self) -> None:
+        await self.flush()
+
+    # --- отчёты: по агрегатам, не по самому журналу ---
+    def user_report(self, user_id: int) -> dict[str, list[int]]:
+        return self.user_stats.get(user_id, {})
+
+    def _read_hardest(self, limit: int, min_answers: int) -> list[tuple[float, int, list[int]]]:
+        db = open_db(self.path)
+        try:
+            rows = db.execute(
+                "SELECT word_key, answers, wrong, latency_ms FROM answer_word_stats WHERE answers >= ?"
+                " ORDER BY (wrong + 1.0) / (answers + 2) DESC LIMIT ?",
+                (min_answers, limit),
+            ).fetchall()
+        finally:
+            db.close()
+        return [((wrong + 1) / (answers + 2), key, [answers, wrong, latency_ms])
+                for key, answers, wrong, latency_ms in rows]
+
+    async def hardest_words(self, limit: int = 20, min_answers: int = 3) -> list[tuple[float, int, list[int]]]:
+        """
+        (доля ошибок со сглаживанием, word_key, [ответов, ошибок, мс]) — самые трудные сверху.
+        По всем процессам, из SQLite (ответы последних ANSWER_LOG_FLUSH_INTERVAL там ещё нет);
+        запрос — не чаще раза в ANSWER_HARD_TTL, между ними отдаём готовый список.
+        """
+        if self.path is None:
+            return []
+        now = time.monotonic()
+        cached = self._hardest
+        if cached is not None and cached[0] > now and cached[1] == (limit, min_answers):
+            return cached[2]
+        top = await asyncio.to_thread(self._read_hardest, limit, min_answers)
+        self._hardest = (now + ANSWER_HARD_TTL, (limit, min_answers), top)
+        return top
+
+
+ANSWER_LOG = AnswerLog()
+
+
 # ===================== QUIZ =====================
-def parse_quiz_source(text: str) -> tuple[str, list[int], list[int]]:
+def parse_quiz_source(text: str) -> list:
     """
-    Возвращает:
-      label: текст для шапки ("Units: 1,3" или "IDs: 140-160")
-      pool_ids: список ID слов для теста
-      units: список unit-ов (если выбраны), иначе []
+    Возвращает источник пула для теста (см. quiz_pool):
+      ["r", a, b]      — диапазон ID
+      ["u", 1, 3, ...] — unit-ы (может быть пустым: ["u"])
     """
     t = (text or "").strip().lower()
 
@@ -503,27 +2834,10 @@ def parse_quiz_source(text: str) -> tuple[str, list[int], list[int]]:
         if a > b:
             a, b = b, a
 
-        pool_ids = []
-        for it in VOCAB:
-            _id = int(it["ID"])
-            if a <= _id <= b and _clean_text(it.get("WORD")) and _clean_text(it.get("DEFINITION")):
-                pool_ids.append(_id)
-
-        label = f"IDs: {a}-{b}"
-        return label, pool_ids, []
+        return ["r", a, b]
 
     # --- units formats (старое поведение) ---
-    units = parse_units(text)
-    units_set = set(units)
-
-    pool_ids = []
-    for it in VOCAB:
-        if it.get("UNIT NO") in units_set:
-            if _clean_text(it.get("WORD")) and _clean_text(it.get("DEFINITION")):
-                pool_ids.append(int(it["ID"]))
-
-    label = f"Units: {', '.join(map(str, units))}" if units else "Units: (none)"
-    return label, pool_ids, units
+    return ["u", *parse_units(text)]
 
 
 def parse_units(text: str) -> list[int]:
@@ -564,129 +2878,263 @@ def parse_units(text: str) -> list[int]:
     return sorted(units)
 
 
-def build_pool(units: list[int]) -> list[int]:
-    # Берём только те слова, где есть и WORD и DEFINITION
-    pool = []
-    units_set = set(units)
-    for it in VOCAB:
-        if it.get("UNIT NO") in units_set:
-            if _clean_text(it.get("WORD")) and _clean_text(it.get("DEFINITION")):
-                pool.append(int(it["ID"]))
-    return pool
-
-
-def pick_options(correct_id: int, pool_ids: list[int], mode: str) -> tuple[list[str], int]:
+# Сессия теста в FSM — один компактный dict под ключом "quiz":
+#   src   — откуда пул: ["u", 1, 3] (unit-ы), ["r", 140, 160] (диапазон ID)
+#           или ["due"] — /review по всему словарю: сначала то, что пора повторить
+#   seed  — вопрос номер pos = QuizPool.nth(seed, pos) (перестановка _permute)
+#   mode  — "wd" / "dw";  hard — 1, если варианты подбираются похожими
+#   k     — вариантов ответа (3..5);  n — вопросов всего;  pos — сколько уже задано
+#   score — верных ответов (ошибок, значит, pos - score)
+#   cur   — word_key текущего слова;  opts — word_key вариантов (A/B/C...), среди них cur
+#   missed — word_key первых QUIZ_MISSED_SHOWN слов с ошибкой (для итога)
+#   t     — когда задан текущий вопрос (для latency в журнале ответов)
+# Слова — по word_key, а не по ID: Excel могут поправить посреди теста, и ID начнут
+# значить другое слово. Поэтому же ошибки — ключами, а не битсетом по номеру вопроса:
+# после перезагрузки словаря номер вопроса указывает уже на другое слово. Тест
+# переживает перезагрузку и продолжается по новому пулу; заканчивается он, только
+# если пропало само слово текущего вопроса. Тексты вариантов в состоянии не лежат.
+def _permute(i: int, n: int, seed: int) -> int:
     """
-    mode:
-      wd: options = definitions
-      dw: options = words
+    i-й элемент случайной перестановки [0, n), заданной seed, — без построения
+    всей перестановки: сеть Фейстеля на чётном числе бит, покрывающем n, и
+    "cycle walking" (пока результат >= n, шифруем дальше; в среднем < 4 шагов).
+    hash() кортежа int не зависит от PYTHONHASHSEED — порядок тот же во всех процессах.
     """
-    correct_item = VOCAB_BY_ID[correct_id]
-    if mode == "wd":
-        correct_text = _clean_text(correct_item.get("DEFINITION"))
-        get_text = lambda _id: _clean_text(VOCAB_BY_ID[_id].get("DEFINITION"))
-    else:
-        correct_text = _clean_text(correct_item.get("WORD"))
-        get_text = lambda _id: _clean_text(VOCAB_BY_ID[_id].get("WORD"))
-
-    # Берём 2 других ID (для вариантов) из пула, исключая correct
-    others = [x for x in pool_ids if x != correct_id]
-    wrong_ids = random.sample(others, 2)
-
-    options = [correct_text, get_text(wrong_ids[0]), get_text(wrong_ids[1])]
-    random.shuffle(options)
-    correct_idx = options.index(correct_text)
-    return options, correct_idx
-
-async def send_next_question(m: Message, state: FSMContext):
-    st = await state.get_data()
-
-    order: list[int] = st.get("quiz_order", [])
-    pos: int = st.get("quiz_pos", 0)
-    score: int = st.get("quiz_score", 0)
-    total: int = st.get("quiz_total", 0)
-    mode: str = st.get("quiz_mode", "wd")  # "wd" или "dw"
-    label: str = st.get("quiz_label", "Test")
-    pool_ids: list[int] = st.get("quiz_pool_ids", [])
-    wrong_ids: list[int] = st.get("quiz_wrong", [])
-
-   # если тест закончился
-    if pos >= total:
-        label = st.get("quiz_label", f"Units: {', '.join(map(str, units))}" if units else "Test")
-        summary = (
-            f"🏁 Тест закончен!\n"
-            f"{label}\n"
-            f"✅ {score}/{total}"
-        )
+    bits = max(2, (n - 1).bit_length())
+    half = (bits + 1) // 2
+    mask = (1 << half) - 1
+    x = i
+    while True:
+        left, right = x >> half, x & mask
+        for rnd in range(4):
+            left, right = right, left ^ (hash((seed, rnd, right)) & mask)
+        x = (left << half) | right
+        if x < n:
+            return x
+
+
+class QuizPool:
+    """
+    Пул теста поверх VocabIndex: порядок вопросов и подбор неправильных вариантов.
 
-        if not wrong_ids:
-            await state.clear()
-            await m.answer(summary + "\n\n🔥 Ошибок нет!")
-            return
+    Пул не копирует ID: это отрезок index.quiz_ids (диапазон, повторение) или
+    несколько списков index.unit_quiz_ids (unit-ы), так что строится за O(число unit-ов).
+    Вопрос номер pos — nth(seed, pos): элемент перестановки, которая считается
+    на лету (_permute), без сортировки всего пула.
 
-        # убрать дубли, сохранив порядок
-        seen = set()
-        uniq_wrong = []
-        for wid in wrong_ids:
-            if wid not in seen:
-                seen.add(wid)
-                uniq_wrong.append(wid)
-
-        lines = []
-        for wid in uniq_wrong[:30]:  # покажем первые 30
-            it = VOCAB_BY_ID.get(int(wid))
-            if not it:
-                continue
-            w = _clean_text(it.get("WORD"))
-            d = _clean_text(it.get("DEFINITION"))
-            lines.append(f"• {w} — {d}")
+    Варианты выбираются за O(1) независимо от размера пула: случайный элемент
+    с отбраковкой (тот же текст, что у правильного или уже выбранного), а "сложные" —
+    из соседей, посчитанных при загрузке словаря (VocabIndex.neighbours).
+    """
 
-        await state.clear()
-        await m.answer(summary + f"\n\n❌ Ошибки ({len(uniq_wrong)}):\n" + "\n".join(lines))
-        if len(uniq_wrong) > 30:
-            await m.answer("…и ещё есть ошибки, но я показал первые 30.")
-        return
+    MAX_TRIES = 16  # попыток на один вариант, дальше — линейный проход по пулу
+
+    def __init__(self, index: VocabIndex, src: list):
+        self.index = index
+        self.src = src
+        # куски пула: (список ID, с какого места в нём); _starts — где кусок начинается в пуле
+        if src[0] == "due":
+            self._parts = [(index.quiz_ids, 0)]
+            self._starts = [0]
+            self._n = len(index.quiz_ids)
+            self._range, self._units = (0, index.max_id), None
+        elif src[0] == "r":
+            lo = bisect_left(index.quiz_ids, src[1])
+            hi = bisect_right(index.quiz_ids, src[2])
+            self._parts = [(index.quiz_ids, lo)]
+            self._starts = [0]
+            self._n = max(0, hi - lo)
+            self._range, self._units = (src[1], src[2]), None
+        else:
+            self._parts, self._starts, n = [], [], 0
+            for u in sorted(set(src[1:])):
+                ids = index.unit_quiz_ids.get(u)
+                if ids:
+                    self._parts.append((ids, 0))
+                    self._starts.append(n)
+                    n += len(ids)
+            self._n = n
+            self._range, self._units = None, frozenset(src[1:])
+
+    def __len__(self) -> int:
+        return self._n
+
+    def id_at(self, i: int) -> int:
+        """i-й ID пула (0 <= i < len) в порядке индекса."""
+        if len(self._parts) == 1:
+            ids, off = self._parts[0]
+            return ids[off + i]
+        j = bisect_right(self._starts, i) - 1
+        ids, off = self._parts[j]
+        return ids[off + i - self._starts[j]]
+
+    def nth(self, seed: int, pos: int) -> int:
+        """ID вопроса номер pos (с 0) теста с этим seed; без повторов, пока pos < len."""
+        return self.id_at(_permute(pos, self._n, seed))
+
+    def random_id(self) -> int:
+        return self.id_at(random.randrange(self._n))
+
+    def __contains__(self, _id: int) -> bool:
+        it = self.index.by_id.get(_id)
+        if it is None or not it.quiz_ok:
+            return False
+        if self._range is not None:
+            return self._range[0] <= _id <= self._range[1]
+        return it.unit in self._units
+
+    def sample_new(self, seen: dict[int, Any]) -> int | None:
+        """
+        Случайное слово пула, чьего word_key нет в seen (новое для /review);
+        None — почти всё уже видели.
+        """
+        by_id = self.index.by_id
+        for _ in range(self.MAX_TRIES * 4):
+            _id = self.random_id()
+            if by_id[_id].key not in seen:
+                return _id
+        return None
+
+    def options(self, correct_id: int, k: int, mode: str, hard: bool = False) -> list[int]:
+        """ID вариантов ответа (до k штук, среди них correct_id) в случайном порядке."""
+        by_id = self.index.by_id
+        field = "definition" if mode == "wd" else "word"
+        chosen = [correct_id]
+        seen = {getattr(by_id[correct_id], field)}
+
+        def take(_id: int) -> None:
+            text = getattr(by_id[_id], field)
+            if text not in seen:
+                seen.add(text)
+                chosen.append(_id)
+
+        if hard:
+            near = [_id for _id in self.index.neighbours_of(correct_id) if _id and _id in self]
+            random.shuffle(near)
+            for _id in near[:k - 1]:
+                take(_id)
+
+        tries = self.MAX_TRIES * k
+        while len(chosen) < k and tries:
+            take(self.random_id())
+            tries -= 1
+        if len(chosen) < k:
+            # в пуле много одинаковых definition — добираем честным проходом
+            for i in range(self._n):
+                if len(chosen) == k:
+                    break
+                take(self.id_at(i))
+
+        random.shuffle(chosen)
+        return chosen
+
+
+def get_quiz_pool(src: list) -> QuizPool:
+    key = (VOCAB_VERSION, tuple(src))
+    pool = QUIZ_POOL_CACHE.get(key)
+    if pool is None:
+        pool = QuizPool(VOCAB_INDEX, src)
+        QUIZ_POOL_CACHE.set(key, pool)
+    return pool
 
-    # следующий вопрос
-    correct_id = order[pos]
-    correct_item = VOCAB_BY_ID[correct_id]
 
-    # варианты (A/B/C)
-    options, correct_idx = pick_options(correct_id, pool_ids, mode)
+def quiz_item(key: int) -> VocabEntry | None:
+    """Слово сессии теста по word_key в текущем словаре; None — его больше нет."""
+    return VOCAB_BY_ID.get(VOCAB_INDEX.id_by_key.get(key, 0))
+
+
+def quiz_label(src: list) -> str:
+    if src[0] == "due":
+        return "🔁 Повторение"
+    if src[0] == "r":
+        return f"IDs: {src[1]}-{src[2]}"
+    return f"Units: {', '.join(map(str, src[1:]))}" if len(src) > 1 else "Units: (none)"
+
+
+def next_question(sess: dict, user_id: int) -> bool:
+    """Ставит в sess следующий вопрос (cur, opts, pos). False — вопросы кончились."""
+    pool = get_quiz_pool(sess["src"])
+    # словарь могли перезагрузить и пул — уменьшиться; уже заданное остаётся в счёте
+    sess["n"] = max(sess["pos"], min(sess["n"], len(pool)))
+    if sess["pos"] >= sess["n"] or len(pool) < 3:
+        sess["n"] = sess["pos"]
+        return False
+
+    ids = pool.index.id_by_key
+    if sess["src"][0] == "due":
+        # сначала то, что пора повторить, потом новые слова
+        key = REVIEW.next_due(user_id, lambda k: ids.get(k, 0) in pool)
+        cur = ids[key] if key is not None else pool.sample_new(REVIEW.deck(user_id).cards)
+        if cur is None:
+            sess["n"] = sess["pos"]
+            return False
+    else:
+        cur = pool.nth(sess["seed"], sess["pos"])
+    by_id = pool.index.by_id
+    sess["cur"] = by_id[cur].key
+    sess["opts"] = [by_id[_id].key for _id in pool.options(cur, sess["k"], sess["mode"], sess.get("hard", 0))]
+    sess["pos"] += 1
+    return True
 
-    # сохраняем текущий вопрос и сдвигаем позицию вперёд (чтобы не повторялся)
-    await state.update_data(
-        quiz_correct_idx=correct_idx,
-        quiz_options=options,
-        quiz_current_id=correct_id,
-        quiz_pos=pos + 1,
-    )
 
-    word = _clean_text(correct_item.get("WORD"))
-    definition = _clean_text(correct_item.get("DEFINITION"))
+def render_question(sess: dict) -> str:
+    # сразу после next_question — все ключи есть в словаре
+    item = quiz_item(sess["cur"])
+    pos = sess["pos"]
 
-    qn = pos + 1
     header = (
-    f"🧪 Тест ({qn}/{total}) | Score: {score}/{pos}\n"
-    f"{label}\n"
+    f"🧪 Тест ({pos}/{sess['n']}) | Score: {sess['score']}/{pos - 1}\n"
+    f"{quiz_label(sess['src'])}\n"
     )
 
-    if mode == "wd":
-        body = (
-            f"\nСлово: {word}\n\n"
-            f"A) {options[0]}\n\n"
-            f"B) {options[1]}\n\n"
-            f"C) {options[2]}"
-        )
+    if sess["mode"] == "wd":
+        body = f"\nСлово: {item.word}\n\n"
+        options = [quiz_item(key).definition for key in sess["opts"]]
     else:
-        body = (
-            f"\nDefinition: {definition}\n\n"
-            f"A) {options[0]}\n\n"
-            f"B) {options[1]}\n\n"
-            f"C) {options[2]}"
-        )
+        body = f"\nDefinition: {item.definition}\n\n"
+        options = [quiz_item(key).word for key in sess["opts"]]
+
+    body += "\n\n".join(f"{letter}) {text}" for letter, text in zip(QUIZ_LETTERS, options))
+    return header + body
+
+
+def render_summary(sess: dict) -> list[str]:
+    summary = (
+        f"🏁 Тест закончен!\n"
+        f"{quiz_label(sess['src'])}\n"
+        f"✅ {sess['score']}/{sess['n']}"
+    )
+
+    errors = sess["n"] - sess["score"]
+    if errors <= 0:
+        return [summary + "\n\n🔥 Ошибок нет!"]
+
+    # удалённые из словаря слова просто не покажем
+    lines = []
+    for key in sess.get("missed") or ():
+        it = quiz_item(key)
+        if it:
+            lines.append(f"• {it.word} — {it.definition}")
+
+    messages = [summary + f"\n\n❌ Ошибки ({errors}):\n" + "\n".join(lines)]
+    if errors > QUIZ_MISSED_SHOWN:
+        messages.append(f"…и ещё есть ошибки, но я показал первые {QUIZ_MISSED_SHOWN}.")
+    return messages
+
+
+async def send_next_question(m: Message, state: FSMContext, sess: dict, before: Sequence[str] = ()):
+    """
+    Следующий вопрос или итог; состояние пишется одним set_data/clear.
+    before — то, что надо сказать перед вопросом (ответ на прошлый): уходит тем же сообщением.
+    """
+    if next_question(sess, state.key.user_id):
+        sess["t"] = round(time.time(), 2)
+        await state.set_data({"quiz": sess})
+        await answer_merged(m, [*before, render_question(sess)], build_quiz_answers_kb(len(sess["opts"])))
+        return
 
-    await m.answer(header + body, reply_markup=build_quiz_answers_kb())
+    await state.clear()
+    await answer_merged(m, [*before, *render_summary(sess)])
 
 
 
@@ -701,11 +3149,12 @@ async def quiz_start(m: Message, state: FSMContext):
     )
 
 
-@router.message(QuizState.waiting_units)
+@router.message(QuizState.waiting_units, flags={"rate_limit": "heavy"})
 async def quiz_set_units(m: Message, state: FSMContext):
-    label, pool_ids, units = parse_quiz_source(m.text or "")
+    src = parse_quiz_source(m.text or "")
+    seed = random.getrandbits(31)
 
-    if len(pool_ids) < 3:
+    if len(get_quiz_pool(src)) < 3:
         await m.answer(
             "Слишком мало слов с definition для теста (нужно минимум 3).\n"
             "Примеры:\n"
@@ -714,36 +3163,90 @@ async def quiz_set_units(m: Message, state: FSMContext):
         )
         return
 
-    await state.update_data(
-        quiz_label=label,
-        quiz_units=units,
-        quiz_pool_ids=pool_ids,
-    )
+    await state.set_data({"quiz": {"src": src, "seed": seed}})
     await state.set_state(QuizState.waiting_mode)
     await m.answer("Выбери режим теста:", reply_markup=build_mode_kb())
 
 
+@router.message(Command("review"))
+async def review_start(m: Message, state: FSMContext):
+    await REVIEW.load(m.from_user.id)
+    due = REVIEW.due_count(m.from_user.id)
+    await state.set_data({"quiz": {"src": ["due"], "seed": 0}})
+    await state.set_state(QuizState.waiting_mode)
+    await m.answer(
+        f"🔁 Повторение: пора повторить {due} сл.\n"
+        "Сначала спрошу их, потом — новые слова.\n"
+        "Выбери режим:",
+        reply_markup=build_mode_kb(),
+    )
+
+
+@router.message(Command("stats"))
+async def stats_cmd(m: Message):
+    report = ANSWER_LOG.user_report(m.from_user.id)
+    if not report:
+        await m.answer("Ты ещё не проходил тесты. Нажми 🧪 Тест.")
+        return
+
+    names = {"wd": "WORD → Definition", "dw": "Definition → WORD"}
+    total = sum(row[0] for row in report.values())
+    correct = sum(row[1] for row in report.values())
+    lines = [f"📊 Ответов: {total}, верно: {correct} ({correct * 100 // total}%)"]
+    for mode, (answers, ok, latency_ms) in sorted(report.items()):
+        lines.append(
+            f"• {names.get(mode, mode)}: {ok}/{answers} ({ok * 100 // answers}%), "
+            f"в среднем {latency_ms / answers / 1000:.1f} с на ответ"
+        )
+
+    # свои трудные слова — из карточек /review: больше всего забываний
+    deck = await REVIEW.load(m.from_user.id)
+    worst = heapq.nlargest(5, ((c.lapses, k) for k, c in deck.cards.items() if c.lapses))
+    if worst:
+        lines.append("\nЧаще всего ошибаешься:")
+        for lapses, key in worst:
+            it = VOCAB_BY_ID.get(VOCAB_INDEX.id_by_key.get(key, 0))
+            if it:
+                lines.append(f"• {it.word} — {lapses}×")
+        lines.append("Повторить: /review")
+    await m.answer("\n".join(lines))
+
+
+@router.message(Command("hard"))
+async def hard_cmd(m: Message):
+    lines = []
+    for rate, key, (answers, wrong, _latency_ms) in await ANSWER_LOG.hardest_words():
+        it = VOCAB_BY_ID.get(VOCAB_INDEX.id_by_key.get(key, 0))
+        if it:
+            lines.append(f"• {it.word} — ошибок {wrong}/{answers}")
+    if not lines:
+        await m.answer("Пока мало ответов, чтобы понять, какие слова трудные.")
+        return
+    await m.answer("🔥 Самые трудные слова (по всем тестам):\n" + "\n".join(lines))
+
+
 @router.callback_query(F.data.startswith("quizmode:"))
 async def quiz_choose_mode(cb: CallbackQuery, state: FSMContext):
-    st = await state.get_data()
-    if not st.get("quiz_pool_ids"):
+    sess = (await state.get_data()).get("quiz")
+    if not sess:
         await cb.answer("Сначала выбери unit-ы", show_alert=True)
         return
 
-    mode = cb.data.split(":", 1)[1]  # wd / dw
-    await state.update_data(quiz_mode=mode)
+    _, mode, *hard = cb.data.split(":")  # wd / dw [:hard]
+    sess["mode"] = mode
+    sess["hard"] = int(bool(hard))
+    await state.set_data({"quiz": sess})
     await state.set_state(QuizState.waiting_count)
 
-    max_possible = len(st["quiz_pool_ids"])
+    max_possible = len(get_quiz_pool(sess["src"]))
     await cb.message.answer(f"Сколько вопросов? (1..{max_possible})\nНапример: 10")
     await cb.answer()
 
 
 @router.message(QuizState.waiting_count)
 async def quiz_set_count(m: Message, state: FSMContext):
-    st = await state.get_data()
-    pool_ids: list[int] = st["quiz_pool_ids"]
-    max_possible = len(pool_ids)
+    sess = (await state.get_data())["quiz"]
+    max_possible = len(get_quiz_pool(sess["src"]))
 
     text = (m.text or "").strip().lower()
     if text.isdigit():
@@ -751,99 +3254,816 @@ async def quiz_set_count(m: Message, state: FSMContext):
     else:
         total = 10  # дефолт
 
-    total = max(1, min(total, max_possible))
-
-    # порядок вопросов без повторов
-    order = pool_ids[:]
-    random.shuffle(order)
-    order = order[:total]
-
-    await state.update_data(
-        quiz_order=order,
-        quiz_total=total,
-        quiz_pos=0,
-        quiz_score=0,
-        quiz_wrong=[],
-    )
+    k = min(QUIZ_OPTIONS, max_possible)
+    sess.update(n=max(1, min(total, max_possible)), k=k, pos=0, score=0, missed=[])
+    # ответы пишутся в карточки /review — колоду читаем сейчас, не в первом ответе
+    await REVIEW.load(m.from_user.id)
     await state.set_state(QuizState.in_quiz)
 
-    await m.answer("Старт! Выбирай A / B / C")
-    await send_next_question(m, state)
+    await send_next_question(m, state, sess, [f"Старт! Выбирай {' / '.join(QUIZ_LETTERS[:k])}"])
 
 
 @router.callback_query(F.data == "quiz:stop")
 async def quiz_stop(cb: CallbackQuery, state: FSMContext):
-    st = await state.get_data()
-    score = st.get("quiz_score", 0)
-    pos = st.get("quiz_pos", 0)
-    total = st.get("quiz_total", pos)
-    units = st.get("quiz_units", [])
+    sess = (await state.get_data()).get("quiz") or {}
+    score = sess.get("score", 0)
+    pos = sess.get("pos", 0)
+    label = quiz_label(sess["src"]) if "src" in sess else "Test"
     await state.clear()
-    await cb.message.answer(f"Остановил тест ✅\nUnits: {', '.join(map(str, units))}\nСчёт: ✅ {score}/{min(pos, total)}")
+    await cb.message.answer(f"Остановил тест ✅\n{label}\nСчёт: ✅ {score}/{pos}")
     await cb.answer()
 
 
 @router.callback_query(F.data.startswith("quizans:"))
 async def quiz_answer(cb: CallbackQuery, state: FSMContext):
-    st = await state.get_data()
-    if not st.get("quiz_options"):
+    # одно чтение состояния на ответ; запись — одна, в send_next_question
+    sess = (await state.get_data()).get("quiz")
+    if not sess or "opts" not in sess:
         await cb.answer("Теста нет. Нажми 🧪 Тест.", show_alert=True)
         await state.clear()
         return
 
+    item = quiz_item(sess["cur"])
+    if item is None:
+        # слово вопроса убрали из Excel посреди теста — ответ не засчитываем,
+        # тест заканчиваем с тем, что уже есть
+        sess["n"] = sess["pos"] - 1
+        await cb.answer()
+        await state.clear()
+        await answer_merged(cb.message, [
+            "🔄 Этого слова больше нет в словаре — вопрос не засчитан.", *render_summary(sess),
+        ])
+        return
+
+    # варианты пользователь уже видел: для подсчёта хватает их ключей, даже если
+    # какой-то из них успели убрать из словаря
     chosen = int(cb.data.split(":")[1])
-    correct_idx = st["quiz_correct_idx"]
-    options = st["quiz_options"]
-    mode = st.get("quiz_mode", "wd")
-    current_id = st.get("quiz_current_id")
+    correct_idx = sess["opts"].index(sess["cur"])
+    word, definition = item.word, item.definition
+
+    correct = chosen == correct_idx
+    # колода уже загружена на старте теста; load() тут — если бот перезапускался посреди теста
+    await REVIEW.load(cb.from_user.id)
+    REVIEW.record(cb.from_user.id, item.key, correct)
+    ANSWER_LOG.append(cb.from_user.id, item.key, sess["mode"], correct, time.time() - sess.get("t", time.time()))
+
+    if correct:
+        sess["score"] += 1
+        verdict = "✅ Верно!"
+    else:
+        corr_letter = QUIZ_LETTERS[correct_idx]
+        verdict = f"❌ Неверно. Правильный ответ: {corr_letter}"
+        if len(sess["missed"]) < QUIZ_MISSED_SHOWN:
+            sess["missed"].append(item.key)
 
-    item = VOCAB_BY_ID.get(int(current_id))
-    word = _clean_text(item.get("WORD")) if item else ""
-    definition = _clean_text(item.get("DEFINITION")) if item else ""
+    # показ правильной пары
+    if sess["mode"] == "wd":
+        pair = f"{word} — {definition}"
+    else:
+        pair = f"{definition}\n— {word}"
 
-    score = st.get("quiz_score", 0)
+    await cb.answer()
 
-    if chosen == correct_idx:
-        score += 1
-        await cb.message.answer("✅ Верно!")
-    else:
-        corr_letter = ["A", "B", "C"][correct_idx]
-        await cb.message.answer(f"❌ Неверно. Правильный ответ: {corr_letter}")
+    # вердикт, правильная пара и следующий вопрос — одним сообщением
+    await send_next_question(cb.message, state, sess, [f"{verdict}\n{pair}"])
 
-        wrong_list = st.get("quiz_wrong", [])
-        wrong_list.append(int(current_id))  # сохраняем ID слова, которое завалил
-        await state.update_data(quiz_wrong=wrong_list)
 
+# ===================== Profiling (/profile) =====================
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
 
-    # показ правильной пары
-    if mode == "wd":
-        await cb.message.answer(f"{word} — {definition}")
-    else:
-        await cb.message.answer(f"{definition}\n— {word}")
 
-    await state.update_data(quiz_score=score)
-    await cb.answer()
+_STDLIB_DIR = os.path.dirname(os.__file__)
+
+
+class Profiler:
+    """
+    Профиль работающего процесса по команде администратора, без рестарта:
+      cProfile    — точное время функций в потоке event loop (хендлеры, рендер, поиск);
+      сэмплер     — раз в PROFILE_SAMPLE_INTERVAL снимает стеки всех потоков: видно и то,
+                    что ушло в asyncio.to_thread (загрузка Excel), и сколько loop ждёт сеть
+                    (стоит в select);
+      tracemalloc — какие строки выделили больше всего памяти за это время.
+    Пока профиль снимается, бот работает медленнее — поэтому только на заданное время.
+    """
+
+    def __init__(self):
+        self.running = False
+        self.stop_early: asyncio.Event | None = None
+        self.task: asyncio.Task | None = None
+        self._profile: cProfile.Profile | None = None
+        self._snapshot: tracemalloc.Snapshot | None = None
+        self._own_tracemalloc = False
+        self._sampling = threading.Event()
+        self._sampler: threading.Thread | None = None
+        self._leaf: Counter = Counter()   # code -> сколько раз поток был именно здесь
+        self._stack: Counter = Counter()  # code -> сколько раз был где-то в стеке
+        self._samples = 0
+        self._started = 0.0
+
+    def start(self) -> None:
+        self.running = True
+        self.stop_early = asyncio.Event()
+        self._leaf.clear()
+        self._stack.clear()
+        self._samples = 0
+        self._started = time.monotonic()
+
+        self._own_tracemalloc = not tracemalloc.is_tracing()
+        if self._own_tracemalloc:
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+        self._snapshot = tracemalloc.take_snapshot()
+
+        self._sampling.clear()
+        self._sampler = threading.Thread(target=self._sample, name="profiler-sampler", daemon=True)
+        self._sampler.start()
+        # cProfile видит только свой поток — включаем его в потоке event loop
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def _sample(self) -> None:
+        me = threading.get_ident()
+        while not self._sampling.wait(PROFILE_SAMPLE_INTERVAL):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                self._samples += 1
+                self._leaf[frame.f_code] += 1
+                seen = set()
+                while frame is not None:
+                    if frame.f_code not in seen:  # рекурсия считается один раз
+                        seen.add(frame.f_code)
+                        self._stack[frame.f_code] += 1
+                    frame = frame.f_back
+
+    async def stop(self) -> tuple[str, list[str]]:
+        """Останавливает профиль; -> (отчёт для чата, пути файлов с полным отчётом)."""
+        self._profile.disable()
+        self._sampling.set()
+        try:
+            # снимок памяти, pstats и запись файлов — не в event loop
+            return await asyncio.to_thread(self._finish, time.monotonic() - self._started)
+        finally:
+            self.running = False
+
+    def _finish(self, elapsed: float) -> tuple[str, list[str]]:
+        self._sampler.join()
+        snapshot = tracemalloc.take_snapshot()
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen *>"))
+        allocs = snapshot.filter_traces(ignore).compare_to(self._snapshot.filter_traces(ignore), "lineno")
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        prefix = os.path.join(PROFILE_DIR, time.strftime("profile-%Y%m%d-%H%M%S") + f"-{os.getpid()}")
+        self._profile.dump_stats(prefix + ".pstats")
+        stats = pstats.Stats(self._profile)
+        with open(prefix + ".txt", "w", encoding="utf-8") as f:
+            f.write(self._report(elapsed, stats, allocs, top=100))
+            f.write("\n\n")
+            stats.stream = f
+            stats.sort_stats("cumulative").print_stats(100)
+
+        self._profile = None
+        self._snapshot = None
+        return self._report(elapsed, stats, allocs, top=PROFILE_TOP), [prefix + ".pstats", prefix + ".txt"]
+
+    def _report(self, elapsed: float, stats: pstats.Stats,
+                allocs: list[tracemalloc.StatisticDiff], top: int) -> str:
+        # stats.stats: (файл, строка, функция) -> (cc, nc, tt, ct, callers)
+        rows = sorted(stats.stats.items(), key=lambda kv: kv[1][2], reverse=True)[:top]
+        lines = [f"⏱ Профиль за {elapsed:.1f} с, pid {os.getpid()}", "",
+                 "Функции в event loop (cProfile): своё время / с вложенными / вызовов"]
+        for (filename, lineno, name), (_cc, nc, tt, ct, _callers) in rows:
+            lines.append(f"{tt:7.3f}s {ct:7.3f}s {nc:>8} {name} ({os.path.basename(filename)}:{lineno})")
+
+        n = max(1, self._samples)
+        lines += ["", f"Снимки стеков всех потоков ({self._samples}): где были / где-то в стеке"]
+        for code, count in self._leaf.most_common(top):
+            lines.append(f"{count / n:6.1%} {self._stack[code] / n:6.1%}  {_frame_label(code)}")
+        # рамки asyncio/threading есть в каждом стеке и ничего не говорят — только наш код и библиотеки
+        lines += ["", "Чаще всего в стеке (с вызванным), без стандартной библиотеки:"]
+        own = [(code, count) for code, count in self._stack.most_common()
+               if not code.co_filename.startswith(_STDLIB_DIR) or "site-packages" in code.co_filename]
+        for code, count in own[:top]:
+            lines.append(f"{count / n:6.1%}  {_frame_label(code)}")
+
+        lines += ["", "Память (tracemalloc): прирост / блоков / где"]
+        for stat in allocs[:top]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size_diff / 1024:+9.0f} KiB {stat.count_diff:+8} "
+                         f"{os.path.basename(frame.filename)}:{frame.lineno}")
+        return "\n".join(lines)
+
+
+PROFILER = Profiler()
+
+
+async def _profile_and_report(m: Message, seconds: int) -> None:
+    try:
+        await asyncio.wait_for(PROFILER.stop_early.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+    try:
+        report, files = await PROFILER.stop()
+    except Exception as e:
+        logger.exception("profile failed")
+        await m.answer(f"Профиль не получился 😕 ({type(e).__name__}: {e})")
+        return
+    await send_long(m, report + "\n\nФайлы:\n" + "\n".join(files))
+
+
+@router.message(Command("profile"))
+async def profile_cmd(m: Message):
+    if m.from_user.id not in ADMIN_IDS:
+        return
+
+    arg = (m.text or "").partition(" ")[2].strip().lower()
+    if arg == "stop":
+        if PROFILER.running:
+            PROFILER.stop_early.set()
+        else:
+            await m.answer("Профиль сейчас не снимается.")
+        return
+    if PROFILER.running:
+        await m.answer("Профиль уже снимается. /profile stop — закончить раньше.")
+        return
+
+    seconds = int(arg) if arg.isdigit() else PROFILE_DEFAULT_SECONDS
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    PROFILER.start()
+    PROFILER.task = asyncio.create_task(_profile_and_report(m, seconds))
+    await m.answer(f"⏱ Снимаю профиль {seconds} с (pid {os.getpid()}). /profile stop — закончить раньше.")
+
+
+# ===================== Webhook =====================
+def webhook_secret() -> str:
+    """Секрет для X-Telegram-Bot-Api-Secret-Token: из WEBHOOK_SECRET или из токена бота."""
+    secret = WEBHOOK_SECRET or hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()
+    # Telegram принимает только A-Z, a-z, 0-9, _ и -, до 256 символов
+    if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", secret):
+        raise RuntimeError("WEBHOOK_SECRET: только A-Z, a-z, 0-9, _ и -, до 256 символов")
+    return secret
+
 
-    # следующий вопрос
-    await send_next_question(cb.message, state)
+class WebhookHandler(SimpleRequestHandler):
+    """
+    POST от Telegram -> Dispatcher. Чужие запросы (без нашего секрета) получают 401,
+    свои — сразу 200, а апдейт обрабатывается в фоне (или уходит в WorkerPool).
+    При остановке новые апдейты получают 503 (Telegram повторит их позже),
+    начатые дорабатывают до WEBHOOK_DRAIN_TIMEOUT.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str, pool: "WorkerPool | None" = None):
+        super().__init__(dispatcher, bot, secret_token=secret_token)
+        self.pool = pool
+        self.stopping = False
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._background_feed_update_tasks)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.stopping:
+            return web.Response(status=503, text="Shutting down")
+        return await super().handle(request)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        if self.pool is None:
+            return await super()._handle_request_background(bot, request)
+        self.pool.dispatch(await request.read())
+        return web.json_response({})
+
+    async def healthz(self, request: web.Request) -> web.Response:
+        ok = not self.stopping and bool(VOCAB) and (self.pool is None or self.pool.alive())
+        return web.json_response(
+            {"ok": ok, "vocab": len(VOCAB), "in_flight": self.in_flight},
+            status=200 if ok else 503,
+        )
+
+    async def close(self) -> None:
+        self.stopping = True
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            _done, pending = await asyncio.wait(tasks, timeout=WEBHOOK_DRAIN_TIMEOUT)
+            if pending:
+                logger.warning("Webhook: не дождались %d апдейтов при остановке", len(pending))
+        await super().close()
+
+
+def build_webhook_app(
+    dp: Dispatcher, bot: Bot, secret: str, pool: "WorkerPool | None" = None
+) -> tuple[web.Application, WebhookHandler]:
+    app = web.Application()
+    handler = WebhookHandler(dp, bot, secret, pool)
+    handler.register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/healthz", handler.healthz)
+    setup_application(app, dp, bot=bot)
+    return app, handler
+
+
+async def wait_for_stop_signal() -> None:
+    """Ждёт SIGTERM/SIGINT (на Windows сигналов в loop нет — там останется KeyboardInterrupt)."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    installed = []
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+            installed.append(sig)
+        except NotImplementedError:
+            pass
+    try:
+        await stop.wait()
+    finally:
+        for sig in installed:
+            loop.remove_signal_handler(sig)
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, pool: "WorkerPool | None" = None) -> None:
+    """Слушает WEBHOOK_HOST:PORT до SIGTERM/SIGINT, потом плавно останавливается."""
+    secret = webhook_secret()
+    app, handler = build_webhook_app(dp, bot, secret, pool)
+    runner = web.AppRunner(app, shutdown_timeout=WEBHOOK_DRAIN_TIMEOUT)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        # вебхук при остановке не снимаем: пока процесс перезапускается,
+        # Telegram копит апдейты и потом пришлёт их заново
+        await bot.set_webhook(
+            WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        logger.info("Webhook %s%s, слушаю %s:%s", WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT)
+        await wait_for_stop_signal()
+    finally:
+        handler.stopping = True  # /healthz сразу 503 — прокси перестаёт слать сюда
+        await runner.cleanup()
+
+
+# ===================== Worker pool =====================
+def update_user_id(update: Mapping[str, Any]) -> int:
+    """Автор апдейта (для постов в канале, где его нет, — чат) по сырому JSON от Telegram."""
+    for body in update.values():
+        if not isinstance(body, dict):
+            continue
+        user = body.get("from")
+        if user:
+            return user["id"]
+        chat = body.get("chat") or (body.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return 0
+
+
+class WorkerPool:
+    """
+    WORKERS процессов-обработчиков за одним приёмником (webhook или getUpdates).
+
+    Апдейт уходит в процесс по user_id автора через кольцо консистентного хеширования:
+    апдейты одного пользователя всегда попадают в один процесс и идут по порядку, а при
+    смене WORKERS переезжает только ~1/N пользователей. Поэтому то, что процесс держит
+    о пользователе в памяти, — колода /review, его /stats, лимиты — есть только у него
+    и не расходится с другими процессами. FSM, переводы, повторение и журнал ответов
+    пишутся в общую SQLite (WAL); общее на всех (/hard) читается оттуда же.
+
+    Ограничение: в группе сообщения разных участников обрабатываются в разных
+    процессах, и порядок между ними не гарантирован (у каждого — сохраняется).
+    Бюджет отправки в группу тоже делится между процессами поровну (см. run_worker).
+
+    Процессы создаются fork-ом после загрузки словаря, так что VOCAB и индексы
+    не копируются: страницы общие, пока их не меняют. gc.freeze() перед fork
+    убирает уже созданные объекты из-под сборщика мусора — иначе его проходы
+    трогают каждый объект и копируют страницы в каждый процесс.
+
+    Поэтому словарь перечитывает только приёмник (он же следит за файлом, /reload
+    из процесса приходит сюда же через общую очередь control), а процессы после
+    этого заменяются новыми, форкнутыми уже со свежим словарём (rotate): копия
+    словаря в памяти по-прежнему одна на всех. Старые процессы доделывают начатое,
+    пишут в SQLite всё, что держали в памяти, и выходят; новые стартуют только
+    после этого, а апдейты тем временем копятся в их очередях.
+    """
+
+    def __init__(self, n: int, make_bot: Callable[[], Bot] | None = None, vnodes: int = WORKER_VNODES):
+        self.n = n
+        self.make_bot = make_bot or (lambda: Bot(BOT_TOKEN))
+        ring = sorted((self._hash(f"worker{i}:{v}"), i) for i in range(n) for v in range(vnodes))
+        self._points = [h for h, _i in ring]
+        self._owners = [i for _h, i in ring]
+        self.queues: list = []
+        self.ready: list = []
+        self.processes: list[multiprocessing.Process] = []
+        self.dispatched = [0] * n
+        self.control = None  # процессы -> приёмник: запросы /reload
+        self._reload_lock = asyncio.Lock()
+        self._rotating = False
+        self._tasks: set[asyncio.Task] = set()
+        self._listener: threading.Thread | None = None
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def worker_for(self, user_id: int) -> int:
+        i = bisect_left(self._points, self._hash(str(user_id)))
+        return self._owners[i % len(self._owners)]
+
+    def start(self) -> None:
+        ctx = multiprocessing.get_context("fork")
+        self.control = ctx.Queue()
+        self.queues = [ctx.Queue() for _ in range(self.n)]
+        self._fork()
+
+    def _fork(self) -> None:
+        """Процессы на текущие self.queues — с тем словарём, что сейчас в памяти."""
+        ctx = multiprocessing.get_context("fork")
+        # прошлый словарь (если это rotate) уже не нужен — выпускаем его к сборщику
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+        self.ready, self.processes = [], []
+        for i, q in enumerate(self.queues):
+            ready = ctx.Event()
+            p = ctx.Process(
+                target=_worker_main, args=(i, self.n, q, self.control, ready, self.make_bot),
+                name=f"bot-worker-{i}",
+            )
+            p.start()
+            self.ready.append(ready)
+            self.processes.append(p)
+
+    def wait_ready(self, timeout: float = WORKER_START_TIMEOUT) -> bool:
+        deadline = time.monotonic() + timeout
+        return all(e.wait(max(0.0, deadline - time.monotonic())) for e in self.ready)
+
+    def alive(self) -> bool:
+        # пока процессы меняются, апдейты ждут в очередях — это не авария
+        return self._rotating or all(p.is_alive() for p in self.processes)
+
+    def dispatch(self, raw: bytes) -> None:
+        """Сырой JSON апдейта -> очередь его процесса (не блокирует: пишет поток очереди)."""
+        k = self.worker_for(update_user_id(json.loads(raw)))
+        self.dispatched[k] += 1
+        self.queues[k].put(raw)
+
+    def listen(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Поток, который читает control и передаёт сообщения в event loop приёмника."""
+        def reader() -> None:
+            while (msg := self.control.get()) is not None:
+                loop.call_soon_threadsafe(self._on_control, msg)
+
+        self._listener = threading.Thread(target=reader, name="pool-control", daemon=True)
+        self._listener.start()
+
+    def _on_control(self, msg: tuple) -> None:
+        if msg[0] == "reload":  # ("reload", процесс, token, rebuild) — /reload в процессе
+            _kind, index, token, rebuild = msg
+            task = asyncio.create_task(self._serve_reload(index, token, rebuild))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _serve_reload(self, index: int, token: int, rebuild: bool) -> None:
+        # ответ уходит до замены процессов: в очередь того, где ждёт хендлер /reload
+        def loaded(elapsed: float) -> None:
+            self.queues[index].put(("reply", token, elapsed, len(VOCAB), VOCAB_VERSION, None))
+
+        try:
+            await self.reload_all(rebuild, loaded)
+        except Exception as e:
+            logger.exception("vocab reload failed")
+            self.queues[index].put(("reply", token, 0.0, 0, 0, f"{type(e).__name__}: {e}"))
+
+    async def reload_all(
+        self, rebuild: bool = False, loaded: Callable[[float], None] | None = None,
+    ) -> tuple[float, dict[int, str]]:
+        """
+        Перечитывает словарь здесь (заодно пишет снимок) и меняет процессы на новые
+        (rotate). loaded(секунд) зовётся, когда словарь готов, до замены процессов.
+        -> (секунд всего, {процесс: ошибка} для не запустившихся)
+        """
+        async with self._reload_lock:
+            t0 = time.perf_counter()
+            await reload_vocab(rebuild)
+            if loaded is not None:
+                loaded(time.perf_counter() - t0)
+            failed = await self.rotate()
+        if failed:
+            logger.warning("workers failed to restart after vocab reload: %s", failed)
+        return time.perf_counter() - t0, failed
+
+    async def rotate(self) -> dict[int, str]:
+        """
+        Старые процессы — доделать начатое и выйти, на их место — fork с текущим словарём.
+        Апдейты сразу идут в очереди новых и ждут там. -> {процесс: ошибка} для не запустившихся
+        """
+        old_queues, old_processes = self.queues, self.processes
+        ctx = multiprocessing.get_context("fork")
+        self._rotating = True
+        try:
+            self.queues = [ctx.Queue() for _ in range(self.n)]
+            for q in old_queues:
+                q.put(None)
+            # новые — только когда старые записали своё (колоды /review, журнал, FSM)
+            await asyncio.to_thread(self._stop, old_processes, old_queues)
+            self._fork()
+            await asyncio.to_thread(self.wait_ready)
+        finally:
+            self._rotating = False
+        return {
+            i: f"не запустился за {WORKER_START_TIMEOUT:.0f}s"
+            for i, (p, ready) in enumerate(zip(self.processes, self.ready))
+            if not ready.is_set() or not p.is_alive()
+        }
+
+    @staticmethod
+    def _stop(processes: list, queues: list, timeout: float = WEBHOOK_DRAIN_TIMEOUT + 5) -> None:
+        deadline = time.monotonic() + timeout
+        for p in processes:
+            p.join(max(0.0, deadline - time.monotonic()))
+            if p.is_alive():
+                logger.warning("%s не остановился за %.0fs, terminate", p.name, timeout)
+                p.terminate()
+                p.join()
+        for q in queues:
+            q.close()
+            q.join_thread()
+
+    def close(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT + 5) -> None:
+        """Просит процессы доделать начатое и выйти; кто не успел — terminate."""
+        for q in self.queues:
+            q.put(None)
+        self._stop(self.processes, self.queues, timeout)
+        if self.control is not None:
+            self.control.put(None)
+            if self._listener is not None:
+                self._listener.join()
+            self.control.close()
+            self.control.join_thread()
+
+
+class WorkerControl:
+    """Сторона процесса-обработчика: /reload через приёмник."""
+
+    def __init__(self, index: int, n: int, control):
+        self.index = index
+        self.n = n
+        self.control = control
+        self._token = 0
+        self._pending: dict[int, asyncio.Future] = {}
+
+    async def request_reload(self, rebuild: bool) -> tuple[float, int, int]:
+        """
+        Просит приёмник перечитать словарь; ждёт, пока он его загрузит (процессы
+        после этого меняются, и этот тоже). -> (секунд, слов, версия словаря)
+        """
+        self._token += 1
+        token = self._token
+        fut = self._pending[token] = asyncio.get_running_loop().create_future()
+        self.control.put(("reload", self.index, token, rebuild))
+        try:
+            elapsed, words, version, error = await asyncio.wait_for(fut, WORKER_RELOAD_TIMEOUT)
+        finally:
+            self._pending.pop(token, None)
+        if error:
+            raise RuntimeError(error)
+        return elapsed, words, version
+
+    def on_message(self, msg: tuple) -> None:
+        if msg[0] == "reply":  # ("reply", token, elapsed, words, version, error) — итог нашего /reload
+            fut = self._pending.get(msg[1])
+            if fut is not None and not fut.done():
+                fut.set_result(msg[2:])
+
+
+WORKER_CONTROL: WorkerControl | None = None  # есть только в процессах WorkerPool
+
+
+def _worker_main(index: int, n: int, q, control, ready, make_bot: Callable[[], Bot]) -> None:
+    # Ctrl+C / SIGTERM ловит приёмник и сам останавливает процессы через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    # после rotate fork идёт из работающего loop приёмника — его wakeup fd нам не нужен
+    signal.set_wakeup_fd(-1)
+    asyncio.run(run_worker(index, n, q, control, ready, make_bot))
+
+
+async def run_worker(index: int, n: int, q, control, ready, make_bot: Callable[[], Bot]) -> None:
+    global WORKER_CONTROL
+    # общий лимит Bot API на бота делится между процессами; лимит группы — тоже:
+    # её участники раздаются по разным процессам
+    SEND_SCHEDULER.global_bucket = TokenBucket(SEND_GLOBAL_RATE / n, max(1.0, SEND_GLOBAL_BURST / n))
+    SEND_SCHEDULER.groups = RateLimiter(SEND_GROUP_RATE / n, max(1.0, SEND_GROUP_BURST / n))
+    # за файлом словаря следит приёмник, перечитывать велит он же
+    WORKER_CONTROL = WorkerControl(index, n, control)
+    services = await start_services(METRICS_PORT + 1 + index if METRICS_PORT else 0, watch=False)
+    bot = make_bot()
+    bot.session.middleware(SEND_SCHEDULER)
+    dp = create_dispatcher()
+
+    loop = asyncio.get_running_loop()
+    stopped = loop.create_future()
+    tasks: set[asyncio.Task] = set()
+
+    async def process(raw: bytes) -> None:
+        try:
+            await dp.feed_raw_update(bot, json.loads(raw))
+        except Exception:
+            logger.exception("worker %d: update failed", index)
+
+    def feed(raw: bytes | tuple | None) -> None:
+        if raw is None:
+            if not stopped.done():
+                stopped.set_result(None)
+            return
+        if isinstance(raw, tuple):  # служебное от приёмника
+            WORKER_CONTROL.on_message(raw)
+            return
+        task = asyncio.create_task(process(raw))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    def reader() -> None:
+        parent = os.getppid()
+        while True:
+            try:
+                raw = q.get(timeout=1.0)
+            except QueueEmpty:
+                if os.getppid() == parent:
+                    continue
+                raw = None  # приёмник умер, не попрощавшись
+            loop.call_soon_threadsafe(feed, raw)
+            if raw is None:
+                return
+
+    threading.Thread(target=reader, name=f"worker-{index}-queue", daemon=True).start()
+    ready.set()
+    try:
+        await stopped
+        if tasks:
+            await asyncio.wait(set(tasks), timeout=WEBHOOK_DRAIN_TIMEOUT)
+    finally:
+        await bot.session.close()
+        await dp.storage.close()
+        await stop_services(services)
+
+
+async def poll_into_pool(bot: Bot, dp: Dispatcher, pool: WorkerPool) -> None:
+    """Приёмник без вебхука: getUpdates и раздача апдейтов по процессам."""
+    await bot.delete_webhook()
+    allowed = dp.resolve_used_update_types()
+
+    async def poll() -> None:
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("getUpdates failed")
+                await asyncio.sleep(1)
+                continue
+            for upd in updates:
+                pool.dispatch(upd.model_dump_json(by_alias=True, exclude_unset=True).encode())
+                offset = upd.update_id + 1
+
+    poller = asyncio.create_task(poll())
+    stop = asyncio.create_task(wait_for_stop_signal())
+    try:
+        await asyncio.wait((poller, stop), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        poller.cancel()
+        stop.cancel()
+
+
+async def receive_into_pool(pool: WorkerPool) -> None:
+    if not await asyncio.to_thread(pool.wait_ready):
+        raise RuntimeError("worker processes did not start")
+    # приёмник сам в чаты не пишет; Dispatcher нужен для allowed_updates и webhook-хендлера
+    bot = Bot(BOT_TOKEN)
+    dp = Dispatcher()
+    dp.include_router(router)
+
+    def collect_pool() -> Iterable[tuple[str, str, tuple, float]]:
+        for i, n in enumerate(pool.dispatched):
+            yield "bot_pool_dispatched_total", "counter", (("worker", i),), n
+
+    # хендлеры здесь не работают (их метрики — у процессов, METRICS_PORT+1..N) — отдаём раздачу
+    METRICS.collectors[:] = [collect_pool]
+    pool.listen(asyncio.get_running_loop())
+    tasks = []
+    if METRICS_PORT and (metrics := await start_metrics(METRICS_HOST, METRICS_PORT)):
+        tasks.append(metrics)
+    if VOCAB_WATCH_INTERVAL > 0:
+        tasks.append(asyncio.create_task(watch_vocab(VOCAB_WATCH_INTERVAL, pool.reload_all)))
+    try:
+        if WEBHOOK_URL:
+            await run_webhook(bot, dp, pool)
+        else:
+            await poll_into_pool(bot, dp, pool)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await bot.session.close()
+
+
+def run_worker_pool(n: int) -> None:
+    if not BOT_TOKEN:
+        raise RuntimeError("BOT_TOKEN not set in .env (BOT_TOKEN=...)")
+    # словарь грузится до fork — процессы получают его готовым
+    asyncio.run(reload_vocab())
+    pool = WorkerPool(n)
+    pool.start()
+    try:
+        asyncio.run(receive_into_pool(pool))
+    finally:
+        pool.close()
 
 
 # ===================== main =====================
-async def main():
-    global VOCAB, VOCAB_BY_ID
+async def start_services(metrics_port: int = METRICS_PORT, watch: bool = True) -> list[asyncio.Task]:
+    """HTTP-сессия, SQLite-кэши, /metrics и фоновые задачи; закрываются в stop_services."""
+    global HTTP_SESSION
+    HTTP_SESSION = create_http_session()
+    TR_CACHE.open(DB_PATH)
+    REVIEW.open(DB_PATH)
+    ANSWER_LOG.open(DB_PATH)
+    VOCAB_TR.update(await asyncio.to_thread(load_vocab_translations, DB_PATH))
+
+    tasks = [asyncio.create_task(REVIEW.run_flusher()), asyncio.create_task(ANSWER_LOG.run())]
+    if watch and VOCAB_WATCH_INTERVAL > 0:
+        tasks.append(asyncio.create_task(watch_vocab(VOCAB_WATCH_INTERVAL)))
+    if metrics_port and (metrics := await start_metrics(METRICS_HOST, metrics_port)):
+        tasks.append(metrics)
+    return tasks
+
+
+async def stop_services(tasks: list[asyncio.Task]) -> None:
+    for task in tasks:
+        task.cancel()
+    await close_http_session()
+    await REVIEW.close()
+    await ANSWER_LOG.close()
+    TR_CACHE.close()
+
+
+def create_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=create_fsm_storage())
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    dp.include_router(router)
+    return dp
 
+
+async def main():
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN not set in .env (BOT_TOKEN=...)")
 
-    VOCAB = load_vocab_openpyxl(FILE_PATH, SHEET_NAME)
-    VOCAB_BY_ID = {int(it["ID"]): it for it in VOCAB}
+    await reload_vocab()
+    services = await start_services()
 
     bot = Bot(BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
-    dp.include_router(router)
-    await dp.start_polling(bot)
+    bot.session.middleware(SEND_SCHEDULER)
+    dp = create_dispatcher()
+    try:
+        if WEBHOOK_URL:
+            await run_webhook(bot, dp)
+        else:
+            # вебхук, оставшийся от запуска в webhook-режиме, не даёт вызывать getUpdates
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await dp.storage.close()
+        await stop_services(services)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--compile-vocab",
+        action="store_true",
+        help="собрать снимок vocab.xlsx (для деплоя) и выйти",
+    )
+    parser.add_argument(
+        "--pretranslate",
+        action="store_true",
+        help="перевести все слова из Excel на армянский заранее (можно прерывать и продолжать)",
+    )
+    parser.add_argument(
+        "--with-definitions",
+        action="store_true",
+        help="вместе с --pretranslate: переводить и DEFINITION",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.compile_vocab:
+        compile_vocab_snapshot()
+    elif args.pretranslate:
+        asyncio.run(pretranslate_vocab(with_definitions=args.with_definitions))
+    elif WORKERS > 1:
+        run_worker_pool(WORKERS)
+    else:
+        asyncio.run(main())
 # 
\ No newline at end of file